@@ -1,8 +1,50 @@
 import argparse
+import os
 import sys
 
 import bakrep
 import bakrep.download
+import bakrep.progress
+import bakrep.scheduler
+import bakrep.summarize
+
+
+def _size(value: str) -> int:
+    """
+    Parses a size in bytes with an optional K, M or G suffix (base 1024)
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    v = value.strip().upper().removesuffix("B")
+    factor = 1
+    if v[-1:] in units:
+        factor = units[v[-1]]
+        v = v[:-1]
+    try:
+        size = int(float(v) * factor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{value}'")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive: '{value}'")
+    return size
+
+
+def _duration(value: str) -> float:
+    """
+    Parses a duration in seconds with an optional s, m, h or d suffix
+    """
+    units = {"S": 1, "M": 60, "H": 3600, "D": 86400}
+    v = value.strip().upper()
+    factor = 1
+    if v[-1:] in units:
+        factor = units[v[-1]]
+        v = v[:-1]
+    try:
+        duration = float(v) * factor
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: '{value}'")
+    if duration < 0:
+        raise argparse.ArgumentTypeError(f"duration must not be negative: '{value}'")
+    return duration
 
 
 def entrypoint():
@@ -23,11 +65,17 @@ def main(argv):
     parser.add_argument('--version', action='version', version=f'%(prog)s {bakrep.__version__}')
 
     sub_parsers = parser.add_subparsers(title="actions", required=True, )
-    download_parser = sub_parsers.add_parser('download')
+    download_parser = sub_parsers.add_parser('download', help="Download datasets")
+    download_parser.set_defaults(check=bakrep.download.check_args, run=bakrep.download.download)
     input_group = download_parser.add_argument_group("input", )
     input_group.add_argument(
         '-t', '--tsv',
-        help="A tsv with the datasets ids to download. The dataset ids are extracted from the first column."
+        help="A tsv with the datasets ids to download, optionally gzip compressed. Use '-' to read from stdin. The dataset ids are extracted from the first column, see --id-column."
+    )
+    input_group.add_argument(
+        '--id-column',
+        default="1",
+        help="Index (starting at 1) or header name of the tsv column with the dataset ids. (default %(default)s)"
     )
     input_group.add_argument(
         '-e', '--entries',
@@ -45,6 +93,19 @@ def main(argv):
         default=False,
         help="Save all datasets to the download directory without any group directories. (default=off)"
     )
+    output_group.add_argument(
+        '--decompress',
+        action="store_true",
+        default=False,
+        help="""Decompress the gzip compressed result files while they are downloaded and save them without '.gz'.
+          The md5 sums are still verified on the compressed data. (default=off)"""
+    )
+    output_group.add_argument(
+        '--pack',
+        type=_size,
+        help="""Stream the result files into tar archives of about this size, e.g. 4G, instead of single files.
+          Every archive has an index with the id, file, offset, length and md5 of its members."""
+    )
 
     filters_group = download_parser.add_argument_group("filters")
     filters_group.add_argument(
@@ -52,28 +113,227 @@ def main(argv):
         dest="filters",
         action="append",
         help="""Only download result files that match the attribute-filter. Can be provided multiple times.
+          A result file is downloaded when it matches all conditions of any filter.
           Example: '-m tool:bakta,filetype:gff3'.
+          Conditions can list alternatives (tool:bakta|gtdbtk), use glob patterns (filetype:g*)
+          or be negated (filetype!=json).
           Currently known attributes and values are:
-            tool:bakta|checkm2|gtdbtk|assemblyscan,
+            tool:bakta|checkm2|gtdbtk|assemblyscan|mlst,
             filetype:json|ffn|faa|gff3|gbff,
             type: qc|annotation|taxonomy
           """
     )
 
     download_group = download_parser.add_argument_group("download")
+    download_group.add_argument(
+        '--plan', '--dry-run',
+        dest="plan",
+        action="store_true",
+        default=False,
+        help="""Only resolve the manifests and report the size of the selected result files per tool and filetype,
+          what is already present, an estimate of the duration based on a small sample download and whether
+          the directory has enough free space. Fails when the space is not sufficient. (default=off)"""
+    )
+    download_group.add_argument(
+        '--api-url',
+        default="https://bakrep.computational.bio/api/v1/datasets/",
+        help="Base url of the BakRep datasets api, e.g. for a mirror. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--shard',
+        help="""Only download the datasets of shard K of N, e.g. 2/4, to split a job across nodes.
+          The datasets are assigned by a hash of their id, so every node can get the same input
+          and output directory. See 'bakrep progress' for the progress of all shards."""
+    )
     download_group.add_argument(
         '-r', '--restart',
         action="store_true",
         default=False,
-        help="""Do not resume previous download, but download everything again."""
+        help="""Do not resume previous download, but check all datasets again.
+          Result files that are already present and match the manifest are not downloaded again."""
+    )
+    download_group.add_argument(
+        '--sync',
+        action="store_true",
+        default=False,
+        help="""Update a previous download: check the manifests of all datasets again and only download the result files
+          that are new or changed since they were downloaded. Unlike --restart, the md5 sums recorded at download time are
+          compared with the manifest instead of reading the present files. Without --tsv and --entries, the datasets of the
+          previous run are used. Not available with --pack. (default=off)"""
+    )
+    download_group.add_argument(
+        '--prune',
+        action="store_true",
+        default=False,
+        help="With --sync, remove the downloaded result files that are no longer in the manifest of their dataset. (default=off)"
+    )
+    download_group.add_argument(
+        '--retry-failed',
+        action="store_true",
+        default=False,
+        help="""Only download the datasets that failed in a previous run with a retryable error, like a timeout or server error.
+          Permanent errors like 404 are not retried. Without --tsv and --entries, the datasets of the previous run are used. (default=off)"""
+    )
+    download_group.add_argument(
+        '--cool-down',
+        type=_duration,
+        default="15m",
+        help="With --retry-failed, skip the datasets that failed less than this long ago. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=1,
+        help="""Maximum number of result files that are downloaded in parallel.
+          Fewer downloads run while the server throttles requests. (default %(default)s)"""
+    )
+    download_group.add_argument(
+        '--manifest-workers',
+        type=int,
+        default=2,
+        help="Number of dataset manifests that are resolved in parallel ahead of the downloads. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--queue-size',
+        type=int,
+        help="Number of result files that may wait for a download worker. (default 4 * WORKERS)"
+    )
+    download_group.add_argument(
+        '--order',
+        choices=bakrep.scheduler.SCHEDULERS,
+        default="input",
+        help="""Order of the datasets: as in the input, smallest or largest first by the size of the selected result files,
+          or interleaved by id prefix group. Ordering by size resolves the pending manifests first.
+          Largest first keeps the workers busy until the end of the job. (default %(default)s)"""
+    )
+    download_group.add_argument(
+        '--limit-rate',
+        type=_size,
+        help="Limit the total download rate of all workers to this many bytes per second, e.g. 500K or 10M."
+    )
+    download_group.add_argument(
+        '--latency-threshold',
+        type=_duration,
+        help="""Also reduce the number of concurrent requests when the response latency rises to twice its long term average
+          and above this duration, e.g. 5s. Without it, only throttling responses (429, 503) reduce it. (default off)"""
+    )
+    download_group.add_argument(
+        '--retries',
+        type=int,
+        default=3,
+        help="Number of retries for each manifest and result file after timeouts, server errors or corrupt transfers. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--retry-backoff',
+        type=_duration,
+        default="1s",
+        help="""Base delay between retries. The n-th retry waits a random time of up to BACKOFF * 2^n,
+          or as long as the server requests with Retry-After. (default %(default)s)"""
+    )
+    download_group.add_argument(
+        '--max-backoff',
+        type=_duration,
+        default="60s",
+        help="Upper limit for the random delay between retries. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--timeout',
+        type=_duration,
+        default="60s",
+        help="Abort a request when the server does not send data for this long. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--buffer-size',
+        type=_size,
+        default="64K",
+        help="Size of the chunks that are streamed to disk, e.g. 64K or 1M. (default %(default)s)"
+    )
+    download_group.add_argument(
+        '--manifest-cache',
+        help="""Cache the dataset manifests in this directory, one file per dataset. Can be shared between download directories.
+          Without it, manifests are only cached with a --manifest-ttl or an order by size, in DIRECTORY/.progress/manifests."""
+    )
+    download_group.add_argument(
+        '--manifest-ttl',
+        type=_duration,
+        default="0",
+        help="""Use cached manifests for this long without asking the server, e.g. 30m or 7d.
+          Older manifests are revalidated with conditional requests. (default %(default)s)"""
+    )
+
+    download_group.add_argument(
+        '--cache-dir',
+        help="""Directory of a cache for result files that can be shared between downloads and processes.
+          Cached files are reflinked, hardlinked or copied into the output instead of downloading them again."""
+    )
+    download_group.add_argument(
+        '--cache-size',
+        type=_size,
+        help="Remove the least recently used files when the cache grows beyond this size, e.g. 100G. (default unlimited)"
+    )
+
+    report_group = download_parser.add_argument_group("reporting")
+    report_group.add_argument(
+        '--events',
+        help="Append the manifest, file, retry and dataset events of the run to this file as JSON lines."
+    )
+    report_group.add_argument(
+        '--metrics',
+        help="Write the metrics of the run to this file in the Prometheus textfile format."
+    )
+    report_group.add_argument(
+        '--changeset',
+        help="With --sync, write the result files that were added, changed or removed to this file as tsv."
+    )
+
+    progress_parser = sub_parsers.add_parser(
+        'progress', help="Show the progress of a download, merged over all shards")
+    progress_parser.set_defaults(check=bakrep.progress.check_args, run=bakrep.progress.progress)
+    progress_parser.add_argument(
+        '-d', '--directory',
+        default="./",
+        help="The target directory of the download. (default %(default)s)"
+    )
+    progress_parser.add_argument(
+        '-l', '--list',
+        choices=bakrep.progress.STATES,
+        help="Print the ids of the datasets in this state instead of the counts, e.g. to download the failed datasets again."
+    )
+    progress_parser.add_argument(
+        '--failures',
+        action="store_true",
+        default=False,
+        help="""Print the last failure of every failed dataset as tsv: the url, status code, error class, whether it is retryable,
+          the number of attempts and the time."""
+    )
+
+    summarize_parser = sub_parsers.add_parser(
+        'summarize', help="Extract the checkm2, gtdbtk, mlst and assemblyscan results of a download into one table")
+    summarize_parser.set_defaults(check=bakrep.summarize.check_args, run=bakrep.summarize.summarize)
+    summarize_parser.add_argument(
+        '-d', '--directory',
+        default="./",
+        help="The target directory of the download. (default %(default)s)"
+    )
+    summarize_parser.add_argument(
+        '-o', '--output',
+        required=True,
+        help="""The table to write, an SQLite database with a summary table for .sqlite or .db, otherwise a tsv.
+          Only new and changed datasets are parsed again."""
+    )
+    summarize_parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes that parse the result files. (default number of CPUs)"
     )
 
     args = parser.parse_args(argv)
 
-    check = bakrep.download.check_args(args)
+    check = args.check(args)
     if not check is None:
         parser.error(check)
-    bakrep.download.download(args)
+    args.run(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+import collections
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from bakrep.model import DownloadListener, DownloadSet, Result
+
+
+def _format_bytes(n: float):
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(n) < 1024 or unit == "TiB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def _format_duration(seconds: Optional[float]):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class ConsoleOutput(DownloadListener):
+    """
+    Renders the progress of a download.
+
+    The workers only update counters; a background thread redraws the
+    progress block every interval seconds. When the stream is not a terminal,
+    a plain summary line is printed every plain_interval seconds instead and
+    errors are printed as they occur.
+
+    The ETA is based on the manifest sizes: the pending bytes of resolved
+    datasets plus the average size of a resolved dataset for every dataset
+    whose manifest was not resolved yet.
+    """
+
+    max_messages = 1
+    max_error_messages = 5
+    max_transfers = 5
+    rate_window = 10.0
+
+    def __init__(self, download_set: DownloadSet, stream: Optional[TextIO] = None, interval: float = 0.5,
+                 plain_interval: float = 30.0, tty: Optional[bool] = None):
+        self.download_set = download_set
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty() if tty is None else tty
+        self.interval = interval if self.tty else plain_interval
+        self.messages: List[str] = []
+        self.error_messages: List[str] = []
+        self.lastlines = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pending_datasets = download_set.total_datasets() - download_set.downloaded_datasets()
+        self._resolved_datasets = 0
+        self._resolved_bytes = 0
+        self._done_bytes = 0
+        self._transferred_bytes = 0
+        self._files = 0
+        self._in_flight: Dict[Tuple[str, str], List[int]] = {}
+        self._samples: collections.deque = collections.deque()
+        self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bakrep-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.print_progress()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.print_progress()
+
+    def print_message(self, msg: str):
+        with self._lock:
+            self.messages.append(msg)
+            if len(self.messages) > self.max_messages:
+                self.messages = self.messages[-self.max_messages:]
+
+    def print_error_message(self, msg: str):
+        with self._lock:
+            self.error_messages.append(msg)
+            if len(self.error_messages) > self.max_error_messages:
+                self.error_messages = self.error_messages[-self.max_error_messages:]
+            if not self.tty:
+                print(msg, file=self.stream, flush=True)
+
+    def dataset_resolved(self, id: str, results: List[Result]):
+        with self._lock:
+            self._resolved_datasets += 1
+            self._resolved_bytes += sum(r.size for r in results)
+
+    def transfer_started(self, id: str, res: Result):
+        with self._lock:
+            self._in_flight[(id, res.filename())] = [res.size, 0]
+
+    def transfer_progress(self, id: str, res: Result, nbytes: int):
+        with self._lock:
+            self._transferred_bytes += nbytes
+            transfer = self._in_flight.get((id, res.filename()))
+            if transfer is not None:
+                transfer[1] += nbytes
+
+    def transfer_finished(self, id: str, res: Result, nbytes: int, duration: float):
+        with self._lock:
+            self._in_flight.pop((id, res.filename()), None)
+            self._done_bytes += res.size
+            self._files += 1
+
+    def transfer_skipped(self, id: str, res: Result):
+        with self._lock:
+            self._done_bytes += res.size
+
+    def transfer_cached(self, id: str, res: Result):
+        self.transfer_skipped(id, res)
+
+    def transfer_failed(self, id: str, res: Result, error: Exception):
+        with self._lock:
+            self._in_flight.pop((id, res.filename()), None)
+
+    def _sample(self):
+        now = time.monotonic()
+        self._samples.append((now, self._transferred_bytes, self._files))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.rate_window:
+            self._samples.popleft()
+
+    def _rates(self):
+        (t0, b0, f0) = self._samples[0]
+        (t1, b1, f1) = self._samples[-1]
+        if t1 - t0 <= 0:
+            return (0.0, 0.0)
+        return ((b1 - b0) / (t1 - t0), (f1 - f0) / (t1 - t0))
+
+    def _remaining_bytes(self):
+        remaining = max(0, self._resolved_bytes - self._done_bytes)
+        if self._resolved_datasets > 0:
+            unresolved = max(0, self._pending_datasets - self._resolved_datasets)
+            remaining += unresolved * self._resolved_bytes / self._resolved_datasets
+        # the transfers in flight are partially done
+        return max(0, remaining - sum(t[1] for t in self._in_flight.values()))
+
+    def summary(self):
+        ds = self.download_set
+        (byte_rate, file_rate) = self._rates()
+        eta = None
+        if byte_rate > 0 and self._resolved_datasets > 0:
+            eta = self._remaining_bytes() / byte_rate
+        return (f"Progress: {ds.downloaded_datasets()}/{ds.total_datasets()}, Failed: {ds.failed_datasets()}, "
+                f"{_format_bytes(self._transferred_bytes)}, {_format_bytes(byte_rate)}/s, "
+                f"{file_rate:.1f} files/s, ETA {_format_duration(eta)}, In flight: {len(self._in_flight)}")
+
+    def print_progress(self):
+        with self._lock:
+            self._sample()
+            if self.tty:
+                self._print_block()
+            else:
+                print(self.summary(), file=self.stream, flush=True)
+
+    def _print_block(self):
+        lines = [self.summary()]
+        for ((id, name), (size, done)) in list(self._in_flight.items())[:self.max_transfers]:
+            percent = 100 * done / size if size > 0 else 100
+            lines.append(f"  {name} {percent:.0f}%")
+        lines.extend(self.messages)
+        lines.append("")
+        lines.append("Latest Errors:")
+        lines.extend(self.error_messages)
+        out = ""
+        if self.lastlines > 0:
+            # move to the start of the previous block and clear it
+            out += f"\033[{self.lastlines}F\033[J"
+        out += "\n".join(lines) + "\n"
+        self.stream.write(out)
+        self.stream.flush()
+        self.lastlines = len(lines)
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Optional
+
+from bakrep.writers import CorruptResultError, ResultOutput, ResultWriter, _md5sum
+
+if TYPE_CHECKING:
+    from bakrep.model import Result
+
+_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS objects (
+    md5 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS objects_used ON objects (used);
+CREATE TABLE IF NOT EXISTS usage (total INTEGER NOT NULL);
+INSERT INTO usage SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM usage);
+CREATE TRIGGER IF NOT EXISTS objects_added AFTER INSERT ON objects BEGIN
+    UPDATE usage SET total = total + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_removed AFTER DELETE ON objects BEGIN
+    UPDATE usage SET total = total - old.size;
+END;
+COMMIT;
+"""
+
+
+class ContentCache:
+    """
+    A store of result files that is shared between download directories,
+    keyed by the md5 sum of the manifest.
+
+    Verified downloads are added while they are streamed. A cached file is
+    materialized into the output as a reflink, hardlink or copy, see
+    clone_file, or streamed into writers that can not link files.
+
+    The objects are listed in an SQLite index with their size and the time
+    they were last used. When the cache grows beyond max_size bytes, the
+    least recently used objects are removed. Files are moved into place
+    atomically and the index is changed in transactions, so several
+    processes can use a cache at the same time; an object that disappears
+    while it is used is a cache miss.
+    """
+
+    def __init__(self, directory: Path, max_size: Optional[int] = None, chunk_size: int = 64 * 1024):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self._tmp = self.directory / "tmp"
+        self._tmp.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # transactions are started explicitly
+        self._db = sqlite3.connect(str(self.directory / "index.sqlite"), timeout=60,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _path(self, md5: str):
+        return self.directory / "objects" / md5[:2] / md5
+
+    def _touch(self, md5: str, size: int):
+        with self._lock:
+            self._db.execute("INSERT INTO objects (md5, size, used) VALUES (?, ?, ?) "
+                             "ON CONFLICT (md5) DO UPDATE SET used = excluded.used", (md5, size, time.time()))
+
+    def get(self, md5: str, size: int) -> Optional[Path]:
+        """
+        Returns the path of a cached object and marks it as used
+        """
+        path = self._path(md5)
+        try:
+            actual = path.stat().st_size
+        except FileNotFoundError:
+            self.remove(md5)
+            return None
+        if actual != size:
+            self.remove(md5)
+            return None
+        self._touch(md5, size)
+        return path
+
+    def contains(self, md5: str, size: int):
+        """
+        Checks for an object without marking it as used
+        """
+        try:
+            return self._path(md5).stat().st_size == size
+        except FileNotFoundError:
+            return False
+
+    def remove(self, md5: str):
+        with self._lock:
+            self._path(md5).unlink(missing_ok=True)
+            self._db.execute("DELETE FROM objects WHERE md5 = ?", (md5,))
+
+    def add(self, md5: str, size: int, file: Path):
+        """
+        Moves a file into the cache and evicts old objects when it is full
+        """
+        path = self._path(md5)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(file, path)
+        self._touch(md5, size)
+        self._evict()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT total FROM usage").fetchone()[0]
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (total,) = self._db.execute("SELECT total FROM usage").fetchone()
+                while total > self.max_size:
+                    oldest = self._db.execute("SELECT md5, size FROM objects ORDER BY used LIMIT 100").fetchall()
+                    if len(oldest) == 0:
+                        break
+                    for (md5, size) in oldest:
+                        if total <= self.max_size:
+                            break
+                        self._path(md5).unlink(missing_ok=True)
+                        self._db.execute("DELETE FROM objects WHERE md5 = ?", (md5,))
+                        total -= size
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def restore(self, id: str, res: "Result", writer: ResultWriter, verify: bool = True):
+        """
+        Stores a cached result file with the writer. Returns False when the
+        file is not cached.
+        """
+        path = self.get(res.md5, res.size)
+        if path is None:
+            return False
+        try:
+            if verify and _md5sum(path, self.chunk_size).hexdigest() != res.md5:
+                self.remove(res.md5)
+                return False
+            if not writer.link(id, res, path):
+                self._copy(id, res, writer, path)
+        except FileNotFoundError:
+            # removed by another process in the meantime
+            return False
+        except CorruptResultError:
+            self.remove(res.md5)
+            return False
+        return True
+
+    def _copy(self, id: str, res: "Result", writer: ResultWriter, path: Path):
+        with open(path, "rb") as f, writer.open(id, res) as out:
+            out.reset()
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                out.write(chunk)
+            out.commit()
+
+    def output(self, res: "Result", out: ResultOutput) -> ResultOutput:
+        """
+        Wraps an output, so that the streamed file is added to the cache once
+        it is committed
+        """
+        return _CachingOutput(self, res, out)
+
+
+class _CachingOutput(ResultOutput):
+    def __init__(self, cache: ContentCache, res: "Result", out: ResultOutput):
+        self.cache = cache
+        self.res = res
+        self.out = out
+        self._enabled = True
+        self._file: Optional[IO[bytes]] = None
+        self._size = 0
+
+    def resume(self, verify: bool):
+        (offset, md5) = self.out.resume(verify)
+        # the cache only takes complete files
+        self._enabled = offset == 0
+        return (offset, md5)
+
+    def reset(self):
+        self.out.reset()
+        self._drop()
+        self._enabled = True
+
+    def write(self, chunk: bytes):
+        self.out.write(chunk)
+        if self._enabled:
+            f = self._file
+            if f is None:
+                f = self._file = tempfile.NamedTemporaryFile(dir=self.cache._tmp, delete=False)
+            f.write(chunk)
+            self._size += len(chunk)
+
+    def commit(self):
+        self.out.commit()
+        if not self._enabled or self._size != self.res.size:
+            return
+        f = self._file
+        if f is None:
+            # an empty file
+            f = self._file = tempfile.NamedTemporaryFile(dir=self.cache._tmp, delete=False)
+        f.close()
+        try:
+            self.cache.add(self.res.md5, self.res.size, Path(f.name))
+            self._file = None
+        except OSError:
+            # the download succeeded, a failure of the cache does not matter
+            pass
+
+    def _drop(self):
+        if self._file is not None:
+            self._file.close()
+            Path(self._file.name).unlink(missing_ok=True)
+            self._file = None
+        self._size = 0
+
+    def discard(self):
+        self.out.discard()
+        self._drop()
+
+    def close(self):
+        self.out.close()
+        self._drop()
@@ -1,67 +1,174 @@
+import gzip
+import io
+import itertools
+import sys
+import time
 from pathlib import Path
-from typing import List
-
-from bakrep.model import BakrepDownloader, DownloadFailedException, DownloadSet
+from typing import Iterable, Iterator, List, Optional, Union, cast
+
+from bakrep.console import ConsoleOutput
+from bakrep.content_cache import ContentCache
+from bakrep.filters import FilterParseError, Matcher
+from bakrep.manifest_cache import ManifestCache
+from bakrep.metrics import EventLog, Metrics
+from bakrep.model import BakrepDownloader, Dataset, DownloadFailedException, DownloadListener, DownloadSet, Result
+from bakrep.pipeline import DownloadPipeline
+from bakrep.plan import Plan, measure_throughput, report, resolve
+from bakrep.retry import RetryPolicy
+from bakrep.scheduler import Scheduler, resolve_sizes
+from bakrep.shard import Shard
+from bakrep.sync import Changeset, SyncWriter
+from bakrep.throttle import AdaptiveConcurrency, TokenBucket
+from bakrep.writers import DirectoryWriter, GunzipWriter, ResultWriter, TarShardWriter
 
 
 def check_args(args):
-    # tsv or entries must be present
-    if args.tsv is None and args.entries is None:
+    # tsv or entries must be present, unless the datasets of a previous run are retried or synced
+    if args.tsv is None and args.entries is None and not (args.retry_failed or args.sync):
         return "at least one of --tsv and --entries is required"
-    if not args.tsv is None:
+    if not args.tsv is None and args.tsv != "-":
         tsv_path = Path(args.tsv)
         if not tsv_path.exists():
             return "the tsv does not exist"
         if not tsv_path.is_file():
             return "the tsv is not a file"
+        column = _parse_id_column(args.id_column)
+        if isinstance(column, str):
+            lines = _read_tsv_lines(args.tsv)
+            try:
+                _find_column(lines, column)
+            except ValueError as e:
+                return str(e)
+            finally:
+                lines.close()
+    if args.id_column == "0":
+        return "the id column index starts at 1"
 
     output_path = Path(args.directory)
     if (output_path.exists() and not output_path.is_dir()):
         return "The output directory is a file. Delete it or use another output path."
+    try:
+        _parse_filters(args.filters)
+    except FilterParseError as e:
+        return str(e)
+    if args.workers < 1:
+        return "the number of workers must be at least 1"
+    if args.retries < 0:
+        return "the number of retries must not be negative"
+    if args.manifest_workers < 1:
+        return "the number of manifest workers must be at least 1"
+    if not args.queue_size is None and args.queue_size < 1:
+        return "the queue size must be at least 1"
+    if not args.cache_dir is None and Path(args.cache_dir).exists() and not Path(args.cache_dir).is_dir():
+        return "the cache directory is a file"
+    if not args.shard is None:
+        try:
+            Shard.parse(args.shard)
+        except ValueError as e:
+            return str(e)
+    if (args.prune or not args.changeset is None) and not args.sync:
+        return "--prune and --changeset require --sync"
+    if args.retry_failed and (args.sync or args.restart):
+        return "--retry-failed can not be combined with --sync or --restart"
+    if args.sync and not args.pack is None:
+        # the archives are only appended to, changed files would be added twice
+        return "--sync can not be combined with --pack"
     return None
 
 
 def _parse_entries(entries: str):
-    ids = []
-    s = entries.split(",")
-    for e in s:
+    for e in entries.split(","):
         id = e.strip()
         if len(id) > 0:
-            ids.append(e)
-    return ids
-
-
-def _parse_id_from_tsv_line(line: str):
+            yield id
+
+
+def _parse_id_column(column: str) -> Union[int, str]:
+    """
+    Parses a 1-based column index or a column name
+    """
+    if column.isdigit():
+        return int(column) - 1
+    return column
+
+
+def _read_tsv_lines(tsv_path: str):
+    """
+    Reads the lines of a plain or gzip compressed tsv, '-' reads from stdin
+    """
+    stdin = tsv_path == "-"
+    # the binary stdin is buffered, like a file opened in binary mode
+    raw = cast(io.BufferedReader, sys.stdin.buffer) if stdin else open(tsv_path, "rb")
+    stream: Union[io.BufferedReader, gzip.GzipFile] = raw
+    if raw.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=raw)
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+    try:
+        # not yield from, it would close the wrapper and with it stdin when the generator is closed early
+        for line in text:
+            yield line
+    finally:
+        if stdin:
+            # leave stdin open, unless it was closed already, e.g. at exit
+            if not raw.closed:
+                text.detach()
+        else:
+            text.close()
+            raw.close()
+
+
+def _find_column(lines: Iterator[str], name: str):
+    """
+    Reads the header of a tsv and returns the index of the named column
+    """
+    for l in lines:
+        header = [h.strip() for h in l.lstrip("#").split("\t")]
+        if header == [""]:
+            continue
+        if name in header:
+            return header.index(name)
+        break
+    raise ValueError(f"the tsv has no column '{name}'")
+
+
+def _parse_id_from_tsv_line(line: str, column: int = 0):
     if (line.startswith("#")):
         return None
-    s = line.split("\t", 1)
-    id = s[0].strip()
+    s = line.split("\t", column + 1)
+    if len(s) <= column:
+        return None
+    id = s[column].strip()
     if len(id) > 0:
         return id
     return None
 
 
-def _parse_ids_from_tsv(tsv_path: str):
-    ids = []
-    with open(tsv_path, "r") as tsv:
-        for l in tsv:
-            id = _parse_id_from_tsv_line(l)
-            if not id is None:
-                ids.append(id)
-    return ids
+def _parse_ids_from_tsv(tsv_path: str, column: Union[int, str] = 0):
+    """
+    The ids in a column of a tsv. A named column is looked up right away, so
+    an unknown column raises a ValueError before any id is read.
+    """
+    lines = _read_tsv_lines(tsv_path)
+    if isinstance(column, str):
+        try:
+            column = _find_column(lines, column)
+        except ValueError:
+            lines.close()
+            raise
+    return _parse_ids_from_tsv_lines(lines, column)
+
 
+def _parse_ids_from_tsv_lines(lines: Iterator[str], column: int):
+    for l in lines:
+        id = _parse_id_from_tsv_line(l, column)
+        if not id is None:
+            yield id
 
-def _parse_filters(filters: List[str]):
-    parsed: List[dict] = []
 
-    for f in filters:
-        groups = f.split(",")
-        d = {}
-        for g in groups:
-            (key, value) = g.split(":")
-            d[key] = value
-        parsed.append(d)
-    return parsed
+def _parse_filters(filters: Optional[List[str]]):
+    if filters is None:
+        return Matcher([])
+    return Matcher.parse(filters)
 
 
 def _path_for_id(id: str, flat=False):
@@ -70,95 +177,184 @@ def _path_for_id(id: str, flat=False):
     return Path(id[3:7]) / id
 
 
-def download_dataset(dl: BakrepDownloader, id: str, filters: List[dict], download_dir: Path, max_retries=3):
-    _try = 0
-    while _try <= max_retries:
-        try:
-            dl.download(id, filters, str(download_dir))
-            break
-        except DownloadFailedException as e:
-            if _try == max_retries:
-                raise e
-            _try += 1
+def _planned(ds: DownloadSet, entries: Iterable[str], has_input: bool, args) -> Iterator[str]:
+    """
+    The datasets that a download with the arguments would fetch, without
+    queueing them in the download set
+    """
+    if not has_input:
+        # the queue of the previous run, with --retry-failed or --sync
+        if args.retry_failed:
+            return ds.retryable_failed(args.cool_down)
+        return ds.queue()
+    entries = ds.distinct(entries)
+    if args.retry_failed:
+        return (id for id in entries if ds.is_retryable_failed(id, args.cool_down))
+    if args.restart or args.sync:
+        return entries
+    return (id for id in entries if not ds.is_downloaded(id))
 
 
 def download(args):
     output_path = Path(args.directory)
-    if not output_path.exists():
-        output_path.mkdir(parents=True)
+    # other shards of the job may create it concurrently
+    output_path.mkdir(parents=True, exist_ok=True)
 
-    entries = []
+    entries: Iterable[str] = []
     if not args.entries is None:
-        entries.extend(_parse_entries(args.entries))
+        entries = itertools.chain(entries, _parse_entries(args.entries))
 
     if not args.tsv is None:
-        entries.extend(_parse_ids_from_tsv(args.tsv))
+        try:
+            entries = itertools.chain(entries, _parse_ids_from_tsv(args.tsv, _parse_id_column(args.id_column)))
+        except ValueError as e:
+            # the column of stdin can only be checked while it is read
+            sys.exit(str(e))
+
+    shard = None
+    if not args.shard is None:
+        shard = Shard.parse(args.shard)
+        entries = shard.filter(entries)
+
+    filters = _parse_filters(args.filters)
+    scheduler = Scheduler.of(args.order)
+
+    # without input, the queue of the previous run is kept
+    has_input = not args.tsv is None or not args.entries is None
+    if args.plan:
+        # a dry run does not change the queue or the state of the datasets
+        set = DownloadSet.at_location(args.directory, shard=shard)
+    else:
+        set = DownloadSet.at_location(
+            args.directory, ids=entries, skipDownloaded=args.restart or args.sync, skipToDownload=has_input,
+            shard=shard)
+    # one file per manifest, so only on request or to reuse the manifests resolved for the order
+    manifest_cache = None
+    if not args.manifest_cache is None or args.manifest_ttl > 0 or scheduler.needs_sizes:
+        manifest_cache_path = output_path / '.progress' / 'manifests'
+        if not args.manifest_cache is None:
+            manifest_cache_path = Path(args.manifest_cache)
+        manifest_cache = ManifestCache(manifest_cache_path, args.manifest_ttl)
+    rate_limit = None
+    if not args.limit_rate is None:
+        rate_limit = TokenBucket(args.limit_rate)
+    content_cache = None
+    if not args.cache_dir is None:
+        content_cache = ContentCache(Path(args.cache_dir), args.cache_size, args.buffer_size)
+    api_url = args.api_url if args.api_url.endswith("/") else args.api_url + "/"
+    dl = BakrepDownloader(api_url, api_pool_size=args.manifest_workers, data_pool_size=args.workers,
+                          chunk_size=args.buffer_size, manifest_cache=manifest_cache,
+                          api_concurrency=AdaptiveConcurrency(args.manifest_workers,
+                                                              latency_threshold=args.latency_threshold),
+                          data_concurrency=AdaptiveConcurrency(args.workers, latency_threshold=args.latency_threshold),
+                          rate_limit=rate_limit,
+                          retry=RetryPolicy(args.retries, args.retry_backoff, args.max_backoff),
+                          timeout=args.timeout, content_cache=content_cache)
+    writer: ResultWriter
+    if args.pack is None:
+        writer = DirectoryWriter(lambda id: output_path / _path_for_id(id, args.flat), args.buffer_size)
+    else:
+        # the shards of a job share the output directory, but not their archives
+        prefix = "results" if shard is None else f"results-{shard.name}"
+        writer = TarShardWriter(output_path, lambda id: _path_for_id(id, args.flat), args.pack, prefix)
+    if args.decompress:
+        writer = GunzipWriter(writer)
+
+    def close():
+        dl.close()
+        writer.close()
+        set.close()
+        if content_cache is not None:
+            content_cache.close()
+
+    if args.plan:
+        try:
+            plan = resolve(dl, _planned(set, entries, has_input, args), filters, writer, args.manifest_workers,
+                           content_cache, Plan(sample_size=max(8, 2 * args.workers)))
+            # the sample is discarded, it is not added to the cache either
+            dl.content_cache = None
+            throughput = measure_throughput(dl, plan.sample, args.workers)
+        finally:
+            close()
+        (lines, fits) = report(plan, throughput, output_path, args.decompress)
+        for line in lines:
+            print(line)
+        if not fits:
+            sys.exit("There is not enough free space for the download")
+        return
+
+    if scheduler.needs_sizes and not args.retry_failed:
+        print("Resolving the manifests of the pending datasets to order them by size")
+        if manifest_cache is not None:
+            # the pipeline uses the manifests that were resolved for the order
+            manifest_cache.fresh_since = time.time()
+        try:
+            resolve_sizes(dl, set, filters, args.manifest_workers)
+        except BaseException:
+            close()
+            raise
 
-    filters = []
-    if not args.filters is None:
-        filters = _parse_filters(args.filters)
+    sync: Optional[SyncWriter] = None
+    if args.sync:
+        sync = SyncWriter(writer, set, Changeset(None if args.changeset is None else Path(args.changeset)))
+        writer = sync
 
-    set = DownloadSet.at_location(
-        args.directory, ids=entries, skipDownloaded=args.restart, skipToDownload=True)
-    dl = BakrepDownloader()
     log = ConsoleOutput(set)
-    log.print_progress()
-    for id in set.download_list():
-        download_dir = output_path / _path_for_id(id, args.flat)
-
-        if not download_dir.exists():
-            download_dir.mkdir(parents=True)
-
+    metrics = Metrics()
+    listeners: List[DownloadListener] = [metrics]
+    events = None
+    if not args.events is None:
+        events = EventLog.open(args.events)
+        listeners.append(events)
+    dl.listeners.extend(listeners + [log])
+    set.listeners.extend(listeners)
+
+    def started(id: str):
         log.print_message(f"Downloading: {id}")
-        try:
-            download_dataset(dl, id, filters, download_dir)
-            set.finish_dataset(id)
-            log.print_message(f"Finished: {id}")
-        except DownloadFailedException as e:
-            log.print_error_message(f"Download failed: {id} {e}")
-            log.print_message(f"Download failed: {id}")
-            set.failed_dataset(id)
-    set.close()
-
-
-class ConsoleOutput:
-    messages: List[str] = []
-    error_messages: List[str] = []
-    lastlines = 1
-    max_messages = 1
-    max_error_messages = 5
-    first_print = True
-
-    def __init__(self, download_set: DownloadSet):
-        self.download_set = download_set
-
-    def print_message(self, msg: str):
-        self.messages.append(msg)
-        if len(self.messages) > self.max_messages:
-            self.messages = self.messages[-self.max_messages:]
-        self.print_progress()
-
-    def print_error_message(self, msg: str):
-        self.error_messages.append(msg)
-        if len(self.error_messages) > self.max_error_messages:
-            self.error_messages = self.error_messages[-self.max_error_messages:]
-        self.print_progress()
-
-    def print_progress(self):
-        ds = self.download_set
-        if not self.first_print:
-            print(f"\033[{self.lastlines}F", end="", flush=True)
-            print(f"\033[2K", end="", flush=True)
-        self.first_print = False
-        print(
-            f"Progress: {ds.downloaded_datasets()}/{ds.total_datasets()}, Failed: {ds.failed_datasets()}")
-        for m in self.messages:
-            print(f"\033[2K", end="", flush=True)
-            print(m)
-
-        print(f"\033[2K", end="", flush=True)
-        print("\nLatest Errors:")
-        for m in self.error_messages:
-            print(f"\033[2K", end="", flush=True)
-            print(m)
-        self.lastlines = 1 + len(self.messages) + 2 + len(self.error_messages)
+
+    def finished(id: str):
+        set.finish_dataset(id)
+        log.print_message(f"Finished: {id}")
+
+    def failed(id: str, e: DownloadFailedException):
+        log.print_error_message(f"Download failed: {id} {e}")
+        log.print_message(f"Download failed: {id}")
+        set.failed_dataset(id, e)
+
+    def manifest(dataset: Dataset):
+        if not sync is None and args.prune:
+            sync.prune(dataset)
+
+    def result(id: str, res: Result):
+        set.finish_file(id, res.filename(), res.size, res.md5)
+        if not sync is None:
+            sync.applied(id, res)
+
+    def resolved(id: str, results: List[Result]):
+        # recorded for the order of later runs
+        set.set_size(id, sum(res.size for res in results))
+        log.dataset_resolved(id, results)
+
+    pipeline = DownloadPipeline(
+        dl, filters, writer,
+        manifest_workers=args.manifest_workers, transfer_workers=args.workers, queue_size=args.queue_size,
+        order_results=scheduler.order_results, on_started=started, on_manifest=manifest, on_resolved=resolved,
+        on_result=result, on_finished=finished, on_failed=failed)
+    try:
+        with log:
+            if args.retry_failed:
+                pipeline.run(set.retryable_failed(args.cool_down))
+            else:
+                pipeline.run(scheduler.pending(set))
+    finally:
+        close()
+        if events is not None:
+            events.close()
+        for line in metrics.report():
+            print(line)
+        if not sync is None:
+            sync.changeset.close()
+            for line in sync.changeset.report():
+                print(line)
+        if not args.metrics is None:
+            metrics.write_prometheus(args.metrics)
@@ -0,0 +1,123 @@
+import fnmatch
+import re
+from typing import Iterable, List, Optional, Union
+
+
+class FilterParseError(ValueError):
+    pass
+
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+_MISSING = object()
+
+
+class Condition:
+    """
+    A condition on a single attribute.
+
+    The attribute must have one of the values or match one of the glob
+    patterns. A negated condition matches when this is not the case, which
+    includes results that do not have the attribute at all.
+    """
+
+    def __init__(self, key: str, values: Iterable[str], negate=False, glob=True):
+        self.key = key
+        self.negate = negate
+        values = list(values)
+        patterns = []
+        if glob:
+            patterns = [fnmatch.translate(v) for v in values if _GLOB_CHARS.search(v)]
+            values = [v for v in values if not _GLOB_CHARS.search(v)]
+        self.values = frozenset(values)
+        self.pattern: Optional[re.Pattern] = None
+        if len(patterns) > 0:
+            self.pattern = re.compile("|".join(patterns))
+
+    def matches(self, attributes: dict):
+        if self.key not in attributes:
+            return self.negate
+        value = attributes[self.key]
+        found = value in self.values or (
+            self.pattern is not None and self.pattern.match(str(value)) is not None)
+        return found != self.negate
+
+    @staticmethod
+    def parse(text: str):
+        """
+        Parses 'key:value', 'key!=value' or value sets like 'key:a|b'
+        """
+        negate = "!=" in text
+        (key, sep, value) = text.partition("!=" if negate else ":")
+        key = key.strip()
+        if sep == "" or len(key) == 0:
+            raise FilterParseError(
+                f"invalid filter '{text}', expected 'key:value' or 'key!=value'")
+        values = [v.strip() for v in value.split("|")]
+        if any(len(v) == 0 for v in values):
+            raise FilterParseError(f"invalid filter '{text}', the value must not be empty")
+        return Condition(key, values, negate)
+
+
+class Matcher:
+    """
+    A compiled set of attribute filters.
+
+    A result matches when all conditions of at least one group match. An
+    empty group matches everything and a matcher without groups matches
+    everything as well. The outcome is cached per combination of attributes,
+    on the values of the filtered attributes, because the manifests of all
+    datasets share a handful of combinations.
+    """
+
+    max_cached = 4096
+
+    def __init__(self, groups: List[List[Condition]]):
+        self.groups = groups
+        self.match_all = len(groups) == 0 or any(len(g) == 0 for g in groups)
+        self._keys = tuple(sorted(set(c.key for g in groups for c in g)))
+        self._cache: dict = {}
+
+    def matches(self, attributes: dict):
+        if self.match_all:
+            return True
+        key = tuple([attributes.get(k, _MISSING) for k in self._keys])
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable attribute values are not cached
+            return self._evaluate(attributes)
+        matches = self._evaluate(attributes)
+        if len(self._cache) < self.max_cached:
+            self._cache[key] = matches
+        return matches
+
+    def _evaluate(self, attributes: dict):
+        for group in self.groups:
+            if all(c.matches(attributes) for c in group):
+                return True
+        return False
+
+    @staticmethod
+    def parse(filters: List[str]):
+        """
+        Compiles filters like 'tool:bakta|gtdbtk,filetype!=json'
+        """
+        groups: List[List[Condition]] = []
+        for f in filters:
+            groups.append([Condition.parse(c) for c in f.split(",") if len(c.strip()) > 0])
+        return Matcher(groups)
+
+    @staticmethod
+    def from_dicts(filters: List[dict]):
+        """
+        Compiles filters of exact values, one dict of attribute values per group
+        """
+        return Matcher([[Condition(k, [v], glob=False) for (k, v) in f.items()] for f in filters])
+
+    @staticmethod
+    def of(filters: Union["Matcher", List[dict]]):
+        if isinstance(filters, Matcher):
+            return filters
+        return Matcher.from_dicts(filters)
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class CachedManifest:
+    def __init__(self, dataset: dict, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 checked: float = 0):
+        self.dataset = dataset
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked = checked
+
+    def conditional_headers(self):
+        """
+        Headers for a request that only returns the manifest when it changed
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self):
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "checked": self.checked,
+            "dataset": self.dataset,
+        }
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return CachedManifest(dict['dataset'], dict.get('etag'), dict.get('last_modified'), dict.get('checked', 0))
+
+
+class ManifestCache:
+    """
+    Keeps the manifests of datasets on disk, keyed by dataset id.
+
+    A cached manifest that was checked less than ttl seconds ago is used
+    without asking the server. Older entries are revalidated with a
+    conditional request based on the ETag and Last-Modified headers.
+    Entries that were checked after fresh_since are fresh as well, so that
+    manifests resolved earlier in the same run are not revalidated again.
+    The files are replaced atomically, so a cache directory can be shared
+    between threads and processes.
+    """
+
+    def __init__(self, directory: Path, ttl: float = 0):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.fresh_since: Optional[float] = None
+
+    def _path(self, id: str):
+        return self.directory / id[3:7] / f"{id}.json"
+
+    def get(self, id: str) -> Optional[CachedManifest]:
+        try:
+            return CachedManifest.from_dict(json.loads(self._path(id).read_text()))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def is_fresh(self, entry: CachedManifest):
+        if self.fresh_since is not None and entry.checked >= self.fresh_since:
+            return True
+        return time.time() - entry.checked < self.ttl
+
+    def put(self, id: str, dataset: dict, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self._write(id, CachedManifest(dataset, etag, last_modified, time.time()))
+
+    def revalidated(self, id: str, entry: CachedManifest):
+        """
+        Marks an entry as checked after the server confirmed that it is unchanged
+        """
+        entry.checked = time.time()
+        self._write(id, entry)
+
+    def _write(self, id: str, entry: CachedManifest):
+        path = self._path(id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=path.parent, prefix=f".{id}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry.to_dict(), f)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
@@ -0,0 +1,223 @@
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO
+
+from bakrep.model import DownloadFailedException, DownloadListener, Result, VerificationFailedException
+
+
+def _host(url: str):
+    return urllib.parse.urlparse(url).netloc
+
+
+def _describe(error: Exception):
+    """
+    The fields of an event that describe an error
+    """
+    d: dict = {"error": type(error).__name__, "message": str(error)}
+    if isinstance(error, DownloadFailedException):
+        d["status"] = error.status_code
+        d["retryable"] = error.retryable
+        if error.status_code is None and isinstance(error.reason, BaseException):
+            d["error"] = type(error.reason).__name__
+    return d
+
+
+class EventLog(DownloadListener):
+    """
+    Writes the events of a download as JSON lines.
+
+    Every line has the unix time and the name of the event, the other fields
+    depend on the event. Transfer progress is not logged.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def open(path: str):
+        return EventLog(open(path, "a", buffering=1))
+
+    def close(self):
+        self.stream.close()
+
+    def _write(self, event: str, **fields):
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields})
+        with self._lock:
+            self.stream.write(line + "\n")
+
+    def manifest_fetched(self, id: str, status_code: Optional[int], duration: float):
+        self._write("manifest_fetched", id=id, status=status_code, cached=status_code is None,
+                    duration=round(duration, 4))
+
+    def manifest_failed(self, id: str, error: Exception):
+        self._write("manifest_failed", id=id, **_describe(error))
+
+    def retry(self, id: str, url: str, attempt: int, error: Exception, delay: float):
+        self._write("retry", id=id, url=url, attempt=attempt, delay=round(delay, 3), **_describe(error))
+
+    def transfer_started(self, id: str, res: Result):
+        self._write("file_started", id=id, url=res.url, size=res.size)
+
+    def transfer_finished(self, id: str, res: Result, nbytes: int, duration: float):
+        self._write("file_finished", id=id, url=res.url, bytes=nbytes, duration=round(duration, 4))
+
+    def transfer_skipped(self, id: str, res: Result):
+        self._write("file_skipped", id=id, url=res.url, size=res.size)
+
+    def transfer_cached(self, id: str, res: Result):
+        self._write("file_cached", id=id, url=res.url, size=res.size)
+
+    def transfer_failed(self, id: str, res: Result, error: Exception):
+        self._write("file_failed", id=id, url=res.url, **_describe(error))
+
+    def dataset_finished(self, id: str):
+        self._write("dataset_finished", id=id)
+
+    def dataset_failed(self, id: str):
+        self._write("dataset_failed", id=id)
+
+
+class _Host:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+class Metrics(DownloadListener):
+    """
+    Aggregates the events of a download into counters for a summary report
+    and the Prometheus textfile format.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.manifests: Dict[str, int] = collections.Counter()
+        self.manifest_seconds = 0.0
+        self.manifest_requests = 0
+        self.manifest_failures = 0
+        self.retries = 0
+        self.files_skipped = 0
+        self.files_cached = 0
+        self.transfer_failures = 0
+        self.verification_failures = 0
+        self.datasets_finished = 0
+        self.datasets_failed = 0
+        self.hosts: Dict[str, _Host] = collections.defaultdict(_Host)
+        self._lock = threading.Lock()
+
+    def manifest_fetched(self, id: str, status_code: Optional[int], duration: float):
+        with self._lock:
+            self.manifests["cached" if status_code is None else str(status_code)] += 1
+            if status_code is not None:
+                self.manifest_requests += 1
+                self.manifest_seconds += duration
+
+    def manifest_failed(self, id: str, error: Exception):
+        with self._lock:
+            self.manifest_failures += 1
+
+    def retry(self, id: str, url: str, attempt: int, error: Exception, delay: float):
+        with self._lock:
+            self.retries += 1
+
+    def transfer_finished(self, id: str, res: Result, nbytes: int, duration: float):
+        with self._lock:
+            host = self.hosts[_host(res.url)]
+            host.files += 1
+            host.bytes += nbytes
+            host.seconds += duration
+
+    def transfer_skipped(self, id: str, res: Result):
+        with self._lock:
+            self.files_skipped += 1
+
+    def transfer_cached(self, id: str, res: Result):
+        with self._lock:
+            self.files_cached += 1
+
+    def transfer_failed(self, id: str, res: Result, error: Exception):
+        with self._lock:
+            self.transfer_failures += 1
+            if isinstance(error, VerificationFailedException):
+                self.verification_failures += 1
+
+    def dataset_finished(self, id: str):
+        with self._lock:
+            self.datasets_finished += 1
+
+    def dataset_failed(self, id: str):
+        with self._lock:
+            self.datasets_failed += 1
+
+    def report(self) -> List[str]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            files = sum(h.files for h in self.hosts.values())
+            total_bytes = sum(h.bytes for h in self.hosts.values())
+            lines = [
+                f"Datasets: {self.datasets_finished} finished, {self.datasets_failed} failed in {elapsed:.1f} s",
+                f"Files: {files} downloaded ({total_bytes} bytes), {self.files_cached} from cache, "
+                f"{self.files_skipped} already present, "
+                f"{self.transfer_failures} failed attempts ({self.verification_failures} corrupt), {self.retries} retries",
+            ]
+            manifests = ", ".join(f"{k}: {v}" for (k, v) in sorted(self.manifests.items()))
+            latency = self.manifest_seconds / self.manifest_requests if self.manifest_requests > 0 else 0
+            lines.append(f"Manifests: {manifests or 'none'}, {self.manifest_failures} failed attempts, "
+                         f"mean latency {latency * 1000:.0f} ms")
+            for (name, h) in sorted(self.hosts.items()):
+                # the sum of the transfer times, so this is the throughput of a single transfer
+                rate = h.bytes / h.seconds if h.seconds > 0 else 0
+                lines.append(f"Host {name}: {h.files} files, {h.bytes} bytes, {rate / 1024 ** 2:.2f} MiB/s per transfer")
+            return lines
+
+    def prometheus(self) -> str:
+        with self._lock:
+            lines = [
+                "# TYPE bakrep_datasets_total counter",
+                f'bakrep_datasets_total{{state="finished"}} {self.datasets_finished}',
+                f'bakrep_datasets_total{{state="failed"}} {self.datasets_failed}',
+                "# TYPE bakrep_manifests_total counter",
+            ]
+            for (k, v) in sorted(self.manifests.items()):
+                lines.append(f'bakrep_manifests_total{{status="{k}"}} {v}')
+            lines += [
+                "# TYPE bakrep_manifest_request_seconds_total counter",
+                f"bakrep_manifest_request_seconds_total {self.manifest_seconds}",
+                "# TYPE bakrep_manifest_failures_total counter",
+                f"bakrep_manifest_failures_total {self.manifest_failures}",
+                "# TYPE bakrep_retries_total counter",
+                f"bakrep_retries_total {self.retries}",
+                "# TYPE bakrep_files_skipped_total counter",
+                f"bakrep_files_skipped_total {self.files_skipped}",
+                "# TYPE bakrep_files_cached_total counter",
+                f"bakrep_files_cached_total {self.files_cached}",
+                "# TYPE bakrep_transfer_failures_total counter",
+                f"bakrep_transfer_failures_total {self.transfer_failures}",
+                "# TYPE bakrep_verification_failures_total counter",
+                f"bakrep_verification_failures_total {self.verification_failures}",
+                "# TYPE bakrep_files_total counter",
+            ]
+            lines += [f'bakrep_files_total{{host="{n}"}} {h.files}' for (n, h) in sorted(self.hosts.items())]
+            lines.append("# TYPE bakrep_bytes_total counter")
+            lines += [f'bakrep_bytes_total{{host="{n}"}} {h.bytes}' for (n, h) in sorted(self.hosts.items())]
+            lines.append("# TYPE bakrep_transfer_seconds_total counter")
+            lines += [f'bakrep_transfer_seconds_total{{host="{n}"}} {h.seconds}' for (n, h) in sorted(self.hosts.items())]
+            return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Writes the metrics atomically, as required by the node exporter textfile collector
+        """
+        target = Path(path)
+        (fd, tmp) = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, target)
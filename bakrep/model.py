@@ -1,8 +1,25 @@
+import contextlib
+import hashlib
+import itertools
+import sqlite3
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Collection, List
+from typing import Iterable, List, Optional, Union
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from bakrep.content_cache import ContentCache
+from bakrep.filters import Matcher
+from bakrep.manifest_cache import ManifestCache
+from bakrep.retry import RetryPolicy, is_retryable_status, parse_retry_after
+from bakrep.shard import Shard
+from bakrep.throttle import AdaptiveConcurrency, TokenBucket
+from bakrep.writers import CorruptResultError, DirectoryWriter, ResultOutput, ResultWriter
 
 
 class Result:
@@ -20,16 +37,11 @@ class Result:
     def __str__(self):
         return f"Result[ {self.url}, {self.attributes}, {self.md5}, {self.size}]"
 
-    def matches(self, filters: List[dict]):
-        for f in filters:
-            matches = True
-            for pair in f.items():
-                if not pair[0] in self.attributes or self.attributes[pair[0]] != pair[1]:
-                    matches = False
-                    break
-            if matches:
-                return True
-        return False
+    def filename(self):
+        return Path(urllib.parse.urlparse(self.url).path).name
+
+    def matches(self, filters: Union[Matcher, List[dict]]):
+        return Matcher.of(filters).matches(self.attributes)
 
     @staticmethod
     def from_dict(dict: dict):
@@ -46,14 +58,11 @@ class Dataset:
             return self.id == __value.id and self.results == __value.results
         return False
 
-    def filter(self, filters: List[dict]):
-        if (len(filters) == 0):
+    def filter(self, filters: Union[Matcher, List[dict]]):
+        matcher = Matcher.of(filters)
+        if matcher.match_all:
             return self.results
-        filtered = []
-        for r in self.results:
-            if r.matches(filters):
-                filtered.append(r)
-        return filtered
+        return [r for r in self.results if matcher.matches(r.attributes)]
 
     @staticmethod
     def from_dict(dict: dict):
@@ -66,22 +75,39 @@ class Dataset:
 
 class DownloadSet:
     """
-    A collection of datasets that should be downloaded
+    A collection of datasets that should be downloaded.
+
+    The state is kept in an SQLite database in the location directory. Every
+    dataset is one row with flags for queued (toDownload), downloaded and
+    failed and the size of its selected result files once the manifest was
+    resolved; the result files that were completed are kept per dataset.
+    The last failure of a dataset is kept with its url, status code, error
+    class, number of attempts and time until the dataset is downloaded.
+    Changes are committed in batches of commit_every changes or after
+    commit_interval seconds, whichever comes first, and on close.
+
+    Finished and failed datasets are reported to the listeners.
     """
 
-    def __init__(self, location: Path, toDownload=set(), downloaded=set(), failed=set()):
+    def __init__(self, location: Path, commit_every: int = 1000, commit_interval: float = 1.0):
         self.location = location
-        self.toDownload = toDownload
-        self.downloaded = downloaded
-        self.failed = failed
-        self.__downloaded_writer__ = open(location/'downloaded.dat', "a")
-        self.__toDownload_writer__ = open(location/'toDownload.dat', "a")
-        self.__failed_writer__ = open(location/'failed.dat', "a")
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.listeners: List["DownloadListener"] = []
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(location / 'progress.sqlite'), check_same_thread=False)
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._schedules = 0
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        (self._seq,) = self._db.execute("SELECT coalesce(max(seq), 0) FROM datasets").fetchone()
+        self._recount()
 
     def close(self):
-        self.__downloaded_writer__.close()
-        self.__toDownload_writer__.close()
-        self.__failed_writer__.close()
+        with self._lock:
+            self._db.commit()
+            self._db.close()
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.close()
@@ -90,92 +116,721 @@ class DownloadSet:
         return self
 
     def __iter__(self):
-        pass
+        return self.pending()
+
+    @property
+    def toDownload(self):
+        return self._ids("queued")
+
+    @property
+    def downloaded(self):
+        return self._ids("downloaded")
+
+    @property
+    def failed(self):
+        return self._ids("failed")
+
+    def _ids(self, flag: str):
+        with self._lock:
+            return set(r[0] for r in self._db.execute(f"SELECT id FROM datasets WHERE {flag}"))
+
+    def pending(self, page_size: int = 1000, order_by: str = "seq"):
+        """
+        Iterates over the queued datasets that are not downloaded yet, in the
+        order they were added or by the SQL expression order_by over the
+        columns of the datasets table. Only one page of ids is held in memory.
+        """
+        if order_by == "seq":
+            return self._by_seq("queued = 1 AND downloaded = 0", page_size)
+        return self._scheduled(order_by, page_size)
+
+    def queue(self, page_size: int = 1000):
+        """
+        Iterates over all queued datasets, downloaded or not, in the order
+        they were added
+        """
+        return self._by_seq("queued = 1", page_size)
+
+    def is_downloaded(self, datasetId: str):
+        with self._lock:
+            row = self._state(datasetId)
+        return row is not None and bool(row[1])
+
+    def is_retryable_failed(self, datasetId: str, cool_down: float = 0):
+        """
+        Whether the dataset failed and would be retried, see retryable_failed
+        """
+        with self._lock:
+            row = self._db.execute(f"SELECT 1 FROM datasets WHERE id = ? AND {_RETRYABLE}",
+                                   (datasetId, time.time() - cool_down)).fetchone()
+        return row is not None
+
+    def distinct(self, datasetIds: Iterable[str], batch_size: int = 10000):
+        """
+        Iterates over the ids without repetitions, without queueing them.
+        The ids that were seen are kept in a temporary table instead of memory.
+        """
+        with self._lock:
+            self._schedules += 1
+            table = f"temp.distinct_{self._schedules}"
+            self._db.execute(f"CREATE TABLE {table} (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        try:
+            for batch in _batched(datasetIds, batch_size):
+                with self._lock:
+                    new = [id for id in batch
+                           if self._db.execute(f"INSERT OR IGNORE INTO {table} (id) VALUES (?)", (id,)).rowcount > 0]
+                yield from new
+        finally:
+            with self._lock:
+                try:
+                    self._db.execute(f"DROP TABLE IF EXISTS {table}")
+                except sqlite3.ProgrammingError:
+                    # closed before the iteration ended, temporary tables are gone with the connection
+                    pass
+
+    def retryable_failed(self, cool_down: float = 0, page_size: int = 1000):
+        """
+        Iterates over the pending failed datasets whose last failure is
+        retryable and at least cool_down seconds ago, in the order they were
+        added. Failures without a record, e.g. of previous versions, are
+        retried as well.
+        """
+        return self._by_seq(f"queued = 1 AND {_RETRYABLE}", page_size, (time.time() - cool_down,))
+
+    def unsized(self, page_size: int = 1000):
+        """
+        Iterates over the pending datasets without a known size
+        """
+        return self._by_seq("queued = 1 AND downloaded = 0 AND size IS NULL", page_size)
+
+    def _by_seq(self, condition: str, page_size: int, params: tuple = ()):
+        last = 0
+        while True:
+            with self._lock:
+                page = self._db.execute(
+                    f"SELECT id, seq FROM datasets WHERE {condition} AND seq > ? ORDER BY seq LIMIT ?",
+                    params + (last, page_size)).fetchall()
+            if len(page) == 0:
+                return
+            for (id, seq) in page:
+                yield id
+            last = page[-1][1]
+
+    def _scheduled(self, order_by: str, page_size: int):
+        # the order is computed once into a temporary table, which is read page by page
+        with self._lock:
+            self._schedules += 1
+            table = f"temp.schedule_{self._schedules}"
+            self._db.execute(f"CREATE TABLE {table} (pos INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+            self._db.execute(f"INSERT INTO {table} (id) SELECT id FROM datasets "
+                             f"WHERE queued = 1 AND downloaded = 0 ORDER BY {order_by}")
+        try:
+            last = 0
+            while True:
+                with self._lock:
+                    page = self._db.execute(f"SELECT pos, id FROM {table} WHERE pos > ? ORDER BY pos LIMIT ?",
+                                            (last, page_size)).fetchall()
+                if len(page) == 0:
+                    return
+                for (pos, id) in page:
+                    yield id
+                last = page[-1][0]
+        finally:
+            with self._lock:
+                try:
+                    self._db.execute(f"DROP TABLE IF EXISTS {table}")
+                except sqlite3.ProgrammingError:
+                    # closed before the iteration ended, temporary tables are gone with the connection
+                    pass
 
     def download_list(self):
-        return list(self.toDownload.difference(self.downloaded))
+        return list(self.pending())
 
     def add_dataset(self, datasetId: str):
-        first = len(self.toDownload) == 0
-        self.toDownload.add(datasetId)
-        if not first:
-            self.__toDownload_writer__.write("\n")
-        self.__toDownload_writer__.write(datasetId)
+        self.add_datasets([datasetId])
+
+    def add_datasets(self, datasetIds: Iterable[str]):
+        """
+        Queues datasets. The ids are consumed lazily and ids that are already
+        queued keep their position.
+        """
+        with self._lock:
+            for batch in _batched(datasetIds, 50000):
+                self._db.executemany(
+                    "INSERT INTO datasets (id, seq, queued) VALUES (?, ?, 1) "
+                    "ON CONFLICT (id) DO UPDATE SET queued = 1, seq = excluded.seq WHERE NOT queued",
+                    ((id, self._next_seq()) for id in batch))
+                self._db.commit()
+                self._last_commit = time.monotonic()
+            self._recount()
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _recount(self):
+        (self._total, self._downloaded, self._failed) = self._db.execute(
+            "SELECT count(*), coalesce(sum(downloaded), 0), coalesce(sum(failed AND NOT downloaded), 0) "
+            "FROM datasets WHERE queued").fetchone()
 
     def downloaded_datasets(self):
-        return len(self.downloaded)
+        return self._downloaded
 
     def total_datasets(self):
-        return len(self.toDownload)
+        return self._total
 
     def failed_datasets(self):
-        return len(self.failed)
+        return self._failed
 
     def finish_dataset(self, datasetId: str):
-        first = len(self.downloaded) == 0
-        self.downloaded.add(datasetId)
-        if not first:
-            self.__downloaded_writer__.write("\n")
-            self.__downloaded_writer__.flush()
-        self.__downloaded_writer__.write(datasetId)
-
-    def failed_dataset(self, datasetId: str):
-        first = len(self.failed) == 0
-        self.failed.add(datasetId)
-        if not first:
-            self.__failed_writer__.write("\n")
-        self.__failed_writer__.write(datasetId)
-        self.__failed_writer__.flush()
+        with self._lock:
+            row = self._state(datasetId)
+            if row is None:
+                self._db.execute("INSERT INTO datasets (id, seq, downloaded) VALUES (?, ?, 1)",
+                                 (datasetId, self._next_seq()))
+            else:
+                (queued, downloaded, failed) = row
+                self._db.execute("UPDATE datasets SET downloaded = 1, failed = 0 WHERE id = ?", (datasetId,))
+                if queued and not downloaded:
+                    self._downloaded += 1
+                    if failed:
+                        self._failed -= 1
+            self._db.execute("DELETE FROM failures WHERE dataset = ?", (datasetId,))
+            self._changed()
+        for listener in self.listeners:
+            listener.dataset_finished(datasetId)
+
+    def failed_dataset(self, datasetId: str, error: Optional["DownloadFailedException"] = None):
+        with self._lock:
+            if not error is None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO failures (dataset, url, status, error, message, retryable, attempts, time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (datasetId, error.url, error.status_code, error.error, str(error.reason), int(error.retryable),
+                     error.attempts, time.time()))
+            row = self._state(datasetId)
+            if row is None:
+                self._db.execute("INSERT INTO datasets (id, seq, failed) VALUES (?, ?, 1)",
+                                 (datasetId, self._next_seq()))
+            else:
+                (queued, downloaded, failed) = row
+                self._db.execute("UPDATE datasets SET failed = 1 WHERE id = ?", (datasetId,))
+                if queued and not downloaded and not failed:
+                    self._failed += 1
+            self._changed()
+        for listener in self.listeners:
+            listener.dataset_failed(datasetId)
+
+    def set_size(self, datasetId: str, size: int):
+        """
+        Records the size of the selected result files of a dataset
+        """
+        with self._lock:
+            self._db.execute("UPDATE datasets SET size = ? WHERE id = ?", (size, datasetId))
+            self._changed()
+
+    def finish_file(self, datasetId: str, name: str, size: int, md5: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files (dataset, name, size, md5) VALUES (?, ?, ?, ?)",
+                             (datasetId, name, size, md5))
+            self._changed()
+
+    def remove_file(self, datasetId: str, name: str):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE dataset = ? AND name = ?", (datasetId, name))
+            self._changed()
+
+    def finished_files(self, datasetId: str):
+        """
+        Returns the completed result files of a dataset as a dict of name to (size, md5)
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT name, size, md5 FROM files WHERE dataset = ?", (datasetId,))
+            return {name: (size, md5) for (name, size, md5) in rows}
+
+    def _state(self, datasetId: str):
+        return self._db.execute("SELECT queued, downloaded, failed FROM datasets WHERE id = ?",
+                                (datasetId,)).fetchone()
+
+    def _changed(self):
+        self._uncommitted += 1
+        now = time.monotonic()
+        if self._uncommitted >= self.commit_every or now - self._last_commit >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+            self._last_commit = time.monotonic()
 
     @staticmethod
-    def at_location(path: str, ids: Collection[str] = set(), skipDownloaded=False, skipToDownload=False, skipFailed=False):
+    def at_location(path: str, ids: Iterable[str] = (), skipDownloaded=False, skipToDownload=False, skipFailed=False,
+                    shard: Optional[Shard] = None):
         """
-        Factory for a downloadset that persists the downloaded ids to disc
+        Factory for a downloadset that persists the downloaded ids to disc.
+        Every shard of a job keeps its own state in a subdirectory.
         """
         p = Path(path) / '.progress'
-        toDownloadPath = p / 'toDownload.dat'
-        downloadedPath = p / 'downloaded.dat'
-        failedPath = p / 'failed.dat'
-        downloaded = set()
-        toDownload = set(ids)
-        failed = set()
-        if not p.exists():
-            p.mkdir(parents=True)
-
-        if not skipDownloaded and downloadedPath.exists():
-            downloaded = set(downloadedPath.read_text().split("\n"))
-        else:
-            downloadedPath.write_text("\n".join(downloaded))
-        if not skipToDownload and toDownloadPath.exists():
-            toDownload = set(toDownloadPath.read_text().split("\n"))
-        else:
-            toDownloadPath.write_text("\n".join(toDownload))
-        if not skipFailed and failedPath.exists():
-            failed = set(failedPath.read_text().split("\n"))
-        return DownloadSet(p, toDownload, downloaded, failed)
+        if not shard is None:
+            p = p / shard.name
+        p.mkdir(parents=True, exist_ok=True)
+        new = not (p / 'progress.sqlite').exists()
+        ds = DownloadSet(p)
+        if new and shard is None:
+            ds._import_legacy_files()
+        with ds._lock:
+            if skipDownloaded:
+                ds._db.execute("UPDATE datasets SET downloaded = 0 WHERE downloaded")
+            if skipToDownload:
+                ds._db.execute("UPDATE datasets SET queued = 0 WHERE queued")
+            if skipFailed:
+                ds._db.execute("UPDATE datasets SET failed = 0 WHERE failed")
+            ds._db.commit()
+        ds.add_datasets(ids)
+        return ds
+
+    def _import_legacy_files(self):
+        """
+        Imports the plain text files of previous versions
+        """
+        for (flag, name) in [("queued", "toDownload.dat"), ("downloaded", "downloaded.dat"), ("failed", "failed.dat")]:
+            f = self.location / name
+            if not f.exists():
+                continue
+            with open(f) as lines:
+                ids = (l.strip() for l in lines)
+                self._db.executemany(
+                    f"INSERT INTO datasets (id, seq, {flag}) VALUES (?, ?, 1) "
+                    f"ON CONFLICT (id) DO UPDATE SET {flag} = 1",
+                    ((id, self._next_seq()) for id in ids if len(id) > 0))
+        self._db.commit()
+        self._recount()
+
+
+# a failed dataset whose last failure is retryable and older than the time parameter
+_RETRYABLE = ("downloaded = 0 AND failed = 1 AND NOT EXISTS (SELECT 1 FROM failures "
+              "WHERE dataset = datasets.id AND (NOT retryable OR time > ?))")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    queued INTEGER NOT NULL DEFAULT 0,
+    downloaded INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS datasets_pending ON datasets (queued, downloaded, seq);
+CREATE TABLE IF NOT EXISTS failures (
+    dataset TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER,
+    error TEXT NOT NULL,
+    message TEXT NOT NULL,
+    retryable INTEGER NOT NULL,
+    attempts INTEGER NOT NULL,
+    time REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    dataset TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    PRIMARY KEY (dataset, name)
+) WITHOUT ROWID;
+"""
+
+
+def _batched(iterable: Iterable, n: int):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, n))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+# errors of a request that may succeed on another attempt
+_TRANSIENT_ERRORS = (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                     urllib3.exceptions.ProtocolError, urllib3.exceptions.TimeoutError, TimeoutError, ConnectionError)
 
 
 class DownloadFailedException(Exception):
-    pass
+    """
+    A dataset or result file could not be downloaded.
+
+    The arguments are the dataset id, the url and the reason, which is the
+    HTTP status code, the underlying exception or a message. Server errors,
+    throttling, timeouts, connection errors, broken transfers and failed
+    verifications are retryable. Other client errors like 404 and other
+    exceptions, e.g. an invalid url, are not. attempts is the number of
+    requests that failed, as counted by the RetryPolicy.
+    """
+
+    def __init__(self, id: str, url: str, reason, retry_after: Optional[float] = None):
+        super().__init__(id, url, reason)
+        self.id = id
+        self.url = url
+        self.reason = reason
+        self.retry_after = retry_after
+        self.attempts = 1
+
+    @property
+    def error(self) -> str:
+        """
+        The class of the error, the exception of the reason or this one
+        """
+        if isinstance(self.reason, BaseException):
+            return type(self.reason).__name__
+        return type(self).__name__
+
+    @property
+    def status_code(self) -> Optional[int]:
+        return self.reason if isinstance(self.reason, int) else None
+
+    @property
+    def retryable(self):
+        if self.status_code is None:
+            return isinstance(self.reason, _TRANSIENT_ERRORS)
+        return is_retryable_status(self.status_code)
+
+
+class VerificationFailedException(DownloadFailedException):
+    """
+    A transferred file does not match the size or md5 sum of the manifest
+    """
+
+    @property
+    def retryable(self):
+        return True
+
+
+def _parse_dataset(id: str, url: str, json) -> Dataset:
+    try:
+        return Dataset.from_dict(json)
+    except (KeyError, TypeError, ValueError) as e:
+        # a malformed manifest only fails its dataset
+        raise DownloadFailedException(id, url, e) from e
+
+
+def _failed_response(id: str, url: str, r: requests.Response):
+    return DownloadFailedException(id, url, r.status_code, parse_retry_after(r.headers.get("Retry-After")))
+
+
+def _content_range_start(r: requests.Response):
+    content_range = r.headers.get("Content-Range", "")
+    # e.g. 'bytes 100-199/200'
+    try:
+        return int(content_range.split()[1].split("-")[0])
+    except (IndexError, ValueError):
+        return None
+
+
+class DownloadListener:
+    """
+    Receives the events of a BakrepDownloader and a DownloadSet.
+
+    The methods are called from the worker threads and should return quickly.
+    Failed attempts are reported as manifest_failed or transfer_failed, even
+    when they are retried afterwards. The status code of manifest_fetched is
+    None when a fresh manifest was taken from the cache.
+    """
+
+    def manifest_fetched(self, id: str, status_code: Optional[int], duration: float):
+        pass
+
+    def manifest_failed(self, id: str, error: Exception):
+        pass
+
+    def retry(self, id: str, url: str, attempt: int, error: Exception, delay: float):
+        pass
+
+    def transfer_started(self, id: str, res: Result):
+        pass
+
+    def transfer_progress(self, id: str, res: Result, nbytes: int):
+        pass
+
+    def transfer_finished(self, id: str, res: Result, nbytes: int, duration: float):
+        pass
+
+    def transfer_skipped(self, id: str, res: Result):
+        pass
+
+    def transfer_cached(self, id: str, res: Result):
+        pass
+
+    def transfer_failed(self, id: str, res: Result, error: Exception):
+        pass
+
+    def dataset_finished(self, id: str):
+        pass
+
+    def dataset_failed(self, id: str):
+        pass
+
+
+def _slot(concurrency: Optional[AdaptiveConcurrency]):
+    if concurrency is None:
+        return contextlib.nullcontext()
+    return concurrency
 
 
 class BakrepDownloader:
-    def __init__(self, url: str = "https://bakrep.computational.bio/api/v1/datasets/"):
+    """
+    Downloads the results of datasets from BakRep.
+
+    With more than one worker the result files of a dataset are downloaded
+    concurrently. All requests go through one session with separate keep-alive
+    connection pools for the API host and the data hosts, so a downloader should
+    be shared between threads instead of creating one per dataset.
+
+    Result files are streamed in chunks of chunk_size bytes to a writer, by
+    default a DirectoryWriter for the target directory. While streaming, the
+    size and md5 sum are compared with the manifest (verify). Files that the
+    writer already has are skipped and partial files of an interrupted run are
+    continued with range requests.
+
+    With a manifest_cache, manifests are only requested again when the cached
+    copy expired and the server reports a change. With a content_cache,
+    result files are taken from the cache before any request and verified
+    downloads are added to it.
+
+    The concurrent requests to the API host and the data hosts can be limited
+    by adaptive controllers that back off when the servers throttle, and the
+    transferred bytes by a rate_limit that is shared by all workers.
+
+    Every manifest and result file request is retried on its own according to
+    the retry policy. Requests time out after timeout seconds without data.
+
+    The progress of the transfers is reported to the listeners.
+    """
+
+    def __init__(self, url: str = "https://bakrep.computational.bio/api/v1/datasets/", workers: int = 1,
+                 api_pool_size: Optional[int] = None, data_pool_size: Optional[int] = None,
+                 chunk_size: int = 64 * 1024, verify: bool = True,
+                 manifest_cache: Optional[ManifestCache] = None,
+                 api_concurrency: Optional[AdaptiveConcurrency] = None,
+                 data_concurrency: Optional[AdaptiveConcurrency] = None,
+                 rate_limit: Optional[TokenBucket] = None,
+                 retry: Optional[RetryPolicy] = None, timeout: Optional[float] = 60,
+                 listeners: Iterable["DownloadListener"] = (),
+                 content_cache: Optional[ContentCache] = None):
         self.url = url
+        self.listeners = list(listeners)
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout
+        self.manifest_cache = manifest_cache
+        self.api_concurrency = api_concurrency
+        self.data_concurrency = data_concurrency
+        self.rate_limit = rate_limit
+        self.content_cache = content_cache
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.verify = verify
+        self.session = self._create_session(
+            url, api_pool_size or workers, data_pool_size or workers)
+        self._executor = None
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="bakrep-file")
+
+    @staticmethod
+    def _create_session(url: str, api_pool_size: int, data_pool_size: int):
+        session = requests.Session()
+        data_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=data_pool_size)
+        session.mount("https://", data_adapter)
+        session.mount("http://", data_adapter)
+        # the most specific prefix wins, so the api gets its own pool, even on the host of the files
+        session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=api_pool_size))
+        return session
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.session.close()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __enter__(self):
+        return self
 
-    def download(self, id: str, filters: List[dict], target_directory: str):
+    def _get(self, concurrency: Optional[AdaptiveConcurrency], url: str, **kwargs):
+        start = time.monotonic()
+        r = self.session.get(url, timeout=self.timeout, **kwargs)
+        if concurrency is not None:
+            concurrency.record(r.status_code, time.monotonic() - start)
+        return r
+
+    def fetch_dataset(self, id: str) -> Dataset:
+        return self.retry.call(lambda: self._fetch_dataset(id), self._on_retry(id, self.url + id))
+
+    def _on_retry(self, id: str, url: str):
+        return lambda attempt, e, delay: self._emit("retry", id, url, attempt, e, delay)
+
+    def _fetch_dataset(self, id: str) -> Dataset:
+        start = time.monotonic()
+        try:
+            (dataset, status_code) = self._request_dataset(id)
+        except Exception as e:
+            self._emit("manifest_failed", id, e)
+            raise
+        self._emit("manifest_fetched", id, status_code, time.monotonic() - start)
+        return dataset
+
+    def _request_dataset(self, id: str):
+        """
+        Returns the dataset and the status code of the response, which is None
+        for a fresh manifest from the cache
+        """
         dataset_url = self.url + id
-        r = requests.get(self.url + id)
-        if not r.ok:
-            raise DownloadFailedException(id, dataset_url, r.status_code)
-        json = r.json()
-        ds = Dataset.from_dict(json)
+        cache = self.manifest_cache
+        cached = None
+        headers = {}
+        if cache is not None:
+            cached = cache.get(id)
+            if cached is not None:
+                if cache.is_fresh(cached):
+                    return (_parse_dataset(id, dataset_url, cached.dataset), None)
+                headers = cached.conditional_headers()
+        try:
+            with _slot(self.api_concurrency), self._get(self.api_concurrency, dataset_url, headers=headers) as r:
+                if r.status_code == 304 and cache is not None and cached is not None:
+                    cache.revalidated(id, cached)
+                    return (_parse_dataset(id, dataset_url, cached.dataset), r.status_code)
+                if not r.ok:
+                    raise _failed_response(id, dataset_url, r)
+                json = r.json()
+        except requests.RequestException as e:
+            raise DownloadFailedException(id, dataset_url, e) from e
+        dataset = _parse_dataset(id, dataset_url, json)
+        if cache is not None:
+            cache.put(id, json, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return (dataset, r.status_code)
+
+    def download_result(self, id: str, res: Result, target: Union[str, Path, ResultWriter]):
+        """
+        Downloads a result file with a writer or into a target directory
+        """
+        writer = self._writer(target)
+        self.retry.call(lambda: self._download_result(id, res, writer), self._on_retry(id, res.url))
+
+    def _writer(self, target: Union[str, Path, ResultWriter]):
+        if isinstance(target, ResultWriter):
+            return target
+        return DirectoryWriter(lambda id: Path(target), self.chunk_size)
+
+    def _download_result(self, id: str, res: Result, writer: ResultWriter):
+        try:
+            self._store_result(id, res, writer)
+        except OSError as e:
+            # a failed write only fails the dataset of the result file
+            raise DownloadFailedException(id, res.url, e) from e
+
+    def _store_result(self, id: str, res: Result, writer: ResultWriter):
+        if writer.is_complete(id, res, self.verify):
+            self._emit("transfer_skipped", id, res)
+            return
+        if self.content_cache is not None and self.content_cache.restore(id, res, writer, self.verify):
+            self._emit("transfer_cached", id, res)
+            return
+        self._emit("transfer_started", id, res)
+        start = time.monotonic()
+        try:
+            with self._open(writer, id, res) as out:
+                transferred = self._transfer(id, res, out)
+        except Exception as e:
+            self._emit("transfer_failed", id, res, e)
+            raise
+        self._emit("transfer_finished", id, res, transferred, time.monotonic() - start)
+
+    def _open(self, writer: ResultWriter, id: str, res: Result):
+        out = writer.open(id, res)
+        if self.content_cache is not None and self.verify:
+            # only verified files may be cached under their md5 sum
+            out = self.content_cache.output(res, out)
+        return out
+
+    def _transfer(self, id: str, res: Result, out: ResultOutput):
+        """
+        Streams a result file into the output, commits it and returns the number of transferred bytes
+        """
+        (offset, md5) = out.resume(self.verify)
+        headers = {}
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            with _slot(self.data_concurrency), \
+                    self._get(self.data_concurrency, res.url, stream=True, headers=headers) as r:
+                if not r.ok:
+                    if r.status_code == 416:
+                        # the partial file does not match the remote file
+                        out.discard()
+                    raise _failed_response(id, res.url, r)
+                if r.status_code != 206 or _content_range_start(r) != offset:
+                    # the server sends the whole file
+                    offset = 0
+                    md5 = hashlib.md5()
+                    out.reset()
+                size = offset
+                # read the raw stream, the files must be saved as they are served
+                for chunk in r.raw.stream(self.chunk_size, decode_content=False):
+                    if self.rate_limit is not None:
+                        self.rate_limit.consume(len(chunk))
+                    md5.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+                    self._emit("transfer_progress", id, res, len(chunk))
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            raise DownloadFailedException(id, res.url, e) from e
+        except CorruptResultError as e:
+            out.discard()
+            raise VerificationFailedException(id, res.url, str(e)) from e
+        if self.verify:
+            self._verify(id, res, out, size, md5.hexdigest())
+        try:
+            out.commit()
+        except CorruptResultError as e:
+            out.discard()
+            raise VerificationFailedException(id, res.url, str(e)) from e
+        return size - offset
+
+    def _emit(self, event: str, *args):
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    @staticmethod
+    def _verify(id: str, res: Result, out: ResultOutput, size: int, md5: str):
+        if size != res.size:
+            out.discard()
+            raise VerificationFailedException(
+                id, res.url, f"size mismatch: expected {res.size} bytes, got {size}")
+        if md5 != res.md5:
+            out.discard()
+            raise VerificationFailedException(
+                id, res.url, f"md5 mismatch: expected {res.md5}, got {md5}")
+
+    def download(self, id: str, filters: Union[Matcher, List[dict]], target: Union[str, Path, ResultWriter]):
+        ds = self.fetch_dataset(id)
         results = ds.filter(filters)
-        for res in results:
-            r = requests.get(res.url, stream=True)
-            if not r.ok:
-                raise DownloadFailedException(id, res.url, r.status_code)
-            result_url = urllib.parse.urlparse(res.url)
-            filename = Path(result_url.path).name
-            target = Path(target_directory) / filename
-            target.write_bytes(r.raw.data)
+        writer = self._writer(target)
+        if self._executor is None:
+            for res in results:
+                self.download_result(id, res, writer)
+            return
+        futures = [self._executor.submit(self.download_result, id, res, writer)
+                   for res in results]
+        wait(futures)
+        for f in futures:
+            f.result()
+
+    def iter_results(self, ids: Iterable[str], filters: Optional[Union[Matcher, List[dict]]] = None, **kwargs):
+        """
+        Yields the selected result files of the datasets as (dataset, result,
+        stream) without writing them to disk, see bakrep.stream.iter_results
+        """
+        # the pipeline is built on the downloader
+        from bakrep.stream import iter_results
+        return iter_results(self, ids, filters, **kwargs)
@@ -0,0 +1,183 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Union
+
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, Dataset, DownloadFailedException, Result
+from bakrep.writers import DirectoryWriter, ResultWriter
+
+
+class _DatasetState:
+    """
+    Tracks the result files of a dataset that are still in the transfer stage
+    """
+
+    def __init__(self, dataset: Dataset, results: List[Result]):
+        self.dataset = dataset
+        self.results = results
+        self.pending = len(results)
+        self.error: Optional[DownloadFailedException] = None
+        self._lock = threading.Lock()
+
+    def result_done(self, error: Optional[DownloadFailedException] = None):
+        """
+        Returns True when this was the last pending result of the dataset
+        """
+        with self._lock:
+            if error is not None and self.error is None:
+                self.error = error
+            self.pending -= 1
+            return self.pending == 0
+
+
+_END = object()
+
+
+class DownloadPipeline:
+    """
+    Downloads datasets in two stages.
+
+    Manifest workers resolve the manifests of the next datasets, apply the
+    filters and put the selected result files into a bounded queue. Transfer
+    workers take the result files from the queue and download them. The queue
+    size limits how far the manifest stage runs ahead of the transfers.
+
+    The result files are stored by the writer, or in the directory that
+    target_directory returns for a dataset id.
+
+    The selected result files of a dataset are queued in the order that
+    order_results returns.
+
+    Every resolved manifest is reported to on_manifest before the filters
+    are applied, its selected result files to on_resolved and every
+    downloaded result file to on_result. A dataset is
+    reported to on_finished when all of its result files were
+    downloaded and to on_failed otherwise, like for a malformed manifest or a
+    failed write. The callbacks are called from the worker threads.
+    """
+
+    def __init__(self, downloader: BakrepDownloader, filters: Union[Matcher, List[dict]],
+                 target_directory: Union[Callable[[str], Path], ResultWriter],
+                 manifest_workers: int = 2, transfer_workers: int = 1, queue_size: Optional[int] = None,
+                 order_results: Callable[[List[Result]], List[Result]] = lambda results: results,
+                 on_started: Callable[[str], None] = lambda id: None,
+                 on_manifest: Callable[[Dataset], None] = lambda dataset: None,
+                 on_resolved: Callable[[str, List[Result]], None] = lambda id, results: None,
+                 on_result: Callable[[str, Result], None] = lambda id, res: None,
+                 on_finished: Callable[[str], None] = lambda id: None,
+                 on_failed: Callable[[str, DownloadFailedException], None] = lambda id, e: None):
+        self.downloader = downloader
+        self.filters = Matcher.of(filters)
+        self.writer = target_directory if isinstance(target_directory, ResultWriter) \
+            else DirectoryWriter(target_directory, downloader.chunk_size)
+        self.manifest_workers = manifest_workers
+        self.transfer_workers = transfer_workers
+        self.queue_size = queue_size or 4 * transfer_workers
+        self.order_results = order_results
+        self.on_started = on_started
+        self.on_manifest = on_manifest
+        self.on_resolved = on_resolved
+        self.on_result = on_result
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+        self._ids_lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._stopped = threading.Event()
+
+    def run(self, ids: Iterable[str]):
+        """
+        Downloads the datasets and blocks until all of them are done
+        """
+        self._ids = iter(ids)
+        self._queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        manifest_threads = [self._start(self._manifest_worker, f"bakrep-manifest-{i}")
+                            for i in range(self.manifest_workers)]
+        transfer_threads = [self._start(self._transfer_worker, f"bakrep-transfer-{i}")
+                            for i in range(self.transfer_workers)]
+        for t in manifest_threads:
+            t.join()
+        for _ in transfer_threads:
+            self._queue.put(_END)
+        for t in transfer_threads:
+            t.join()
+        if self._error is not None:
+            raise self._error
+
+    @staticmethod
+    def _start(target: Callable, name: str):
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        return t
+
+    def _next_id(self):
+        with self._ids_lock:
+            return next(self._ids, None)
+
+    def stop(self):
+        """
+        Stops the workers. Transfers that already started are completed and
+        run returns once they are done.
+        """
+        self._stopped.set()
+
+    def _stop(self, error: BaseException):
+        if self._error is None:
+            self._error = error
+        self._stopped.set()
+
+    def _manifest_worker(self):
+        try:
+            while not self._stopped.is_set():
+                id = self._next_id()
+                if id is None:
+                    return
+                self._resolve(id)
+        except BaseException as e:
+            self._stop(e)
+
+    def _resolve(self, id: str):
+        self.on_started(id)
+        try:
+            dataset = self.downloader.fetch_dataset(id)
+        except DownloadFailedException as e:
+            self.on_failed(id, e)
+            return
+        self.on_manifest(dataset)
+        results = self.order_results(dataset.filter(self.filters))
+        self.on_resolved(id, results)
+        if len(results) == 0:
+            self.on_finished(id)
+            return
+        state = _DatasetState(dataset, results)
+        for res in results:
+            self._queue.put((state, res))
+
+    def _transfer_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if self._stopped.is_set():
+                # keep draining the queue, so that the manifest workers do not block
+                continue
+            (state, res) = item
+            try:
+                self._transfer(state, res)
+            except BaseException as e:
+                self._stop(e)
+
+    def _transfer(self, state: _DatasetState, res: Result):
+        id = state.dataset.id
+        error = None
+        if state.error is None:
+            try:
+                self.downloader.download_result(id, res, self.writer)
+                self.on_result(id, res)
+            except DownloadFailedException as e:
+                error = e
+        if state.result_done(error):
+            if state.error is None:
+                self.on_finished(id)
+            else:
+                self.on_failed(id, state.error)
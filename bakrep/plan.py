@@ -0,0 +1,189 @@
+import collections
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bakrep.console import _format_bytes, _format_duration
+from bakrep.content_cache import ContentCache
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, DownloadFailedException, Result
+from bakrep.writers import ResultOutput, ResultWriter
+
+DOWNLOAD = "download"
+PRESENT = "present"
+CACHED = "cached"
+
+
+class _Group:
+    def __init__(self):
+        self.files: Dict[str, int] = collections.Counter()
+        self.bytes: Dict[str, int] = collections.Counter()
+
+
+class Plan:
+    """
+    The result files that a download would fetch, grouped by tool and
+    filetype, and whether they are already present or cached.
+
+    A uniform random sample of sample_size files to download is kept
+    (reservoir sampling) to measure the throughput.
+    """
+
+    def __init__(self, sample_size: int = 8, seed: int = 0):
+        self.groups: Dict[Tuple[str, str], _Group] = collections.defaultdict(_Group)
+        self.datasets = 0
+        self.failed: List[str] = []
+        self.sample_size = sample_size
+        self.sample: List[Tuple[str, Result]] = []
+        self._candidates = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def add_dataset(self, id: str, results: List[Tuple[Result, str]]):
+        with self._lock:
+            self.datasets += 1
+            for (res, state) in results:
+                group = self.groups[(res.attributes.get("tool", ""), res.attributes.get("filetype", ""))]
+                group.files[state] += 1
+                group.bytes[state] += res.size
+                if state == DOWNLOAD:
+                    self._sample(id, res)
+
+    def _sample(self, id: str, res: Result):
+        self._candidates += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append((id, res))
+            return
+        i = self._random.randrange(self._candidates)
+        if i < self.sample_size:
+            self.sample[i] = (id, res)
+
+    def add_failed(self, id: str):
+        with self._lock:
+            self.failed.append(id)
+
+    def total(self, state: str):
+        return sum(g.bytes[state] for g in self.groups.values())
+
+
+def resolve(downloader: BakrepDownloader, ids: Iterable[str], filters: Matcher, writer: ResultWriter,
+            workers: int = 2, content_cache: Optional[ContentCache] = None, plan: Optional[Plan] = None):
+    """
+    Resolves the manifests with concurrent workers and classifies the
+    selected result files of every dataset
+    """
+    plan = plan or Plan()
+    it = iter(ids)
+    lock = threading.Lock()
+
+    def next_id():
+        with lock:
+            return next(it, None)
+
+    def worker():
+        while True:
+            id = next_id()
+            if id is None:
+                return
+            try:
+                dataset = downloader.fetch_dataset(id)
+            except DownloadFailedException:
+                plan.add_failed(id)
+                continue
+            plan.add_dataset(id, [(res, _state(id, res, writer, content_cache)) for res in dataset.filter(filters)])
+
+    threads = [threading.Thread(target=worker, name=f"bakrep-plan-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return plan
+
+
+def _state(id: str, res: Result, writer: ResultWriter, content_cache: Optional[ContentCache]):
+    # only the size of present files is compared, reading them all would take as long as the download
+    if writer.is_complete(id, res, False):
+        return PRESENT
+    if content_cache is not None and content_cache.contains(res.md5, res.size):
+        return CACHED
+    return DOWNLOAD
+
+
+class _DiscardWriter(ResultWriter):
+    def open(self, id: str, res: Result):
+        return _DiscardOutput()
+
+
+class _DiscardOutput(ResultOutput):
+    def write(self, chunk: bytes):
+        pass
+
+    def commit(self):
+        pass
+
+
+def measure_throughput(downloader: BakrepDownloader, sample: List[Tuple[str, Result]], workers: int = 1):
+    """
+    Downloads the sample with concurrent workers and returns the transferred
+    bytes per second, or None without a usable sample
+    """
+    if len(sample) == 0:
+        return None
+    writer = _DiscardWriter()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        done = list(executor.map(lambda item: _download_sample(downloader, writer, *item), sample))
+    elapsed = time.monotonic() - start
+    transferred = sum(done)
+    if transferred == 0 or elapsed <= 0:
+        return None
+    return transferred / elapsed
+
+
+def _download_sample(downloader: BakrepDownloader, writer: ResultWriter, id: str, res: Result):
+    try:
+        downloader.download_result(id, res, writer)
+        return res.size
+    except DownloadFailedException:
+        return 0
+
+
+def report(plan: Plan, throughput: Optional[float], directory: Path, decompress: bool = False):
+    """
+    The lines of the plan and whether there is enough free space for it
+    """
+    lines = [f"Plan for {plan.datasets} datasets, {len(plan.failed)} manifests could not be resolved"]
+    lines.append(f"{'tool':<14}{'filetype':<10}{'files':>10}{'size':>12}{'present':>12}{'cached':>12}{'download':>12}")
+    rows = sorted(plan.groups.items())
+    totals = _Group()
+    for ((tool, filetype), g) in rows:
+        lines.append(_row(tool, filetype, g))
+        totals.files.update(g.files)
+        totals.bytes.update(g.bytes)
+    lines.append(_row("total", "", totals))
+
+    to_download = plan.total(DOWNLOAD)
+    if throughput is None:
+        lines.append("Estimated duration: unknown, no sample could be downloaded")
+    else:
+        lines.append(f"Estimated duration: {_format_duration(to_download / throughput)} "
+                     f"at {_format_bytes(throughput)}/s (sample of {len(plan.sample)} files)")
+
+    # cached files may have to be copied
+    required = to_download + plan.total(CACHED)
+    free = shutil.disk_usage(directory).free
+    lines.append(f"Free space in {directory}: {_format_bytes(free)}, required: {_format_bytes(required)}")
+    if decompress:
+        lines.append("The decompressed files need more space than their compressed size")
+    return (lines, required <= free)
+
+
+def _row(tool: str, filetype: str, g: _Group):
+    files = sum(g.files.values())
+    size = sum(g.bytes.values())
+    return (f"{tool:<14}{filetype:<10}{files:>10}{_format_bytes(size):>12}{_format_bytes(g.bytes[PRESENT]):>12}"
+            f"{_format_bytes(g.bytes[CACHED]):>12}{_format_bytes(g.bytes[DOWNLOAD]):>12}")
@@ -0,0 +1,142 @@
+import datetime
+import re
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple
+
+_SHARD_DIRECTORY = re.compile(r"^shard-(\d+)-of-(\d+)$")
+
+STATES = ["downloaded", "failed", "pending"]
+
+
+def progress_locations(directory: Path) -> List[Tuple[str, Path]]:
+    """
+    The progress databases of a download directory: the one of an unsharded
+    download and one per shard, ordered by shard
+    """
+    p = directory / '.progress'
+    locations = []
+    if (p / 'progress.sqlite').exists():
+        locations.append(("unsharded", p / 'progress.sqlite'))
+    shards = []
+    for d in p.glob('shard-*-of-*'):
+        m = _SHARD_DIRECTORY.match(d.name)
+        if m is not None and (d / 'progress.sqlite').exists():
+            shards.append(((int(m.group(2)), int(m.group(1))), d.name, d / 'progress.sqlite'))
+    locations.extend((name, path) for (_, name, path) in sorted(shards))
+    return locations
+
+
+class JobProgress:
+    """
+    The merged progress of all shards of a download directory.
+
+    The queued datasets of every progress database are merged into one
+    in-memory table. A dataset that appears in several databases is
+    downloaded when any of them downloaded it, and keeps its latest failure.
+    The databases are opened read-only, so the progress can be checked
+    while the shards run.
+    """
+
+    def __init__(self, directory: Path):
+        self.shards: List[Tuple[str, Tuple[int, int, int]]] = []
+        self._db = sqlite3.connect(":memory:", uri=True)
+        self._db.execute(
+            "CREATE TABLE job (id TEXT PRIMARY KEY, seq INTEGER, queued INTEGER, downloaded INTEGER, failed INTEGER)")
+        self._db.execute("CREATE TABLE failure (dataset TEXT PRIMARY KEY, url TEXT, status INTEGER, error TEXT, "
+                         "message TEXT, retryable INTEGER, attempts INTEGER, time REAL)")
+        for (name, path) in progress_locations(directory):
+            self._db.execute("ATTACH DATABASE ? AS shard", (path.resolve().as_uri() + "?mode=ro",))
+            try:
+                self.shards.append((name, self._counts("shard.datasets")))
+                # keep the input order of every shard, one shard after the other
+                (offset,) = self._db.execute("SELECT coalesce(max(seq), 0) FROM job").fetchone()
+                self._db.execute(
+                    "INSERT INTO job SELECT id, ? + seq, 1, downloaded, failed FROM shard.datasets WHERE queued "
+                    "ON CONFLICT (id) DO UPDATE SET downloaded = max(downloaded, excluded.downloaded), "
+                    "failed = max(failed, excluded.failed)", (offset,))
+                # the last failure of every dataset
+                self._db.execute(
+                    "INSERT INTO failure SELECT * FROM shard.failures WHERE true "
+                    "ON CONFLICT (dataset) DO UPDATE SET url = excluded.url, status = excluded.status, "
+                    "error = excluded.error, message = excluded.message, retryable = excluded.retryable, "
+                    "attempts = excluded.attempts, time = excluded.time WHERE excluded.time > time")
+                self._db.commit()
+            finally:
+                self._db.execute("DETACH DATABASE shard")
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _counts(self, table: str):
+        (total, downloaded, failed) = self._db.execute(
+            "SELECT count(*), coalesce(sum(downloaded), 0), coalesce(sum(failed AND NOT downloaded), 0) "
+            f"FROM {table} WHERE queued").fetchone()
+        return (downloaded, failed, total - downloaded - failed)
+
+    def counts(self):
+        """
+        The number of downloaded, failed and pending datasets of the whole job
+        """
+        return self._counts("job")
+
+    def ids(self, state: str):
+        conditions = {
+            "downloaded": "downloaded",
+            "failed": "failed AND NOT downloaded",
+            "pending": "NOT failed AND NOT downloaded",
+        }
+        for (id,) in self._db.execute(f"SELECT id FROM job WHERE {conditions[state]} ORDER BY seq"):
+            yield id
+
+    def failures(self):
+        """
+        The recorded failures of the failed datasets: id, url, status code,
+        error class, message, retryable, attempts and time
+        """
+        return self._db.execute(
+            "SELECT f.dataset, f.url, f.status, f.error, f.message, f.retryable, f.attempts, f.time FROM failure f "
+            "JOIN job j ON j.id = f.dataset WHERE j.failed AND NOT j.downloaded ORDER BY j.seq")
+
+
+def _format_failure(failure: tuple):
+    (id, url, status, error, message, retryable, attempts, time) = failure
+    failed_at = datetime.datetime.fromtimestamp(time, datetime.timezone.utc).isoformat(timespec="seconds")
+    # the messages of exceptions may span several lines, every failure is one line of the tsv
+    message = " ".join(message.split())
+    return "\t".join([id, url, "" if status is None else str(status), error, "yes" if retryable else "no",
+                      str(attempts), failed_at, message])
+
+
+def _format_counts(name: str, counts: Tuple[int, int, int]):
+    (downloaded, failed, pending) = counts
+    return (f"{name}: {downloaded + failed + pending} datasets, {downloaded} downloaded, "
+            f"{failed} failed, {pending} pending")
+
+
+def check_args(args):
+    if len(progress_locations(Path(args.directory))) == 0:
+        return f"there is no download progress in '{args.directory}'"
+    return None
+
+
+def progress(args):
+    with JobProgress(Path(args.directory)) as job:
+        if args.failures:
+            print("#id\turl\tstatus\terror\tretryable\tattempts\tfailed_at\tmessage")
+            for failure in job.failures():
+                print(_format_failure(failure))
+            return
+        if not args.list is None:
+            for id in job.ids(args.list):
+                print(id)
+            return
+        for (name, counts) in job.shards:
+            print(_format_counts(name, counts))
+        print(_format_counts("total", job.counts()))
@@ -0,0 +1,75 @@
+import email.utils
+import random
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+RETRYABLE_STATUS_CODES = frozenset([408, 416, 425, 429])
+
+
+def is_retryable_status(status_code: int):
+    """
+    Server errors, throttling and timeouts are worth another attempt, other
+    client errors like 404 are permanent
+    """
+    return status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header, given in seconds or as an HTTP date
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    Retries failed requests with exponential backoff.
+
+    The n-th retry waits a random time between 0 and backoff * 2^n seconds,
+    but at most max_backoff seconds ("full jitter"), unless the server asked
+    for a longer pause with Retry-After. Only retryable failures are retried.
+    """
+
+    def __init__(self, max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 60.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, fn: Callable, on_retry: Callable[[int, Exception, float], None] = lambda attempt, e, delay: None):
+        """
+        Calls fn until it succeeds, raises a permanent error or runs out of
+        retries. Errors are retried when their retryable attribute is set,
+        like for a DownloadFailedException. The number of attempts is set on
+        errors with an attempts attribute.
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if not getattr(e, "retryable", False) or attempt >= self.max_retries:
+                    if hasattr(e, "attempts"):
+                        setattr(e, "attempts", attempt + 1)
+                    raise e
+                delay = self.delay(attempt, getattr(e, "retry_after", None))
+                on_retry(attempt + 1, e, delay)
+                self.sleep(delay)
+                attempt += 1
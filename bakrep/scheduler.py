@@ -0,0 +1,107 @@
+import threading
+from typing import List
+
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, DownloadFailedException, DownloadSet, Result
+
+SCHEDULERS = ["input", "smallest", "largest", "interleave"]
+
+
+class Scheduler:
+    """
+    The order in which the pending datasets of a download are started.
+
+    The order is computed from the progress database alone, the input order
+    and the recorded sizes of the datasets, so the same job is scheduled the
+    same way on every run. Ties are broken by the input order.
+    """
+
+    name = "input"
+    needs_sizes = False
+    order_by = "seq"
+
+    def pending(self, set: DownloadSet):
+        return set.pending(order_by=self.order_by)
+
+    def order_results(self, results: List[Result]) -> List[Result]:
+        return results
+
+    @staticmethod
+    def of(name: str) -> "Scheduler":
+        if name == "input":
+            return Scheduler()
+        if name == "smallest":
+            return SizeScheduler(largest=False)
+        if name == "largest":
+            return SizeScheduler(largest=True)
+        if name == "interleave":
+            return InterleaveScheduler()
+        raise ValueError(f"unknown order '{name}', expected one of {', '.join(SCHEDULERS)}")
+
+
+class SizeScheduler(Scheduler):
+    """
+    Orders the datasets by the size of their selected result files.
+
+    Largest first keeps all transfer workers busy until the end of the job,
+    because only small files are left for the last workers. Smallest first
+    completes the most datasets early. The result files of a dataset are
+    ordered the same way. Datasets without a known size come last.
+    """
+
+    needs_sizes = True
+
+    def __init__(self, largest: bool):
+        self.largest = largest
+        self.name = "largest" if largest else "smallest"
+        self.order_by = f"size IS NULL, size {'DESC' if largest else 'ASC'}, seq"
+
+    def order_results(self, results: List[Result]) -> List[Result]:
+        return sorted(results, key=lambda res: res.size, reverse=self.largest)
+
+
+class InterleaveScheduler(Scheduler):
+    """
+    Takes the datasets from the id prefix groups in turns, see _path_for_id,
+    so that the downloads are spread over the groups instead of working
+    through one group after another. Within a group the input order is kept.
+    """
+
+    name = "interleave"
+    order_by = "row_number() OVER (PARTITION BY substr(id, 4, 4) ORDER BY seq), substr(id, 4, 4)"
+
+
+def resolve_sizes(downloader: BakrepDownloader, set: DownloadSet, filters: Matcher, workers: int = 2):
+    """
+    Resolves the manifests of the pending datasets without a known size with
+    concurrent workers and records the size of their selected result files.
+    Returns the number of datasets whose manifest could not be resolved.
+    """
+    it = set.unsized()
+    lock = threading.Lock()
+    failed = [0]
+
+    def next_id():
+        with lock:
+            return next(it, None)
+
+    def worker():
+        while True:
+            id = next_id()
+            if id is None:
+                return
+            try:
+                dataset = downloader.fetch_dataset(id)
+            except DownloadFailedException:
+                with lock:
+                    failed[0] += 1
+                continue
+            set.set_size(id, sum(res.size for res in dataset.filter(filters)))
+
+    threads = [threading.Thread(target=worker, name=f"bakrep-sizes-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    set.flush()
+    return failed[0]
@@ -0,0 +1,45 @@
+import zlib
+from typing import Iterable
+
+
+class Shard:
+    """
+    One of count disjoint parts of a download job.
+
+    Every dataset id belongs to exactly one shard, decided by a stable hash
+    of the id, so independent nodes with the same count and different
+    indices split a job without coordination. The index starts at 1.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1 or index < 1 or index > count:
+            raise ValueError(f"invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @staticmethod
+    def parse(value: str):
+        """
+        Parses a shard given as K/N
+        """
+        (index, sep, count) = value.partition("/")
+        if sep != "/" or not index.strip().isdigit() or not count.strip().isdigit():
+            raise ValueError(f"invalid shard '{value}', expected K/N")
+        return Shard(int(index), int(count))
+
+    @property
+    def name(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+    def contains(self, id: str):
+        # crc32 does not depend on the interpreter, unlike hash() of a str
+        return zlib.crc32(id.encode("utf-8")) % self.count == self.index - 1
+
+    def filter(self, ids: Iterable[str]):
+        return (id for id in ids if self.contains(id))
+
+    def __eq__(self, other):
+        return isinstance(other, Shard) and (self.index, self.count) == (other.index, other.count)
+
+    def __repr__(self):
+        return f"Shard({self.index}/{self.count})"
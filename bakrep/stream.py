@@ -0,0 +1,182 @@
+import gzip
+import io
+import json
+import queue
+import tempfile
+import threading
+from typing import IO, Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, Dataset, DownloadFailedException, Result
+from bakrep.pipeline import DownloadPipeline
+from bakrep.writers import GunzipWriter, ResultOutput, ResultWriter, _GunzipOutput
+
+_END = object()
+
+
+class _SpoolWriter(ResultWriter):
+    """
+    Keeps every result file in a SpooledTemporaryFile, which stays in memory
+    up to spool_size bytes and is moved to a temporary file beyond. Committed
+    files are handed to done.
+    """
+
+    def __init__(self, done: Callable[[str, Result, IO[bytes]], None], spool_size: int, decompress: bool):
+        self.done = done
+        self.spool_size = spool_size
+        self.decompress = decompress
+
+    def open(self, id: str, res: Result):
+        out = _SpoolOutput(self, id, res)
+        if self.decompress and res.filename().endswith(".gz"):
+            return _GunzipOutput(out, GunzipWriter.max_output)
+        return out
+
+
+class _SpoolOutput(ResultOutput):
+    def __init__(self, writer: _SpoolWriter, id: str, res: Result):
+        self.writer = writer
+        self.id = id
+        self.res = res
+        self._spool: IO[bytes] = tempfile.SpooledTemporaryFile(max_size=writer.spool_size)
+        self._committed = False
+
+    def reset(self):
+        self._spool.seek(0)
+        self._spool.truncate()
+
+    def write(self, chunk: bytes):
+        self._spool.write(chunk)
+
+    def commit(self):
+        # the consumer owns the spool from now on
+        self._committed = True
+        self._spool.seek(0)
+        self.writer.done(self.id, self.res, self._spool)
+
+    def discard(self):
+        self.reset()
+
+    def close(self):
+        if not self._committed:
+            self._spool.close()
+
+
+def _decode_json(res: Result, stream: IO[bytes], decompressed: bool):
+    name = res.filename()
+    if name.endswith(".json.gz") and not decompressed:
+        return json.load(gzip.GzipFile(fileobj=stream, mode="rb"))
+    if name.endswith(".json") or name.endswith(".json.gz"):
+        return json.load(io.TextIOWrapper(stream, encoding="utf-8"))
+    return None
+
+
+def iter_results(downloader: BakrepDownloader, ids: Iterable[str],
+                 filters: Optional[Union[Matcher, List[dict]]] = None, workers: int = 4, manifest_workers: int = 2,
+                 prefetch: Optional[int] = None, decompress: bool = False, decode_json: bool = False,
+                 spool_size: int = 1024 * 1024,
+                 on_failed: Optional[Callable[[str, DownloadFailedException], None]] = None
+                 ) -> Generator[Tuple[Dataset, Result, Any], None, None]:
+    """
+    Downloads the selected result files of the datasets and yields them as
+    (dataset, result, stream) without writing them to the output directory.
+    The dataset holds the selected result files only, all files are selected
+    without filters.
+
+    The manifests are resolved and the files downloaded by a DownloadPipeline
+    with the given number of workers, while the consumer processes earlier
+    files. The files are yielded in the order they complete. At most
+    prefetch downloaded files (default 2 * workers) wait for the consumer,
+    every one in memory up to spool_size bytes and in a temporary file
+    beyond, so the memory stays bounded however far the consumer lags
+    behind. A stream is closed when the next file is requested.
+
+    With decompress, gzip compressed files are decompressed while they are
+    downloaded. With decode_json, JSON files (compressed or not) are yielded
+    as the decoded object instead of a stream.
+
+    A failed dataset is reported to on_failed. Without on_failed, the
+    DownloadFailedException is raised to the consumer. Result files of the
+    dataset that were downloaded before the failure have already been
+    yielded. Leaving the loop early stops the downloads.
+    """
+    results: queue.Queue = queue.Queue(maxsize=prefetch or 2 * workers)
+    closed = threading.Event()
+    datasets: Dict[str, Dataset] = {}
+    lock = threading.Lock()
+
+    def put(item):
+        # the consumer may stop early, so the workers must not block forever
+        while not closed.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def done(id: str, res: Result, spool: IO[bytes]):
+        with lock:
+            dataset = datasets[id]
+        if not put((dataset, res, spool)):
+            spool.close()
+
+    def resolved(id: str, selected: List[Result]):
+        with lock:
+            datasets[id] = Dataset(id, selected)
+
+    def finished(id: str):
+        with lock:
+            datasets.pop(id, None)
+
+    def failed(id: str, e: DownloadFailedException):
+        finished(id)
+        if on_failed is None:
+            put(e)
+        else:
+            on_failed(id, e)
+
+    pipeline = DownloadPipeline(downloader, filters or [], _SpoolWriter(done, spool_size, decompress),
+                                manifest_workers=manifest_workers, transfer_workers=workers,
+                                on_resolved=resolved, on_finished=finished, on_failed=failed)
+
+    def run():
+        try:
+            pipeline.run(ids)
+        except BaseException as e:
+            put(e)
+        put(_END)
+
+    runner = threading.Thread(target=run, name="bakrep-stream", daemon=True)
+    runner.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            (dataset, res, stream) = item
+            with stream:
+                if decode_json:
+                    value = _decode_json(res, stream, decompress)
+                    if value is not None:
+                        yield (dataset, res, value)
+                        continue
+                yield (dataset, res, stream)
+    finally:
+        closed.set()
+        pipeline.stop()
+        _drain(results)
+        runner.join()
+        _drain(results)
+
+
+def _drain(results: queue.Queue):
+    while True:
+        try:
+            item = results.get_nowait()
+        except queue.Empty:
+            return
+        if isinstance(item, tuple):
+            item[2].close()
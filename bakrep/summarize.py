@@ -0,0 +1,262 @@
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from bakrep.model import _batched
+
+# the columns of every tool and the path to their value in the json of the tool
+COLUMNS: Dict[str, Sequence[Tuple[str, tuple]]] = {
+    "checkm2": [
+        ("completeness", ("quality", "completeness")),
+        ("contamination", ("quality", "contamination")),
+        ("model", ("calculation", "model")),
+        ("translation_table", ("calculation", "translation_table")),
+    ],
+    "gtdbtk": [(rank, ("classification", rank))
+               for rank in ["domain", "phylum", "class", "order", "family", "genus", "species"]] + [
+        ("fastani_reference", ("fastani_reference",)),
+        ("classification_method", ("classification_method",)),
+    ],
+    # mlst reports a list with one entry per input file
+    "mlst": [
+        ("scheme", (0, "scheme")),
+        ("sequence_type", (0, "sequence_type")),
+        ("alleles", (0, "alleles")),
+    ],
+    "assemblyscan": [(key, (key,)) for key in [
+        "total_contig", "total_contig_length", "max_contig_length", "mean_contig_length", "median_contig_length",
+        "min_contig_length", "n50_contig_length", "l50_contig_count", "num_contig_non_acgtn",
+        "contig_percent_a", "contig_percent_c", "contig_percent_g", "contig_percent_t", "contig_percent_n",
+        "contig_non_acgtn", "contigs_greater_1m", "contigs_greater_100k", "contigs_greater_10k", "contigs_greater_1k",
+        "percent_contigs_greater_1m", "percent_contigs_greater_100k", "percent_contigs_greater_10k",
+        "percent_contigs_greater_1k"]],
+}
+
+TOOLS = list(COLUMNS)
+
+HEADER = ["id"] + [f"{tool}_{name}" for (tool, columns) in COLUMNS.items() for (name, _) in columns]
+
+# a file of a dataset: its path, size and modification time
+SourceFile = Tuple[str, int, int]
+
+
+def _value(data, path: tuple):
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    if isinstance(data, dict):
+        # e.g. the alleles of mlst, in the notation of mlst
+        return ",".join(f"{k}({v})" for (k, v) in data.items())
+    if isinstance(data, list):
+        return ",".join(str(v) for v in data)
+    return data
+
+
+def _tool_file(id: str, name: str):
+    """
+    The tool of a result file name of the dataset, compressed or decompressed
+    """
+    for tool in TOOLS:
+        if name == f"{id}.{tool}.json.gz" or name == f"{id}.{tool}.json":
+            return tool
+    return None
+
+
+def _dataset_files(id: str, entries: Iterable[os.DirEntry]) -> Dict[str, SourceFile]:
+    files = {}
+    for e in entries:
+        tool = _tool_file(id, e.name)
+        if tool is not None and e.is_file():
+            s = e.stat()
+            files[tool] = (e.path, s.st_size, s.st_mtime_ns)
+    return files
+
+
+def scan(directory: Path) -> Iterator[Tuple[str, Dict[str, SourceFile]]]:
+    """
+    Finds the datasets with results of the summarized tools in a download
+    directory, in the layout of _path_for_id with and without --flat, and
+    yields their ids with the files per tool
+    """
+    with os.scandir(directory) as level1:
+        for d in sorted((e for e in level1 if e.is_dir() and not e.name.startswith(".")), key=lambda e: e.name):
+            with os.scandir(d.path) as level2:
+                entries = list(level2)
+            # a dataset directory of a flat download
+            files = _dataset_files(d.name, entries)
+            if len(files) > 0:
+                yield (d.name, files)
+            for sub in sorted((e for e in entries if e.is_dir()), key=lambda e: e.name):
+                with os.scandir(sub.path) as level3:
+                    files = _dataset_files(sub.name, level3)
+                if len(files) > 0:
+                    yield (sub.name, files)
+
+
+def _signature(files: Dict[str, SourceFile]):
+    return ";".join(f"{tool}:{size}:{mtime}" for (tool, (_, size, mtime)) in sorted(files.items()))
+
+
+def _read_json(path: str):
+    with open(path, "rb") as f:
+        if f.peek(2)[:2] == b"\x1f\x8b":
+            return json.load(gzip.GzipFile(fileobj=f, mode="rb"))
+        return json.load(f)
+
+
+def summarize_dataset(item: Tuple[str, Dict[str, SourceFile]]):
+    """
+    Parses the files of a dataset and returns its row and the signature of
+    the files that could be parsed. Runs in the worker processes.
+    """
+    (id, files) = item
+    row: list = [id]
+    parsed = {}
+    for (tool, columns) in COLUMNS.items():
+        data = None
+        if tool in files:
+            try:
+                data = _read_json(files[tool][0])
+                parsed[tool] = files[tool]
+            except (OSError, EOFError, ValueError):
+                # e.g. removed or corrupt, it is parsed again on the next run
+                pass
+        row.extend(_value(data, path) for (_, path) in columns)
+    return (_signature(parsed), row)
+
+
+def _quote(column: str):
+    return '"' + column + '"'
+
+
+class SummaryStore:
+    """
+    The summary table of a download in an SQLite database. Every dataset is
+    a row with the signature of the files it was parsed from (size and
+    modification time per tool), so only new and changed datasets are
+    parsed again.
+    """
+
+    def __init__(self, path: Path):
+        self._db = sqlite3.connect(str(path))
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS summary (id TEXT PRIMARY KEY, files TEXT NOT NULL, "
+                         f"{', '.join(_quote(c) for c in HEADER[1:])})")
+        self._db.execute("CREATE TEMP TABLE seen (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def changed(self, datasets: List[Tuple[str, Dict[str, SourceFile]]]):
+        """
+        Marks the datasets as seen and returns the ones that are new or changed
+        """
+        self._db.executemany("INSERT OR IGNORE INTO seen (id) VALUES (?)", ((id,) for (id, _) in datasets))
+        changed = []
+        for (id, files) in datasets:
+            row = self._db.execute("SELECT files FROM summary WHERE id = ?", (id,)).fetchone()
+            if row is None or row[0] != _signature(files):
+                changed.append((id, files))
+        return changed
+
+    def put(self, rows: Iterable[Tuple[str, list]]):
+        self._db.executemany(
+            f"INSERT OR REPLACE INTO summary (id, files, {', '.join(_quote(c) for c in HEADER[1:])}) "
+            f"VALUES ({', '.join('?' * (len(HEADER) + 1))})",
+            ((row[0], signature, *row[1:]) for (signature, row) in rows))
+        self._db.commit()
+
+    def remove_unseen(self):
+        """
+        Removes the datasets that were not seen, e.g. deleted from the download
+        """
+        removed = self._db.execute("DELETE FROM summary WHERE id NOT IN (SELECT id FROM seen)").rowcount
+        self._db.commit()
+        return removed
+
+    def count(self):
+        return self._db.execute("SELECT count(*) FROM summary").fetchone()[0]
+
+    def rows(self):
+        return self._db.execute(f"SELECT {', '.join(_quote(c) for c in HEADER)} FROM summary ORDER BY id")
+
+    def write_tsv(self, path: Path):
+        (fd, tmp) = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("#" + "\t".join(HEADER) + "\n")
+                for row in self.rows():
+                    f.write("\t".join("" if v is None else str(v) for v in row) + "\n")
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+def update(store: SummaryStore, directory: Path, workers: int = 1, batch_size: int = 10000):
+    """
+    Parses the new and changed datasets of a download directory with a pool
+    of worker processes and removes the datasets that are gone. The rows are
+    committed in batches, so an interrupted run keeps its progress.
+    Returns the number of parsed, unchanged and removed datasets.
+    """
+    parsed = 0
+    unchanged = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for batch in _batched(scan(directory), batch_size):
+            changed = store.changed(batch)
+            if executor is None:
+                rows: Iterable = map(summarize_dataset, changed)
+            else:
+                rows = executor.map(summarize_dataset, changed, chunksize=max(1, len(changed) // (4 * workers)))
+            store.put(rows)
+            parsed += len(changed)
+            unchanged += len(batch) - len(changed)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return (parsed, unchanged, store.remove_unseen())
+
+
+def _is_sqlite(output: str):
+    return Path(output).suffix in (".sqlite", ".db")
+
+
+def check_args(args):
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        return f"the download directory '{args.directory}' does not exist"
+    if Path(args.output).is_dir():
+        return "the output is a directory"
+    if args.workers < 1:
+        return "the number of workers must be at least 1"
+    return None
+
+
+def summarize(args):
+    directory = Path(args.directory)
+    output = Path(args.output)
+    store_path = output
+    if not _is_sqlite(args.output):
+        # the tsv is written from the table that is kept with the progress of the download
+        store_path = directory / ".progress" / "summary.sqlite"
+        store_path.parent.mkdir(parents=True, exist_ok=True)
+    with SummaryStore(store_path) as store:
+        (parsed, unchanged, removed) = update(store, directory, args.workers)
+        if not _is_sqlite(args.output):
+            store.write_tsv(output)
+        print(f"Summarized {store.count()} datasets: {parsed} parsed, {unchanged} unchanged, {removed} removed")
@@ -0,0 +1,118 @@
+import collections
+import threading
+from pathlib import Path
+from typing import Dict, Optional, TextIO, Tuple
+
+from bakrep.model import Dataset, DownloadSet, Result
+from bakrep.writers import ResultOutput, ResultWriter
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+
+class Changeset:
+    """
+    The result files that a sync added, changed or removed, counted and
+    optionally written to a tsv file as they happen
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.counts: Dict[str, int] = collections.Counter()
+        self.unchanged = 0
+        self._file: Optional[TextIO] = None
+        if not path is None:
+            self._file = open(path, "w")
+            self._file.write("#change\tid\tfile\n")
+        self._lock = threading.Lock()
+
+    def record(self, change: str, id: str, name: str):
+        with self._lock:
+            self.counts[change] += 1
+            if self._file is not None:
+                self._file.write(f"{change}\t{id}\t{name}\n")
+
+    def record_unchanged(self):
+        with self._lock:
+            self.unchanged += 1
+
+    def report(self):
+        return [f"Sync: {self.counts[ADDED]} files added, {self.counts[CHANGED]} changed, "
+                f"{self.counts[REMOVED]} removed, {self.unchanged} unchanged"]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SyncWriter(ResultWriter):
+    """
+    Compares the result files of a manifest with the files that were
+    downloaded before, as recorded in the download set.
+
+    A file whose recorded size and md5 sum match the manifest is unchanged
+    when the writer still has it, without reading it. Files without a
+    record are checked by the writer, e.g. the downloads of previous
+    versions. All other files are downloaded again and recorded in the
+    changeset once they are stored, see applied: as added when they were
+    not recorded or are missing, as changed otherwise.
+    """
+
+    def __init__(self, writer: ResultWriter, set: DownloadSet, changeset: Changeset):
+        self.writer = writer
+        self.set = set
+        self.changeset = changeset
+        self._pending: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def is_complete(self, id: str, res: Result, verify: bool):
+        name = res.filename()
+        recorded = self.set.finished_files(id).get(name)
+        if recorded == (res.size, res.md5) and self.writer.is_complete(id, res, False):
+            self.changeset.record_unchanged()
+            return True
+        if recorded is None and self.writer.is_complete(id, res, verify):
+            self.changeset.record_unchanged()
+            return True
+        # a recorded file that was deleted since is restored, like a new one
+        change = ADDED if recorded is None or not self.writer.exists(id, name) else CHANGED
+        with self._lock:
+            # the first check decides, retries of the transfer see the same state
+            self._pending.setdefault((id, name), change)
+        return False
+
+    def applied(self, id: str, res: Result):
+        """
+        Records a stored result file in the changeset
+        """
+        name = res.filename()
+        with self._lock:
+            change = self._pending.pop((id, name), None)
+        if change is not None:
+            self.changeset.record(change, id, name)
+
+    def prune(self, dataset: Dataset):
+        """
+        Removes the recorded files of a dataset that are no longer in its manifest
+        """
+        names = set(res.filename() for res in dataset.results)
+        for name in self.set.finished_files(dataset.id):
+            if not name in names and self.writer.remove(dataset.id, name):
+                self.set.remove_file(dataset.id, name)
+                self.changeset.record(REMOVED, dataset.id, name)
+
+    def exists(self, id: str, name: str):
+        return self.writer.exists(id, name)
+
+    def open(self, id: str, res: Result) -> ResultOutput:
+        return self.writer.open(id, res)
+
+    def link(self, id: str, res: Result, source: Path):
+        return self.writer.link(id, res, source)
+
+    def remove(self, id: str, name: str):
+        return self.writer.remove(id, name)
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,122 @@
+import threading
+import time
+from typing import Optional
+
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+
+
+class TokenBucket:
+    """
+    Limits the rate of a shared resource, e.g. bytes per second.
+
+    consume() blocks until the requested amount is available. The bucket may
+    go into debt, so a single large request waits proportionally instead of
+    never fitting into the bucket. A bucket is shared by all workers.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of concurrent requests to a host with AIMD.
+
+    The limit starts at maximum. Every successful request raises it by
+    increase / limit, i.e. by about increase per round of requests, and a
+    throttling response (429, 503) multiplies it by decrease. Decreases are
+    applied at most once per cooldown seconds, so a burst of throttled
+    requests counts as one event.
+
+    With a latency_threshold, a sharp rise of the response latency
+    decreases the limit as well: a short term average of the time until the
+    response headers arrive that is latency_factor times the long term
+    average and above latency_threshold seconds. The threshold keeps the
+    jitter of fast responses from reducing the limit.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, increase: float = 1.0, decrease: float = 0.5,
+                 latency_threshold: Optional[float] = None, latency_factor: float = 2.0, cooldown: float = 1.0):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.limit = float(maximum)
+        self.active = 0
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+    def record(self, status_code: int, latency: float):
+        """
+        Adjusts the limit after a response arrived
+        """
+        with self._condition:
+            if status_code in THROTTLE_STATUS_CODES:
+                self._decrease()
+            elif status_code < 500:
+                if self._latency_rises(latency):
+                    self._decrease()
+                else:
+                    self._increase()
+
+    def _latency_rises(self, latency: float):
+        if self.latency_threshold is None:
+            return False
+        if self._short_latency is None or self._long_latency is None:
+            self._short_latency = latency
+            self._long_latency = latency
+            return False
+        self._short_latency += 0.3 * (latency - self._short_latency)
+        self._long_latency += 0.01 * (latency - self._long_latency)
+        return (self._short_latency > self.latency_threshold
+                and self._short_latency > self.latency_factor * self._long_latency)
+
+    def _increase(self):
+        before = int(self.limit)
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+        if int(self.limit) > before:
+            self._condition.notify(int(self.limit) - before)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
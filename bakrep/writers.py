@@ -0,0 +1,599 @@
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from bakrep.model import Result
+
+
+class CorruptResultError(Exception):
+    """
+    An output could not process the content of a result file, e.g. an invalid gzip stream
+    """
+    pass
+
+
+def _md5sum(path: Path, chunk_size: int):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5
+
+
+class ResultOutput:
+    """
+    The destination of a single result file transfer.
+
+    resume() is called first and returns the number of bytes that are
+    already present from a previous attempt together with their md5 state.
+    reset() discards these bytes when the server sends the whole file. A
+    completed transfer is committed, a corrupt one discarded; close() is
+    always called and drops anything that was not committed.
+    """
+
+    def resume(self, verify: bool) -> Tuple[int, "hashlib._Hash"]:
+        return (0, hashlib.md5())
+
+    def reset(self):
+        pass
+
+    def write(self, chunk: bytes):
+        raise NotImplementedError()
+
+    def commit(self):
+        raise NotImplementedError()
+
+    def discard(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class ResultWriter:
+    """
+    Stores the downloaded result files. A writer is shared by all transfer
+    workers of a downloader.
+    """
+
+    def is_complete(self, id: str, res: "Result", verify: bool) -> bool:
+        """
+        Checks whether the result file is already stored from a previous run
+        """
+        return False
+
+    def exists(self, id: str, name: str) -> bool:
+        """
+        Checks whether a file of the dataset is stored, without checking its content
+        """
+        return False
+
+    def open(self, id: str, res: "Result") -> ResultOutput:
+        raise NotImplementedError()
+
+    def link(self, id: str, res: "Result", source: Path) -> bool:
+        """
+        Stores a local copy of the result file without streaming it, e.g. as a
+        hardlink. Returns False when the writer does not support it.
+        """
+        return False
+
+    def remove(self, id: str, name: str) -> bool:
+        """
+        Removes a stored file of the dataset. Returns False when the writer
+        does not support it.
+        """
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+# ioctl to share the data blocks of two files on btrfs, xfs and others
+_FICLONE = 0x40049409
+
+
+def _reflink(source: Path, target: Path):
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+    target.unlink()
+    return False
+
+
+def clone_file(source: Path, target: Path):
+    """
+    Creates target with the content of source as a reflink, a hardlink or a
+    copy, whichever the file system supports first. A hardlink shares the
+    file, so changing one of them changes both.
+    """
+    if _reflink(source, target):
+        return
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source, target)
+
+
+class DirectoryWriter(ResultWriter):
+    """
+    Writes every result file to its own file in the directory of its dataset.
+
+    A file is streamed to a '.part' file next to the target and renamed into
+    place once it is complete, so the partial file of an interrupted transfer
+    can be continued.
+    """
+
+    def __init__(self, target_directory: Callable[[str], Path], chunk_size: int = 64 * 1024):
+        self.target_directory = target_directory
+        self.chunk_size = chunk_size
+
+    def path(self, id: str, res: "Result"):
+        return self.target_directory(id) / res.filename()
+
+    def is_complete(self, id: str, res: "Result", verify: bool):
+        target = self.path(id, res)
+        if not target.is_file() or target.stat().st_size != res.size:
+            return False
+        return not verify or _md5sum(target, self.chunk_size).hexdigest() == res.md5
+
+    def exists(self, id: str, name: str):
+        return (self.target_directory(id) / name).is_file()
+
+    def open(self, id: str, res: "Result"):
+        return _PartFile(self.path(id, res), res, self.chunk_size)
+
+    def link(self, id: str, res: "Result", source: Path):
+        target = self.path(id, res)
+        part = target.with_name(target.name + ".part")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part.unlink(missing_ok=True)
+        clone_file(source, part)
+        os.replace(part, target)
+        return True
+
+    def remove(self, id: str, name: str):
+        (self.target_directory(id) / name).unlink(missing_ok=True)
+        return True
+
+
+class _PartFile(ResultOutput):
+    def __init__(self, target: Path, res: "Result", chunk_size: int):
+        self.target = target
+        self.part = target.with_name(target.name + ".part")
+        self.res = res
+        self.chunk_size = chunk_size
+        self._append = False
+        self._file: Optional[BinaryIO] = None
+
+    def resume(self, verify: bool):
+        md5 = hashlib.md5()
+        if not self.part.is_file():
+            return (0, md5)
+        offset = self.part.stat().st_size
+        if offset == 0 or offset >= self.res.size:
+            self.part.unlink()
+            return (0, md5)
+        if verify:
+            md5 = _md5sum(self.part, self.chunk_size)
+        self._append = True
+        return (offset, md5)
+
+    def reset(self):
+        self._append = False
+        if self._file is not None:
+            self._file.seek(0)
+            self._file.truncate()
+
+    def _open(self):
+        if self._file is None:
+            self.target.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.part, "ab" if self._append else "wb")
+        return self._file
+
+    def write(self, chunk: bytes):
+        self._open().write(chunk)
+
+    def commit(self):
+        self._open().close()
+        os.replace(self.part, self.target)
+
+    def discard(self):
+        self.close()
+        self.part.unlink(missing_ok=True)
+
+    def close(self):
+        # an uncommitted part file is kept, so that the transfer can be continued
+        if self._file is not None:
+            self._file.close()
+
+
+class GunzipWriter(ResultWriter):
+    """
+    Decompresses gzip compressed result files while they are streamed to
+    another writer and stores them without the '.gz' suffix.
+
+    The downloader still verifies the compressed bytes against the manifest.
+    A decompressed file can not be checked against the manifest, so it is
+    skipped when it exists, and an interrupted transfer starts over. The
+    output of a chunk is limited to max_output bytes at a time, so highly
+    compressed files do not have to fit into memory. Other files are passed
+    through unchanged.
+    """
+
+    max_output = 1024 * 1024
+
+    def __init__(self, writer: ResultWriter):
+        self.writer = writer
+
+    @staticmethod
+    def _compressed(res: "Result"):
+        return res.filename().endswith(".gz")
+
+    @staticmethod
+    def _decompressed(res: "Result"):
+        # the inner writer names the file after the url
+        return type(res)(res.url[:-len(".gz")], res.attributes, res.md5, res.size)
+
+    def is_complete(self, id: str, res: "Result", verify: bool):
+        if not self._compressed(res):
+            return self.writer.is_complete(id, res, verify)
+        return self.writer.exists(id, res.filename()[:-len(".gz")])
+
+    def exists(self, id: str, name: str):
+        if name.endswith(".gz"):
+            name = name[:-len(".gz")]
+        return self.writer.exists(id, name)
+
+    def open(self, id: str, res: "Result"):
+        if not self._compressed(res):
+            return self.writer.open(id, res)
+        return _GunzipOutput(self.writer.open(id, self._decompressed(res)), self.max_output)
+
+    def link(self, id: str, res: "Result", source: Path):
+        if not self._compressed(res):
+            return self.writer.link(id, res, source)
+        return False
+
+    def remove(self, id: str, name: str):
+        if name.endswith(".gz"):
+            name = name[:-len(".gz")]
+        return self.writer.remove(id, name)
+
+    def close(self):
+        self.writer.close()
+
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class _GunzipOutput(ResultOutput):
+    def __init__(self, out: ResultOutput, max_output: int):
+        self.out = out
+        self.max_output = max_output
+        self._decompressor = _gzip_decompressor()
+        self._in_member = False
+
+    def resume(self, verify: bool):
+        # the state of the decompressor is lost with the previous attempt
+        self.out.reset()
+        return (0, hashlib.md5())
+
+    def reset(self):
+        self.out.reset()
+        self._decompressor = _gzip_decompressor()
+        self._in_member = False
+
+    def write(self, chunk: bytes):
+        data = chunk
+        try:
+            while len(data) > 0:
+                self._in_member = True
+                inflated = self._decompressor.decompress(data, self.max_output)
+                if len(inflated) > 0:
+                    self.out.write(inflated)
+                if self._decompressor.eof:
+                    # files may consist of several gzip members, e.g. bgzip
+                    data = self._decompressor.unused_data
+                    self._decompressor = _gzip_decompressor()
+                    self._in_member = False
+                else:
+                    data = self._decompressor.unconsumed_tail
+        except zlib.error as e:
+            raise CorruptResultError(f"invalid gzip data: {e}") from e
+
+    def commit(self):
+        if self._in_member:
+            try:
+                inflated = self._decompressor.flush()
+            except zlib.error as e:
+                raise CorruptResultError(f"invalid gzip data: {e}") from e
+            if len(inflated) > 0:
+                self.out.write(inflated)
+            if not self._decompressor.eof:
+                raise CorruptResultError("truncated gzip data")
+        self.out.commit()
+
+    def discard(self):
+        self.out.discard()
+
+    def close(self):
+        self.out.close()
+
+
+class IndexEntry(NamedTuple):
+    """
+    A result file in an archive: its content starts at offset and is length bytes long
+    """
+    id: str
+    file: str
+    offset: int
+    length: int
+    md5: str
+
+
+def read_index(path: Path) -> Iterator[IndexEntry]:
+    with open(path) as lines:
+        for l in lines:
+            if l.startswith("#"):
+                continue
+            fields = l.rstrip("\n").split("\t")
+            if len(fields) != 5:
+                # the last line of an interrupted run may be incomplete
+                continue
+            yield IndexEntry(fields[0], fields[1], int(fields[2]), int(fields[3]), fields[4])
+
+
+_INDEX_HEADER = "#id\tfile\toffset\tlength\tmd5\n"
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def _padded(length: int):
+    return length + (-length % _BLOCK_SIZE)
+
+
+class _TarShard:
+    def __init__(self, path: Path):
+        self.path = path
+        self.part = path.with_name(path.name + ".part")
+        self.index_path = path.with_suffix(".tsv")
+        self.file = open(self.part, "wb")
+        self.index = open(self.index_path, "w")
+        self.index.write(_INDEX_HEADER)
+        self.size = 0
+        self.members = 0
+
+    def add(self, entry: IndexEntry):
+        # the content must be in the archive before the index refers to it
+        self.file.flush()
+        self.index.write("\t".join(str(f) for f in entry) + "\n")
+        self.index.flush()
+        self.size = self.file.tell()
+        self.members += 1
+
+    def finish(self):
+        if self.members == 0:
+            self.file.close()
+            self.index.close()
+            self.part.unlink()
+            self.index_path.unlink()
+            return
+        # end of archive marker
+        self.file.write(b"\0" * 2 * _BLOCK_SIZE)
+        self.file.close()
+        self.index.close()
+        os.replace(self.part, self.path)
+
+
+class TarShardWriter(ResultWriter):
+    """
+    Streams the result files into rolling tar archives instead of single files.
+
+    Every transfer worker appends to an archive of its own, so the files are
+    written without a temporary copy. An archive is written as
+    PREFIX-NNNNNN.tar.part and renamed when it grew beyond shard_size bytes or
+    the writer is closed. Next to it, PREFIX-NNNNNN.tsv lists the id, file name,
+    offset, length and md5 of every member, where offset is the position of
+    the content in the archive, so single files can be read without
+    unpacking, see PackedResults. The md5 is computed from the stored
+    content, so it differs from the manifest for decompressed files. The
+    members are named like the files of a DirectoryWriter, relative to the
+    output directory.
+
+    Archives of an interrupted run are truncated to their last indexed member
+    and closed when a writer is created. Files are not skipped on a restart,
+    so the result files of an interrupted dataset may appear twice; the last
+    entry wins.
+    """
+
+    def __init__(self, directory: Path, member_directory: Callable[[str], Path],
+                 shard_size: int = 1024 ** 3, prefix: str = "results"):
+        self.directory = directory
+        self.member_directory = member_directory
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self._pattern = re.compile(re.escape(prefix) + r"-(\d+)\.(tar|tar\.part|tsv)$")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards: List[_TarShard] = []
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._recover()
+        self._next = max((int(m.group(1)) for m in self._matches()), default=0) + 1
+
+    def _matches(self):
+        for p in self.directory.iterdir():
+            m = self._pattern.match(p.name)
+            if m is not None:
+                yield m
+
+    def _recover(self):
+        for m in list(self._matches()):
+            if m.group(2) == "tar.part":
+                _recover_shard(self.directory / m.group(0)[:-len(".part")])
+
+    def _shard(self) -> _TarShard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            with self._lock:
+                shard = _TarShard(self.directory / f"{self.prefix}-{self._next:06d}.tar")
+                self._next += 1
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _committed(self, shard: _TarShard):
+        if shard.size >= self.shard_size:
+            with self._lock:
+                self._shards.remove(shard)
+            self._local.shard = None
+            shard.finish()
+
+    def open(self, id: str, res: "Result"):
+        name = (self.member_directory(id) / res.filename()).as_posix()
+        return _TarMember(self, self._shard(), id, res, name)
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.finish()
+            self._shards = []
+
+
+def _tar_header(name: str, size: int):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    # the gnu format encodes large sizes in place, so the header length does not depend on the size
+    return info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+
+
+class _TarMember(ResultOutput):
+    def __init__(self, writer: TarShardWriter, shard: _TarShard, id: str, res: "Result", name: str):
+        self.writer = writer
+        self.shard = shard
+        self.id = id
+        self.res = res
+        self.name = name
+        self.start = shard.size
+        self.header = _tar_header(name, res.size)
+        self.written = 0
+        self._md5 = hashlib.md5()
+        self._done = False
+        shard.file.write(self.header)
+
+    def reset(self):
+        self.shard.file.seek(self.start + len(self.header))
+        self.shard.file.truncate()
+        self.written = 0
+        self._md5 = hashlib.md5()
+
+    def write(self, chunk: bytes):
+        self.shard.file.write(chunk)
+        self.written += len(chunk)
+        self._md5.update(chunk)
+
+    def commit(self):
+        f = self.shard.file
+        if self.written != self.res.size:
+            # only without verification, the header has to match the content
+            f.seek(self.start)
+            f.write(_tar_header(self.name, self.written))
+            f.seek(0, os.SEEK_END)
+        f.write(b"\0" * (-self.written % _BLOCK_SIZE))
+        self.shard.add(IndexEntry(self.id, self.res.filename(), self.start + len(self.header), self.written,
+                                  self._md5.hexdigest()))
+        self._done = True
+        self.writer._committed(self.shard)
+
+    def discard(self):
+        self.shard.file.seek(self.start)
+        self.shard.file.truncate()
+        self._done = True
+
+    def close(self):
+        if not self._done:
+            self.discard()
+
+
+def _recover_shard(path: Path):
+    """
+    Closes the archive of an interrupted run after its last complete member
+    """
+    part = path.with_name(path.name + ".part")
+    index_path = path.with_suffix(".tsv")
+    size = part.stat().st_size
+    entries = []
+    if index_path.exists():
+        entries = [e for e in read_index(index_path) if e.offset + e.length <= size]
+    if len(entries) == 0:
+        part.unlink()
+        index_path.unlink(missing_ok=True)
+        return
+    with open(index_path, "w") as index:
+        index.write(_INDEX_HEADER)
+        for e in entries:
+            index.write("\t".join(str(f) for f in e) + "\n")
+    with open(part, "r+b") as f:
+        f.truncate(max(_padded(e.offset + e.length) for e in entries))
+        f.seek(0, os.SEEK_END)
+        f.write(b"\0" * 2 * _BLOCK_SIZE)
+    os.replace(part, path)
+
+
+class PackedResults:
+    """
+    Reads single result files from the archives of TarShardWriters in a
+    directory using their indexes
+    """
+
+    def __init__(self, directory: Path):
+        self.entries: Dict[str, Dict[str, Tuple[Path, IndexEntry]]] = {}
+        for index in sorted(directory.glob("*.tsv")):
+            archive = index.with_suffix(".tar")
+            if not archive.exists():
+                continue
+            for e in read_index(index):
+                self.entries.setdefault(e.id, {})[e.file] = (archive, e)
+
+    def ids(self):
+        return list(self.entries)
+
+    def files(self, id: str):
+        return list(self.entries.get(id, {}))
+
+    def read(self, id: str, file: str) -> bytes:
+        (archive, e) = self.entries[id][file]
+        with open(archive, "rb") as f:
+            f.seek(e.offset)
+            return f.read(e.length)
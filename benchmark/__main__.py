@@ -0,0 +1,52 @@
+import argparse
+import sys
+
+from bakrep.cli import _duration, _size
+from benchmark import mock_server, run
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python -m benchmark", description="Benchmarks the download command against a local mock BakRep server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    server_args = argparse.ArgumentParser(add_help=False)
+    server_args.add_argument('--datasets', type=int, default=1000,
+                             help="Number of synthetic datasets (default %(default)s)")
+    server_args.add_argument('--latency', type=_duration, default=0.0,
+                             help="Delay of every request in seconds (default %(default)s)")
+    server_args.add_argument('--bandwidth', type=_size,
+                             help="Bandwidth per connection in bytes per second with optional K, M or G suffix. "
+                                  "(default unlimited)")
+    server_args.add_argument('--error-rate', type=float, default=0.0,
+                             help="Fraction of requests that fail with a 503 (default %(default)s)")
+    server_args.add_argument('--file-size', type=_size,
+                             help="Size of every file, instead of the files of the test fixture")
+    server_args.add_argument('--seed', type=int, default=0,
+                             help="Seed for the file contents and the failures (default %(default)s)")
+
+    run_parser = subparsers.add_parser('run', parents=[server_args], help="Run the benchmark")
+    run_parser.add_argument('--workers', type=int, nargs="+", default=[1, 4, 16],
+                            help="Worker counts to benchmark (default %(default)s)")
+    run_parser.add_argument('--repeat', type=int, default=1,
+                            help="Runs per worker count (default %(default)s)")
+    run_parser.add_argument('--bakrep-args', default="",
+                            help="Additional arguments for the download command, e.g. '--retry-backoff 0.1'")
+    run_parser.add_argument('-o', '--output', help="Write the parameters and results to this file as JSON")
+    run_parser.set_defaults(func=run.run)
+
+    serve_parser = subparsers.add_parser('serve', parents=[server_args], help="Only run the mock server")
+    serve_parser.add_argument('--port', type=int, default=8080, help="(default %(default)s)")
+    serve_parser.add_argument('--data-port', type=int, default=8081,
+                              help="The port of the file host (default %(default)s)")
+    serve_parser.add_argument('--ids', help="Write the ids of the datasets to this file")
+    serve_parser.set_defaults(func=lambda args: mock_server.serve(
+        args.datasets, args.latency, args.bandwidth, args.error_rate, args.file_size, args.seed,
+        port=args.port, data_port=args.data_port, ids_file=args.ids))
+
+    args = parser.parse_args()
+    sys.exit(args.func(args) or 0)
+
+
+if __name__ == "__main__":
+    main()
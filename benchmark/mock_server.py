@@ -0,0 +1,251 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+FIXTURES = Path(__file__).parent.parent / "test" / "data" / "scenarios" / "download-dataset"
+FIXTURE_ID = "SAMEA3231284"
+
+
+class _File:
+    def __init__(self, suffix: str, attributes: dict, content: bytes):
+        self.suffix = suffix
+        self.attributes = attributes
+        self.content = content
+        self.md5 = hashlib.md5(content).hexdigest()
+
+
+def _load_files(file_size: Optional[int], seed: int) -> Dict[str, _File]:
+    """
+    The files of the fixture dataset. With a file_size every file is replaced
+    by the same amount of pseudo random bytes.
+    """
+    manifest = json.loads((FIXTURES / f"{FIXTURE_ID}.json").read_text())
+    content = None
+    if file_size is not None:
+        content = random.Random(seed).randbytes(file_size)
+    files = {}
+    for r in manifest["results"]:
+        name = r["url"].rsplit("/", 1)[1]
+        suffix = name[len(FIXTURE_ID) + 1:]
+        files[suffix] = _File(suffix, r["attributes"], content if content is not None else (FIXTURES / name).read_bytes())
+    return files
+
+
+class Stats:
+    def __init__(self):
+        self.manifests = 0
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for (k, v) in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def to_dict(self):
+        with self._lock:
+            return {"manifests": self.manifests, "files": self.files, "errors": self.errors, "bytes": self.bytes}
+
+
+class MockBakrep:
+    """
+    A local HTTP server that emulates the BakRep datasets api and the file
+    host for benchmarks.
+
+    It serves `datasets` synthetic datasets that all have the files of the
+    test fixture. Every request is delayed by `latency` seconds, a response
+    body is sent with at most `bandwidth` bytes per second per connection
+    and a fraction of `error_rate` of all requests fails with a 503.
+    Manifests have an ETag and files support range requests, like the real
+    service. The files are served by a second listener on data_port, like
+    the separate file host of the real service, so the client uses its api
+    and data connection pools. The random failures are seeded, so runs are
+    reproducible.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, datasets: int = 1000, latency: float = 0.0, bandwidth: Optional[float] = None,
+                 error_rate: float = 0.0, file_size: Optional[int] = None, seed: int = 0,
+                 host: str = "127.0.0.1", port: int = 0, data_port: int = 0):
+        self.ids = [f"SAMEA{9000000 + i}" for i in range(datasets)]
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.files = _load_files(file_size, seed)
+        self.stats = Stats()
+        self._known = set(self.ids)
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._servers = [ThreadingHTTPServer((host, port), _handler(self)),
+                         ThreadingHTTPServer((host, data_port), _handler(self))]
+        for server in self._servers:
+            server.daemon_threads = True
+        self._threads: List[threading.Thread] = []
+
+    @staticmethod
+    def _url(server: ThreadingHTTPServer):
+        (host, port) = server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return self._url(self._servers[0])
+
+    @property
+    def data_url(self):
+        return self._url(self._servers[1])
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/api/v1/datasets/"
+
+    def dataset_size(self):
+        return sum(len(f.content) for f in self.files.values())
+
+    def manifest(self, id: str):
+        return {
+            "id": id,
+            "results": [{
+                "md5": f.md5,
+                "size": len(f.content),
+                "url": f"{self.data_url}/data/{id}/{id}.{f.suffix}",
+                "attributes": f.attributes,
+            } for f in self.files.values()]
+        }
+
+    def fails(self):
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def start(self):
+        for (name, server) in zip(["mock-bakrep-api", "mock-bakrep-data"], self._servers):
+            thread = threading.Thread(target=server.serve_forever, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            if len(self._threads) > 0:
+                server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+
+_MANIFEST_PATH = re.compile(r"^/api/v1/datasets/([^/]+)$")
+_DATA_PATH = re.compile(r"^/data/([^/]+)/([^/]+)$")
+_RANGE = re.compile(r"^bytes=(\d+)-$")
+
+
+def _handler(mock: MockBakrep):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so the connection pools of the client are exercised
+        protocol_version = "HTTP/1.1"
+        # without it the small header and body writes stall on delayed acks
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if mock.latency > 0:
+                time.sleep(mock.latency)
+            if mock.fails():
+                mock.stats.add(errors=1)
+                return self._respond(503, b"", {"Retry-After": "0"})
+            path = self.path.split("?", 1)[0]
+            m = _MANIFEST_PATH.match(path)
+            if m is not None:
+                return self._manifest(m.group(1))
+            m = _DATA_PATH.match(path)
+            if m is not None:
+                return self._file(m.group(1), m.group(2))
+            self._respond(404, b"")
+
+        def _manifest(self, id: str):
+            if id not in mock._known:
+                return self._respond(404, b"")
+            body = json.dumps(mock.manifest(id)).encode()
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            mock.stats.add(manifests=1)
+            if self.headers.get("If-None-Match") == etag:
+                return self._respond(304, b"", {"ETag": etag})
+            self._respond(200, body, {"ETag": etag, "Content-Type": "application/json"})
+
+        def _file(self, id: str, name: str):
+            f = mock.files.get(name[len(id) + 1:])
+            if id not in mock._known or not name.startswith(id + ".") or f is None:
+                return self._respond(404, b"")
+            mock.stats.add(files=1)
+            m = _RANGE.match(self.headers.get("Range", ""))
+            if m is None:
+                return self._respond(200, f.content, {"ETag": f'"{f.md5}"'})
+            start = int(m.group(1))
+            if start >= len(f.content):
+                return self._respond(416, b"", {"Content-Range": f"bytes */{len(f.content)}"})
+            self._respond(206, f.content[start:], {
+                "ETag": f'"{f.md5}"',
+                "Content-Range": f"bytes {start}-{len(f.content) - 1}/{len(f.content)}",
+            })
+
+        def _respond(self, status: int, body: bytes, headers: dict = {}):
+            self.send_response(status)
+            for (k, v) in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self._send_body(body)
+
+        def _send_body(self, body: bytes):
+            view = memoryview(body)
+            for offset in range(0, len(body), mock.chunk_size):
+                chunk = view[offset:offset + mock.chunk_size]
+                self.wfile.write(chunk)
+                mock.stats.add(bytes=len(chunk))
+                if mock.bandwidth is not None:
+                    time.sleep(len(chunk) / mock.bandwidth)
+
+    return Handler
+
+
+def serve(datasets: int = 1000, latency: float = 0.0, bandwidth: Optional[float] = None, error_rate: float = 0.0,
+          file_size: Optional[int] = None, seed: int = 0, host: str = "127.0.0.1", port: int = 8080,
+          data_port: int = 8081, ids_file: Optional[str] = None):
+    """
+    Runs the mock server in the foreground, e.g. for manual tests
+    """
+    mock = MockBakrep(datasets, latency, bandwidth, error_rate, file_size, seed, host, port, data_port)
+    if ids_file is not None:
+        _write_ids(ids_file, mock.ids)
+    print(f"Serving {datasets} datasets at {mock.api_url}, files at {mock.data_url}", flush=True)
+    with mock:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+def _write_ids(path: str, ids: List[str]):
+    with open(path, "w") as f:
+        f.write("#id\n")
+        for id in ids:
+            f.write(id + "\n")
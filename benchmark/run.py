@@ -0,0 +1,111 @@
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmark.mock_server import MockBakrep, _write_ids
+
+
+def _directory_size(path: Path):
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file() and ".progress" not in p.parts)
+
+
+def _run_download(args: List[str]):
+    """
+    Runs the download command in a child process and returns the exit code,
+    the wall time and the peak RSS in bytes of that process
+    """
+    # stderr goes to a file, a pipe that is not read while waiting could fill up and block the child
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.monotonic()
+        proc = subprocess.Popen([sys.executable, "-m", "bakrep.cli", "download"] + args,
+                                stdout=subprocess.DEVNULL, stderr=stderr_file)
+        (_, status, usage) = os.wait4(proc.pid, 0)
+        elapsed = time.monotonic() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = usage.ru_maxrss if platform.system() == "Darwin" else usage.ru_maxrss * 1024
+    return (proc.returncode, elapsed, rss, stderr)
+
+
+def run_scenario(mock: MockBakrep, ids_file: str, workers: int, extra_args: List[str]):
+    """
+    Downloads all datasets of the mock server into a new directory and then
+    runs the same command again. The second run has nothing left to do, so
+    its time is the startup cost of resuming a download.
+    """
+    with tempfile.TemporaryDirectory(prefix="bakrep-bench-") as tmp:
+        args = ["-t", ids_file, "-d", tmp, "--api-url", mock.api_url, "-j", str(workers)] + extra_args
+        before = mock.stats.to_dict()
+        (code, elapsed, rss, stderr) = _run_download(args)
+        after = mock.stats.to_dict()
+        downloaded = _directory_size(Path(tmp))
+        (resume_code, resume_elapsed, _, _) = _run_download(args)
+    if code != 0:
+        print(stderr, file=sys.stderr)
+    datasets = len(mock.ids)
+    return {
+        "workers": workers,
+        "exit_code": code,
+        "seconds": round(elapsed, 3),
+        "datasets_per_second": round(datasets / elapsed, 2),
+        "mb_per_second": round(downloaded / elapsed / 1e6, 2),
+        "bytes": downloaded,
+        "peak_rss_mb": round(rss / 1e6, 1),
+        "resume_seconds": round(resume_elapsed, 3),
+        "resume_exit_code": resume_code,
+        "requests": {k: after[k] - before[k] for k in after},
+    }
+
+
+def _format_row(r: dict):
+    return (f"{r['workers']:>7} {r['seconds']:>9.2f} {r['datasets_per_second']:>10.1f} {r['mb_per_second']:>8.2f} "
+            f"{r['peak_rss_mb']:>8.1f} {r['resume_seconds']:>9.2f} {r['requests']['errors']:>7} {r['exit_code']:>5}")
+
+
+def run(args):
+    """
+    Runs the download command against a mock server once per worker count
+    and reports datasets/s, MB/s, peak RSS and the resume startup time
+    """
+    extra_args = shlex.split(args.bakrep_args)
+    mock = MockBakrep(args.datasets, args.latency, args.bandwidth, args.error_rate, args.file_size, args.seed)
+    results = []
+    with mock, tempfile.TemporaryDirectory(prefix="bakrep-bench-ids-") as tmp:
+        ids_file = str(Path(tmp) / "ids.tsv")
+        _write_ids(ids_file, mock.ids)
+        print(f"{args.datasets} datasets of {mock.dataset_size()} bytes, latency {args.latency} s, "
+              f"bandwidth {args.bandwidth or 'unlimited'} B/s, error rate {args.error_rate}")
+        print(f"{'workers':>7} {'seconds':>9} {'datasets/s':>10} {'MB/s':>8} {'RSS MB':>8} {'resume s':>9} "
+              f"{'errors':>7} {'exit':>5}")
+        for workers in args.workers:
+            for _ in range(args.repeat):
+                r = run_scenario(mock, ids_file, workers, extra_args)
+                print(_format_row(r), flush=True)
+                results.append(r)
+    if args.output is not None:
+        report = {
+            "parameters": {
+                "datasets": args.datasets,
+                "latency": args.latency,
+                "bandwidth": args.bandwidth,
+                "error_rate": args.error_rate,
+                "file_size": args.file_size,
+                "seed": args.seed,
+                "bakrep_args": extra_args,
+            },
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if all(r["exit_code"] == 0 for r in results) else 1
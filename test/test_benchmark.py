@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests
+
+from bakrep.model import BakrepDownloader
+from bakrep.retry import RetryPolicy
+from benchmark.mock_server import MockBakrep
+
+
+class MockBakrepTest(unittest.TestCase):
+    def test_datasets_should_be_downloadable(self):
+        with MockBakrep(datasets=3, file_size=1000) as mock, tempfile.TemporaryDirectory() as tmp:
+            with BakrepDownloader(mock.api_url, retry=RetryPolicy(max_retries=0)) as dl:
+                for id in mock.ids:
+                    (Path(tmp) / id).mkdir()
+                    dl.download(id, [], Path(tmp) / id)
+            for id in mock.ids:
+                files = list((Path(tmp) / id).iterdir())
+                self.assertEqual(len(files), 9)
+                self.assertTrue(all(f.stat().st_size == 1000 for f in files))
+            self.assertEqual(mock.stats.manifests, 3)
+            self.assertEqual(mock.stats.files, 27)
+
+    def test_fixture_files_should_be_served(self):
+        with MockBakrep(datasets=1) as mock:
+            manifest = requests.get(mock.api_url + mock.ids[0]).json()
+            sizes = sorted(r["size"] for r in manifest["results"])
+            self.assertEqual(sizes[-1], 965037)
+
+    def test_files_should_be_served_by_a_second_host(self):
+        with MockBakrep(datasets=1, file_size=1000) as mock:
+            url = requests.get(mock.api_url + mock.ids[0]).json()["results"][0]["url"]
+            self.assertTrue(url.startswith(mock.data_url + "/data/"))
+            self.assertNotEqual(mock.data_url, mock.base_url)
+            self.assertEqual(requests.get(url).status_code, 200)
+
+    def test_unknown_datasets_should_not_be_found(self):
+        with MockBakrep(datasets=1) as mock:
+            self.assertEqual(requests.get(mock.api_url + "SAMEA1").status_code, 404)
+
+    def test_range_requests_should_be_supported(self):
+        with MockBakrep(datasets=1, file_size=1000) as mock:
+            url = requests.get(mock.api_url + mock.ids[0]).json()["results"][0]["url"]
+            r = requests.get(url, headers={"Range": "bytes=600-"})
+            self.assertEqual(r.status_code, 206)
+            self.assertEqual(len(r.content), 400)
+            self.assertEqual(r.headers["Content-Range"], "bytes 600-999/1000")
+
+    def test_errors_should_be_injected(self):
+        with MockBakrep(datasets=1, error_rate=1.0) as mock:
+            self.assertEqual(requests.get(mock.api_url + mock.ids[0]).status_code, 503)
+            self.assertEqual(mock.stats.errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import tempfile
+import unittest
+
+from bakrep.console import ConsoleOutput, _format_bytes, _format_duration
+from bakrep.model import DownloadSet, Result
+
+
+def result(name: str, size: int):
+    return Result(f"https://example.org/{name}", {}, "unknown", size)
+
+
+class ConsoleOutputTest(unittest.TestCase):
+
+    def test_messages_should_not_be_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a"]) as ds:
+                first = ConsoleOutput(ds, io.StringIO())
+                second = ConsoleOutput(ds, io.StringIO())
+                first.print_message("hello")
+                first.print_error_message("error")
+                self.assertEqual(second.messages, [])
+                self.assertEqual(second.error_messages, [])
+
+    def test_messages_should_not_be_rendered_immediately(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a"]) as ds:
+                out = io.StringIO()
+                log = ConsoleOutput(ds, out, tty=True)
+                for i in range(100):
+                    log.print_message(f"Finished: {i}")
+                self.assertEqual(out.getvalue(), "")
+                log.print_progress()
+                self.assertIn("Finished: 99", out.getvalue())
+
+    def test_plain_output_should_print_summary_lines_and_errors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b"]) as ds:
+                out = io.StringIO()
+                log = ConsoleOutput(ds, out, tty=False)
+                a = result("a.json.gz", 1024)
+                log.dataset_resolved("a", [a])
+                log.transfer_started("a", a)
+                log.transfer_progress("a", a, 1024)
+                log.transfer_finished("a", a, 1024, 0.1)
+                ds.finish_dataset("a")
+                log.print_error_message("Download failed: b")
+                log.print_progress()
+                lines = out.getvalue().splitlines()
+                self.assertEqual(lines[0], "Download failed: b")
+                self.assertTrue(lines[1].startswith("Progress: 1/2, Failed: 0, 1.0 KiB"))
+                self.assertNotIn("\033", out.getvalue())
+
+    def test_remaining_bytes_should_be_estimated_from_resolved_manifests(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b", "c"]) as ds:
+                log = ConsoleOutput(ds, io.StringIO())
+                a = result("a.json.gz", 100)
+                log.dataset_resolved("a", [a, result("a.gff3.gz", 300)])
+                log.transfer_finished("a", a, 100, 0.1)
+                # 300 bytes of a and 400 for each of b and c
+                self.assertEqual(log._remaining_bytes(), 1100)
+
+    def test_in_flight_transfers_should_be_tracked(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a"]) as ds:
+                log = ConsoleOutput(ds, io.StringIO())
+                a = result("a.json.gz", 100)
+                log.transfer_started("a", a)
+                self.assertIn("In flight: 1", log.summary())
+                log.transfer_failed("a", a, Exception())
+                self.assertIn("In flight: 0", log.summary())
+
+    def test_formatting(self):
+        self.assertEqual(_format_bytes(100), "100 B")
+        self.assertEqual(_format_bytes(1536), "1.5 KiB")
+        self.assertEqual(_format_bytes(3 * 1024 ** 3), "3.0 GiB")
+        self.assertEqual(_format_duration(3725), "01:02:05")
+        self.assertEqual(_format_duration(None), "--:--:--")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import hashlib
+import tarfile
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from typing import IO, cast
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.content_cache import ContentCache
+from bakrep.model import BakrepDownloader, DownloadListener
+from bakrep.writers import TarShardWriter
+from test.test_download import mockserver
+from test.test_download_command import mock_dataset
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+
+
+class CacheListener(DownloadListener):
+    def __init__(self):
+        self.cached = []
+        self.started = []
+
+    def transfer_cached(self, id, res):
+        self.cached.append(res.filename())
+
+    def transfer_started(self, id, res):
+        self.started.append(res.filename())
+
+
+def add(cache: ContentCache, tmp: str, content: bytes):
+    f = Path(tmp) / "new"
+    f.write_bytes(content)
+    md5 = hashlib.md5(content).hexdigest()
+    cache.add(md5, len(content), f)
+    return md5
+
+
+def cached(cache: ContentCache, md5: str, size: int) -> Path:
+    path = cache.get(md5, size)
+    if path is None:
+        raise AssertionError(f"{md5} is not cached")
+    return path
+
+
+class ContentCacheTest(unittest.TestCase):
+    def test_downloads_should_be_cached(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                out1 = Path(tmp) / "a"
+                out2 = Path(tmp) / "b"
+                out1.mkdir()
+                out2.mkdir()
+                with ContentCache(Path(tmp) / "cache") as cache:
+                    with BakrepDownloader(content_cache=cache) as d:
+                        d.download(ID, [{"tool": "bakta"}], str(out1))
+                    requests = m.call_count
+                    listener = CacheListener()
+                    with BakrepDownloader(content_cache=cache, listeners=[listener]) as d:
+                        d.download(ID, [{"tool": "bakta"}], str(out2))
+                    # only the manifest was requested again
+                    self.assertEqual(m.call_count, requests + 1)
+                    self.assertEqual(len(listener.cached), 5)
+                    self.assertEqual(listener.started, [])
+                for f in out1.iterdir():
+                    self.assertEqual((out2 / f.name).read_bytes(), f.read_bytes())
+
+    def test_cached_files_should_be_streamed_into_packed_output(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with ContentCache(Path(tmp) / "cache") as cache:
+                    add(cache, tmp, (FIXTURES / f"{ID}.mlst.json.gz").read_bytes())
+                    with TarShardWriter(Path(tmp) / "packed", lambda id: Path(id)) as writer, \
+                            BakrepDownloader(content_cache=cache) as d:
+                        d.download(ID, [{"tool": "mlst"}], writer)
+                self.assertEqual(m.call_count, 1)
+                with tarfile.open(Path(tmp) / "packed" / "results-000001.tar") as tar:
+                    self.assertEqual(cast(IO[bytes], tar.extractfile(f"{ID}/{ID}.mlst.json.gz")).read(),
+                                     (FIXTURES / f"{ID}.mlst.json.gz").read_bytes())
+
+    def test_corrupt_objects_should_be_downloaded_again(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                content = (FIXTURES / f"{ID}.mlst.json.gz").read_bytes()
+                with ContentCache(Path(tmp) / "cache") as cache:
+                    md5 = add(cache, tmp, content)
+                    cached(cache, md5, len(content)).write_bytes(b"x" * len(content))
+                    with BakrepDownloader(content_cache=cache) as d:
+                        d.download(ID, [{"tool": "mlst"}], tmp)
+                    self.assertEqual(m.call_count, 2)
+                    self.assertEqual(cached(cache, md5, len(content)).read_bytes(), content)
+                self.assertEqual((Path(tmp) / f"{ID}.mlst.json.gz").read_bytes(), content)
+
+    def test_least_recently_used_objects_should_be_evicted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with ContentCache(Path(tmp) / "cache", max_size=250) as cache:
+                first = add(cache, tmp, b"a" * 100)
+                time.sleep(0.01)
+                second = add(cache, tmp, b"b" * 100)
+                time.sleep(0.01)
+                self.assertIsNotNone(cache.get(first, 100))
+                time.sleep(0.01)
+                add(cache, tmp, b"c" * 100)
+                self.assertIsNotNone(cache.get(first, 100))
+                self.assertIsNone(cache.get(second, 100))
+                self.assertEqual(cache.size(), 200)
+
+    def test_caches_should_be_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with ContentCache(Path(tmp) / "cache") as a, ContentCache(Path(tmp) / "cache") as b:
+                md5 = add(a, tmp, b"abc")
+                self.assertEqual(cached(b, md5, 3).read_bytes(), b"abc")
+                b.remove(md5)
+                self.assertIsNone(a.get(md5, 3))
+                self.assertEqual(a.size(), 0)
+
+    def test_download_command_should_use_the_cache(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            with tempfile.TemporaryDirectory() as tmp:
+                cache = str(Path(tmp) / "cache")
+                main(["download", "-e", "abc", "-d", str(Path(tmp) / "a"), "--cache-dir", cache])
+                requests = m.call_count
+                main(["download", "-e", "abc", "-d", str(Path(tmp) / "b"), "--cache-dir", cache])
+                self.assertEqual(m.call_count, requests + 1)
+                self.assertEqual(len(list((Path(tmp) / "b" / "abc").iterdir())), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
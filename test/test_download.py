@@ -1,8 +1,13 @@
 import unittest
 from bakrep.model import BakrepDownloader, DownloadFailedException
+from bakrep.retry import RetryPolicy
 import tempfile
 from pathlib import Path
+import io
+from typing import cast
+
 import requests_mock
+from requests.adapters import HTTPAdapter
 
 
 def mockdataset(m, id):
@@ -27,6 +32,29 @@ def mockserver(m, id):
     mockdownload(m, id, "gtdbtk.json.gz")
     mockdownload(m, id, "checkm2.json.gz")
 
+NO_RETRY = RetryPolicy(max_retries=0)
+
+
+class BrokenStream(io.RawIOBase):
+    """
+    A stream that fails after the first chunk of data
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.served = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.served:
+            raise ConnectionResetError("connection lost")
+        self.served = True
+        n = min(len(b), len(self.data))
+        b[:n] = self.data[:n]
+        return n
+
 
 class BakrepDownloaderTest(unittest.TestCase):
 
@@ -89,3 +117,148 @@ class BakrepDownloaderTest(unittest.TestCase):
                 d = BakrepDownloader()
                 self.assertRaises(DownloadFailedException, lambda: d.download(
                     id, [{"tool": "gtdbtk"}], tmp))
+
+    def test_download_with_multiple_workers_should_save_everything(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockserver(m, id)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(workers=4) as d:
+                    d.download(id, [], tmp)
+                files = list(Path(tmp).iterdir())
+                self.assertEqual(len(files), 9)
+
+    def test_downloader_should_use_separate_pools_for_api_and_data_hosts(self):
+        with BakrepDownloader(api_pool_size=2, data_pool_size=8) as d:
+            api = d.session.get_adapter("https://bakrep.computational.bio/api/v1/datasets/abc")
+            data = d.session.get_adapter(
+                "https://bakrep-data.s3.computational.bio.uni-giessen.de/abc/abc.mlst.json.gz")
+            self.assertIsNot(api, data)
+            self.assertEqual(cast(HTTPAdapter, api)._pool_maxsize, 2)
+            self.assertEqual(cast(HTTPAdapter, data)._pool_maxsize, 8)
+            # files on the host of the api use the data pool
+            self.assertIs(d.session.get_adapter("https://bakrep.computational.bio/data/abc.mlst.json.gz"), data)
+
+    def test_download_in_small_chunks_should_save_identical_files(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockserver(m, id)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(chunk_size=1000) as d:
+                    d.download(id, [{"tool": "bakta", "filetype": "gbff"}], tmp)
+                expected = Path(f"./test/data/scenarios/download-dataset/{id}.bakta.gbff.gz").read_bytes()
+                self.assertEqual((Path(tmp) / f"{id}.bakta.gbff.gz").read_bytes(), expected)
+
+    def test_interrupted_download_should_not_leave_a_finished_file(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockdataset(m, id)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.bakta.gbff.gz",
+                  body=BrokenStream(b"x" * 5000))
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(chunk_size=1000, retry=NO_RETRY) as d:
+                    with self.assertRaises(DownloadFailedException):
+                        d.download(id, [{"tool": "bakta", "filetype": "gbff"}], tmp)
+                self.assertFalse((Path(tmp) / f"{id}.bakta.gbff.gz").exists())
+
+    def test_download_with_wrong_md5_should_raise_exception(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockdataset(m, id)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.mlst.json.gz",
+                  content=b"x" * 210)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(retry=NO_RETRY) as d:
+                    with self.assertRaises(DownloadFailedException):
+                        d.download(id, [{"tool": "mlst"}], tmp)
+                self.assertEqual(list(Path(tmp).iterdir()), [])
+
+    def test_download_with_wrong_size_should_raise_exception(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockdataset(m, id)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.mlst.json.gz",
+                  content=b"short")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(retry=NO_RETRY) as d:
+                    with self.assertRaises(DownloadFailedException):
+                        d.download(id, [{"tool": "mlst"}], tmp)
+                self.assertEqual(list(Path(tmp).iterdir()), [])
+
+    def test_download_without_verification_should_accept_any_content(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockdataset(m, id)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.mlst.json.gz",
+                  content=b"short")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(verify=False) as d:
+                    d.download(id, [{"tool": "mlst"}], tmp)
+                self.assertEqual((Path(tmp) / f"{id}.mlst.json.gz").read_bytes(), b"short")
+
+    def test_download_should_skip_files_that_match_the_manifest(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockdataset(m, id)
+            source = Path(f"./test/data/scenarios/download-dataset/{id}.mlst.json.gz")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                (Path(tmp) / source.name).write_bytes(source.read_bytes())
+                with BakrepDownloader() as d:
+                    d.download(id, [{"tool": "mlst"}], tmp)
+                self.assertEqual(m.call_count, 1)
+
+    def test_download_should_replace_files_that_do_not_match_the_manifest(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockserver(m, id)
+            source = Path(f"./test/data/scenarios/download-dataset/{id}.mlst.json.gz")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                (Path(tmp) / source.name).write_bytes(b"x" * 210)
+                with BakrepDownloader() as d:
+                    d.download(id, [{"tool": "mlst"}], tmp)
+                self.assertEqual((Path(tmp) / source.name).read_bytes(), source.read_bytes())
+
+    def test_download_should_continue_partial_files_with_range_requests(self):
+        id = "SAMEA3231284"
+        source = Path(f"./test/data/scenarios/download-dataset/{id}.bakta.gbff.gz")
+        content = source.read_bytes()
+        ranges = []
+
+        def partial_content(request, context):
+            start = int(request.headers["Range"].removeprefix("bytes=").removesuffix("-"))
+            ranges.append(start)
+            context.status_code = 206
+            context.headers["Content-Range"] = f"bytes {start}-{len(content) - 1}/{len(content)}"
+            return content[start:]
+
+        with requests_mock.Mocker() as m:
+            mockdataset(m, id)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.bakta.gbff.gz",
+                  content=partial_content)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                (Path(tmp) / (source.name + ".part")).write_bytes(content[:1000])
+                with BakrepDownloader() as d:
+                    d.download(id, [{"tool": "bakta", "filetype": "gbff"}], tmp)
+                self.assertEqual(ranges, [1000])
+                self.assertEqual((Path(tmp) / source.name).read_bytes(), content)
+
+    def test_download_should_start_over_when_range_requests_are_not_supported(self):
+        with requests_mock.Mocker() as m:
+            id = "SAMEA3231284"
+            mockserver(m, id)
+            source = Path(f"./test/data/scenarios/download-dataset/{id}.bakta.gbff.gz")
+
+            with tempfile.TemporaryDirectory() as tmp:
+                (Path(tmp) / (source.name + ".part")).write_bytes(b"x" * 1000)
+                with BakrepDownloader() as d:
+                    d.download(id, [{"tool": "bakta", "filetype": "gbff"}], tmp)
+                self.assertEqual((Path(tmp) / source.name).read_bytes(), source.read_bytes())
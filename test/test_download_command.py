@@ -1,10 +1,15 @@
+import gzip
+import io
+import sys
 import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
 from requests_mock import Mocker
 
 from bakrep.cli import main
+from bakrep.model import DownloadSet
 
 
 def mock_result(id: str, suffix: str, attributes: dict,
@@ -83,3 +88,59 @@ class DownloadCommandTest(unittest.TestCase):
                 self.assertListEqual(
                     sorted(map(lambda x: x.name, files)),
                     sorted(["abc.gff3"]))
+
+    def test_should_download_datasets_in_parallel(self):
+        ids = [f"id{i}" for i in range(10)]
+        with Mocker() as m:
+            for id in ids:
+                mock_dataset(m, id)
+            with tempfile.TemporaryDirectory() as tmp:
+                main(["download", "-e", ",".join(ids), "-d", tmp, "--flat", "-j", "4"])
+                for id in ids:
+                    files = list((Path(tmp) / id).iterdir())
+                    self.assertEqual(len(files), 3)
+                with DownloadSet.at_location(tmp) as ds:
+                    self.assertEqual(ds.downloaded, set(ids))
+
+    def test_should_fail_with_less_than_one_worker(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(SystemExit) as cm:
+                main(["download", "-e", "abc", "-d", tmp, "-j", "0"])
+
+    def test_should_read_ids_from_a_named_tsv_column(self):
+        with Mocker() as m:
+            mock_dataset(m, "xyz")
+            with tempfile.TemporaryDirectory() as tmp:
+                tsv_path = Path(tmp) / "tsv.gz"
+                tsv_path.write_bytes(gzip.compress(b"species\tid\nE. coli\txyz\n"))
+                main(["download", "-t", str(tsv_path), "--id-column", "id", "-d", tmp, "--flat"])
+                self.assertTrue((Path(tmp) / "xyz").is_dir())
+
+    def test_should_fail_with_an_unknown_tsv_column(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv_path = Path(tmp) / "tsv"
+            tsv_path.write_text("species\tid\n")
+            with self.assertRaises(SystemExit) as cm:
+                main(["download", "-t", str(tsv_path), "--id-column", "accession", "-d", tmp])
+
+    def test_should_fail_with_an_unknown_column_of_stdin(self):
+        stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(b"species\tid\nE. coli\txyz\n")))
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(sys, "stdin", stdin):
+            with self.assertRaises(SystemExit) as cm:
+                main(["download", "-t", "-", "--id-column", "accession", "-d", tmp])
+            self.assertEqual(cm.exception.code, "the tsv has no column 'accession'")
+            self.assertFalse(stdin.buffer.closed)
+
+    def test_manifests_should_only_be_cached_on_request(self):
+        with Mocker() as m:
+            mock_dataset(m, "xyz")
+            with tempfile.TemporaryDirectory() as tmp:
+                main(["download", "-e", "xyz", "-d", tmp])
+                self.assertFalse((Path(tmp) / ".progress" / "manifests").exists())
+                main(["download", "-e", "xyz", "-d", tmp, "-r", "--manifest-ttl", "1h"])
+                self.assertTrue((Path(tmp) / ".progress" / "manifests").is_dir())
+
+    def test_should_fail_with_an_invalid_filter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(SystemExit) as cm:
+                main(["download", "-e", "abc", "-d", tmp, "-m", "tool=bakta"])
@@ -1,5 +1,6 @@
 import tempfile
 import unittest
+from pathlib import Path
 
 from bakrep.model import DownloadSet
 
@@ -53,3 +54,57 @@ class PersistDownloadSetTest(unittest.TestCase):
                 dl = ds.download_list()
                 dl.sort()
                 self.assertEqual(dl, ["a", "c"])
+
+    def test_pending_should_keep_the_input_order(self):
+        ids = [f"id{i}" for i in range(2500)]
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ids) as ds:
+                ds.finish_dataset("id7")
+                expected = [id for id in ids if id != "id7"]
+                self.assertEqual(list(ds.pending(page_size=100)), expected)
+
+    def test_requeued_ids_should_follow_the_new_input_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ['a', 'b', 'c']) as ds:
+                pass
+            with DownloadSet.at_location(tmp, ['c', 'x', 'a'], skipToDownload=True) as ds:
+                self.assertEqual(ds.download_list(), ['c', 'x', 'a'])
+
+    def test_distinct_ids_should_not_be_queued(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ['a']) as ds:
+                self.assertEqual(list(ds.distinct(['b', 'a', 'b', 'c', 'a'], batch_size=2)), ['b', 'a', 'c'])
+                self.assertEqual(ds.toDownload, {'a'})
+
+    def test_counters_should_reflect_the_state(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, self.ids) as ds:
+                ds.failed_dataset("a")
+                ds.failed_dataset("b")
+                ds.finish_dataset("b")
+                self.assertEqual(ds.total_datasets(), 3)
+                self.assertEqual(ds.downloaded_datasets(), 1)
+                self.assertEqual(ds.failed_datasets(), 1)
+            with DownloadSet.at_location(tmp) as ds:
+                self.assertEqual(ds.downloaded_datasets(), 1)
+                self.assertEqual(ds.failed_datasets(), 1)
+
+    def test_finished_files_should_be_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, self.ids) as ds:
+                ds.finish_file("a", "a.json.gz", 10, "abc")
+            with DownloadSet.at_location(tmp) as ds:
+                self.assertEqual(ds.finished_files("a"), {"a.json.gz": (10, "abc")})
+                self.assertEqual(ds.finished_files("b"), {})
+
+    def test_progress_files_of_previous_versions_should_be_imported(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            p = Path(tmp) / ".progress"
+            p.mkdir()
+            (p / "toDownload.dat").write_text("a\nb\nc")
+            (p / "downloaded.dat").write_text("b")
+            (p / "failed.dat").write_text("c")
+            with DownloadSet.at_location(tmp) as ds:
+                self.assertEqual(set(self.ids), ds.toDownload)
+                self.assertEqual({"b"}, ds.downloaded)
+                self.assertEqual({"c"}, ds.failed)
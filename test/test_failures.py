@@ -0,0 +1,120 @@
+import contextlib
+import io
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.model import BakrepDownloader, DownloadFailedException, DownloadSet
+from bakrep.progress import JobProgress, _format_failure
+from bakrep.retry import RetryPolicy
+from bakrep.shard import Shard
+from test.test_download_command import mock_dataset
+
+API = "https://bakrep.computational.bio/api/v1/datasets/"
+
+
+def failure(id: str, reason, attempts: int = 1):
+    e = DownloadFailedException(id, API + id, reason)
+    e.attempts = attempts
+    return e
+
+
+class FailureStoreTest(unittest.TestCase):
+    def test_failures_should_be_recorded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b", "c"]) as ds:
+                ds.failed_dataset("a", failure("a", 404))
+                ds.failed_dataset("b", failure("b", TimeoutError("timed out"), 4))
+                ds.failed_dataset("c", failure("c", 503))
+                ds.finish_dataset("c")
+            with JobProgress(Path(tmp)) as job:
+                failures = [f[:7] for f in job.failures()]
+            self.assertListEqual(failures, [
+                ("a", API + "a", 404, "DownloadFailedException", "404", 0, 1),
+                ("b", API + "b", None, "TimeoutError", "timed out", 1, 4),
+            ])
+
+    def test_only_retryable_failures_should_be_retried_after_the_cool_down(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b", "c", "d"]) as ds:
+                ds.failed_dataset("a", failure("a", 404))
+                ds.failed_dataset("b", failure("b", 503))
+                # without a record, e.g. imported from failed.dat
+                ds.failed_dataset("c")
+                self.assertListEqual(list(ds.retryable_failed()), ["b", "c"])
+                self.assertListEqual(list(ds.retryable_failed(cool_down=60)), ["c"])
+                ds._db.execute("UPDATE failures SET time = ?", (time.time() - 120,))
+                self.assertListEqual(list(ds.retryable_failed(cool_down=60)), ["b", "c"])
+
+    def test_attempts_should_be_counted(self):
+        with requests_mock.Mocker() as m:
+            m.get(API + "a", status_code=503)
+            m.get(API + "b", status_code=404)
+            with BakrepDownloader(retry=RetryPolicy(max_retries=2, backoff=0)) as d:
+                with self.assertRaises(DownloadFailedException) as cm:
+                    d.fetch_dataset("a")
+                self.assertEqual(cm.exception.attempts, 3)
+                with self.assertRaises(DownloadFailedException) as cm:
+                    d.fetch_dataset("b")
+                self.assertEqual(cm.exception.attempts, 1)
+
+    def test_messages_should_be_one_field_of_the_tsv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a"]) as ds:
+                ds.failed_dataset("a", failure("a", ConnectionError("reset\n\tby peer")))
+            with JobProgress(Path(tmp)) as job:
+                [line] = [_format_failure(f) for f in job.failures()]
+            self.assertEqual(line.split("\t")[-1], "reset by peer")
+
+    def test_failures_of_shards_should_be_merged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a"], shard=Shard(1, 2)) as s:
+                s.failed_dataset("a", failure("a", 503))
+            with DownloadSet.at_location(tmp, ["b"], shard=Shard(2, 2)) as s:
+                s.failed_dataset("b", failure("b", 404))
+            with JobProgress(Path(tmp)) as job:
+                self.assertListEqual([f[0] for f in job.failures()], ["a", "b"])
+
+
+class RetryFailedCommandTest(unittest.TestCase):
+    def test_retryable_failures_should_be_downloaded_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                m.get(API + "a", status_code=404)
+                m.get(API + "b", status_code=503)
+                mock_dataset(m, "c")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main(["download", "-e", "a,b,c", "-d", tmp, "--flat", "--retries", "0"])
+            with requests_mock.Mocker() as m:
+                mock_dataset(m, "a")
+                mock_dataset(m, "b")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main(["download", "-d", tmp, "--flat", "--retry-failed", "--cool-down", "0"])
+                self.assertListEqual(sorted(set(r.url for r in m.request_history if r.url.startswith(API))),
+                                     [API + "b"])
+            with DownloadSet.at_location(tmp) as ds:
+                self.assertSetEqual(ds.downloaded, {"b", "c"})
+                self.assertSetEqual(ds.failed, {"a"})
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                main(["progress", "-d", tmp, "--failures"])
+            lines = out.getvalue().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertTrue(lines[1].startswith(f"a\t{API}a\t404\tDownloadFailedException\tno\t1\t"))
+
+    def test_recent_failures_should_wait_for_the_cool_down(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                m.get(API + "b", status_code=503)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main(["download", "-e", "b", "-d", tmp, "--retries", "0"])
+                    main(["download", "-d", tmp, "--retry-failed"])
+                self.assertEqual(m.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
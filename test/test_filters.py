@@ -0,0 +1,64 @@
+import unittest
+
+from bakrep.download import _parse_filters
+from bakrep.filters import FilterParseError, Matcher
+
+BAKTA_GFF3 = {"type": "annotation", "filetype": "gff3", "tool": "bakta"}
+BAKTA_JSON = {"type": "annotation", "filetype": "json", "tool": "bakta"}
+GTDBTK = {"type": "taxonomy", "filetype": "json", "tool": "gtdbtk"}
+CHECKM2 = {"type": "qc", "filetype": "json", "tool": "checkm2"}
+
+
+class MatcherTest(unittest.TestCase):
+
+    def test_exact_values_should_match(self):
+        m = Matcher.parse(["tool:bakta,filetype:gff3"])
+        self.assertTrue(m.matches(BAKTA_GFF3))
+        self.assertFalse(m.matches(BAKTA_JSON))
+
+    def test_any_filter_may_match(self):
+        m = Matcher.parse(["tool:gtdbtk", "filetype:gff3"])
+        self.assertTrue(m.matches(GTDBTK))
+        self.assertTrue(m.matches(BAKTA_GFF3))
+        self.assertFalse(m.matches(CHECKM2))
+
+    def test_value_sets_should_match_any_value(self):
+        m = Matcher.parse(["tool:bakta|gtdbtk"])
+        self.assertTrue(m.matches(BAKTA_JSON))
+        self.assertTrue(m.matches(GTDBTK))
+        self.assertFalse(m.matches(CHECKM2))
+
+    def test_negated_conditions_should_exclude_values(self):
+        m = Matcher.parse(["tool:bakta,filetype!=json|gbff"])
+        self.assertTrue(m.matches(BAKTA_GFF3))
+        self.assertFalse(m.matches(BAKTA_JSON))
+        self.assertFalse(m.matches(GTDBTK))
+
+    def test_negated_conditions_should_match_missing_attributes(self):
+        m = Matcher.parse(["format!=xml"])
+        self.assertTrue(m.matches(BAKTA_GFF3))
+
+    def test_glob_patterns_should_match(self):
+        m = Matcher.parse(["filetype:g*"])
+        self.assertTrue(m.matches(BAKTA_GFF3))
+        self.assertFalse(m.matches(BAKTA_JSON))
+
+    def test_dict_filters_should_match_exact_values(self):
+        m = Matcher.from_dicts([{"filetype": "g*"}])
+        self.assertFalse(m.matches(BAKTA_GFF3))
+        self.assertTrue(m.matches({"filetype": "g*"}))
+
+    def test_empty_filters_should_match_everything(self):
+        self.assertTrue(Matcher.parse([]).matches(BAKTA_GFF3))
+        self.assertTrue(Matcher.parse([""]).matches(BAKTA_GFF3))
+        self.assertTrue(_parse_filters(None).matches(BAKTA_GFF3))
+
+    def test_invalid_filters_should_raise_a_parse_error(self):
+        for f in ["tool", "tool=bakta", ":bakta", "tool:", "tool:bakta|", "tool!="]:
+            with self.subTest(filter=f):
+                with self.assertRaises(FilterParseError):
+                    Matcher.parse([f])
+
+
+if __name__ == '__main__':
+    unittest.main()
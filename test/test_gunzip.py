@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from typing import IO, cast
+
+import requests_mock
+
+from bakrep.model import BakrepDownloader, Result, VerificationFailedException
+from bakrep.writers import DirectoryWriter, GunzipWriter, TarShardWriter, _GunzipOutput, read_index
+from test.test_download import NO_RETRY, mockdataset, mockserver
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+URL = f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{ID}/{ID}"
+
+
+def gunzip_writer(tmp: str):
+    return GunzipWriter(DirectoryWriter(lambda id: Path(tmp)))
+
+
+class GunzipWriterTest(unittest.TestCase):
+    def test_results_should_be_decompressed(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader() as d:
+                    d.download(ID, [{"tool": "bakta"}, {"tool": "mlst"}], gunzip_writer(tmp))
+                for name in ["bakta.json", "bakta.faa", "bakta.gff3", "bakta.gbff", "mlst.json"]:
+                    with self.subTest(name=name):
+                        self.assertEqual((Path(tmp) / f"{ID}.{name}").read_bytes(),
+                                         gzip.decompress((FIXTURES / f"{ID}.{name}.gz").read_bytes()))
+                self.assertFalse(any(p.name.endswith(".gz") for p in Path(tmp).iterdir()))
+
+    def test_large_outputs_should_be_written_in_pieces(self):
+        content = gzip.compress(b"a" * 10_000_000)
+        res = Result(f"{URL}.big.gz", {}, "", len(content))
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = gunzip_writer(tmp)
+            with writer.open(ID, res) as out:
+                writes = []
+                inner = cast(_GunzipOutput, out).out
+                original = inner.write
+                inner.write = lambda chunk: (writes.append(len(chunk)), original(chunk))
+                out.write(content)
+                out.commit()
+            self.assertEqual((Path(tmp) / f"{ID}.big").stat().st_size, 10_000_000)
+            self.assertLessEqual(max(writes), GunzipWriter.max_output)
+
+    def test_concatenated_members_should_be_decompressed(self):
+        content = gzip.compress(b"first\n") + gzip.compress(b"second\n")
+        res = Result(f"{URL}.txt.gz", {}, "", len(content))
+        with tempfile.TemporaryDirectory() as tmp:
+            with gunzip_writer(tmp).open(ID, res) as out:
+                out.write(content[:5])
+                out.write(content[5:])
+                out.commit()
+            self.assertEqual((Path(tmp) / f"{ID}.txt").read_bytes(), b"first\nsecond\n")
+
+    def test_invalid_gzip_data_should_fail_verification(self):
+        for verify in [True, False]:
+            with self.subTest(verify=verify), requests_mock.Mocker() as m:
+                mockdataset(m, ID)
+                m.get(f"{URL}.mlst.json.gz", content=b"not gzip")
+                with tempfile.TemporaryDirectory() as tmp:
+                    with BakrepDownloader(retry=NO_RETRY, verify=verify) as d:
+                        with self.assertRaises(VerificationFailedException):
+                            d.download(ID, [{"tool": "mlst"}], gunzip_writer(tmp))
+                    self.assertEqual(list(Path(tmp).iterdir()), [])
+
+    def test_truncated_gzip_data_should_fail(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            m.get(f"{URL}.mlst.json.gz", content=(FIXTURES / f"{ID}.mlst.json.gz").read_bytes()[:100])
+            with tempfile.TemporaryDirectory() as tmp:
+                with BakrepDownloader(retry=NO_RETRY, verify=False) as d:
+                    with self.assertRaises(VerificationFailedException):
+                        d.download(ID, [{"tool": "mlst"}], gunzip_writer(tmp))
+
+    def test_decompressed_files_should_be_skipped(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                (Path(tmp) / f"{ID}.mlst.json").write_text("{}")
+                with BakrepDownloader() as d:
+                    d.download(ID, [{"tool": "mlst"}], gunzip_writer(tmp))
+                self.assertEqual(m.call_count, 1)
+
+    def test_packed_results_should_be_decompressed(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with GunzipWriter(TarShardWriter(Path(tmp), lambda id: Path(id))) as writer, \
+                        BakrepDownloader() as d:
+                    d.download(ID, [{"tool": "gtdbtk"}], writer)
+                content = gzip.decompress((FIXTURES / f"{ID}.gtdbtk.json.gz").read_bytes())
+                with tarfile.open(Path(tmp) / "results-000001.tar") as tar:
+                    self.assertEqual(cast(IO[bytes], tar.extractfile(f"{ID}/{ID}.gtdbtk.json")).read(), content)
+                [entry] = read_index(Path(tmp) / "results-000001.tsv")
+                self.assertEqual(entry.md5, hashlib.md5(content).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
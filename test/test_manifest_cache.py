@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.manifest_cache import CachedManifest, ManifestCache
+from bakrep.model import BakrepDownloader, Dataset
+
+URL = "https://bakrep.computational.bio/api/v1/datasets/abc"
+
+
+def dataset(md5: str):
+    return {"id": "abc", "results": [{
+        "url": "https://bakrep-data.s3.computational.bio.uni-giessen.de/abc/abc.json",
+        "attributes": {"tool": "test"},
+        "md5": md5,
+        "size": 0,
+    }]}
+
+
+def get(cache: ManifestCache, id: str) -> CachedManifest:
+    cached = cache.get(id)
+    if cached is None:
+        raise AssertionError(f"{id} is not cached")
+    return cached
+
+
+class ManifestCacheTest(unittest.TestCase):
+
+    def test_fetched_manifest_should_be_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                m.get(URL, json=dataset("a"), headers={"ETag": '"v1"'})
+                with BakrepDownloader(manifest_cache=ManifestCache(Path(tmp))) as d:
+                    d.fetch_dataset("abc")
+            cached = get(ManifestCache(Path(tmp)), "abc")
+            self.assertEqual(cached.dataset, dataset("a"))
+            self.assertEqual(cached.etag, '"v1"')
+
+    def test_fresh_manifest_should_be_used_without_request(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ManifestCache(Path(tmp), ttl=3600)
+            cache.put("abc", dataset("a"))
+            with requests_mock.Mocker() as m:
+                with BakrepDownloader(manifest_cache=cache) as d:
+                    ds = d.fetch_dataset("abc")
+                self.assertEqual(m.call_count, 0)
+            self.assertEqual(ds, Dataset.from_dict(dataset("a")))
+
+    def test_unchanged_manifest_should_be_revalidated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ManifestCache(Path(tmp))
+            cache.put("abc", dataset("a"), etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+            with requests_mock.Mocker() as m:
+                m.get(URL, status_code=304)
+                with BakrepDownloader(manifest_cache=cache) as d:
+                    ds = d.fetch_dataset("abc")
+                headers = m.last_request.headers
+                self.assertEqual(headers["If-None-Match"], '"v1"')
+                self.assertEqual(headers["If-Modified-Since"], "Mon, 01 Jan 2024 00:00:00 GMT")
+            self.assertEqual(ds, Dataset.from_dict(dataset("a")))
+
+    def test_changed_manifest_should_replace_the_cached_one(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ManifestCache(Path(tmp))
+            cache.put("abc", dataset("a"), etag='"v1"')
+            with requests_mock.Mocker() as m:
+                m.get(URL, json=dataset("b"), headers={"ETag": '"v2"'})
+                with BakrepDownloader(manifest_cache=cache) as d:
+                    d.fetch_dataset("abc")
+            cached = get(cache, "abc")
+            self.assertEqual(cached.dataset, dataset("b"))
+            self.assertEqual(cached.etag, '"v2"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from requests_mock import Mocker
+
+from bakrep.cli import main
+from bakrep.metrics import Metrics
+from bakrep.model import DownloadFailedException, Result, VerificationFailedException
+from test.test_download_command import mock_dataset
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_events_should_be_written_as_json_lines(self):
+        with Mocker() as m:
+            mock_dataset(m, "abc")
+            m.get("https://bakrep.computational.bio/api/v1/datasets/xyz", status_code=404)
+            with tempfile.TemporaryDirectory() as tmp:
+                events_path = Path(tmp) / "events.jsonl"
+                main(["download", "-e", "abc,xyz", "-d", tmp, "--events", str(events_path)])
+                events = [json.loads(l) for l in events_path.read_text().splitlines()]
+                names = [e["event"] for e in events]
+                self.assertEqual(names.count("file_finished"), 3)
+                self.assertIn({"id": "abc", "status": 200, "cached": False},
+                              [{k: e[k] for k in ["id", "status", "cached"]}
+                               for e in events if e["event"] == "manifest_fetched"])
+                failed = [e for e in events if e["event"] == "manifest_failed"][0]
+                self.assertEqual(failed["status"], 404)
+                self.assertFalse(failed["retryable"])
+                self.assertIn("dataset_finished", names)
+                self.assertIn("dataset_failed", names)
+
+    def test_metrics_should_be_written_in_prometheus_format(self):
+        with Mocker() as m:
+            mock_dataset(m, "abc")
+            with tempfile.TemporaryDirectory() as tmp:
+                metrics_path = Path(tmp) / "bakrep.prom"
+                main(["download", "-e", "abc", "-d", tmp, "--metrics", str(metrics_path)])
+                metrics = metrics_path.read_text().splitlines()
+                self.assertIn('bakrep_datasets_total{state="finished"} 1', metrics)
+                self.assertIn('bakrep_files_total{host="bakrep-data.s3.computational.bio.uni-giessen.de"} 3', metrics)
+                self.assertIn('bakrep_manifests_total{status="200"} 1', metrics)
+
+    def test_failures_should_be_classified(self):
+        metrics = Metrics()
+        res = Result("https://example.org/a.json.gz", {}, "abc", 1)
+        metrics.transfer_failed("a", res, VerificationFailedException("a", res.url, "md5 mismatch"))
+        metrics.transfer_failed("a", res, DownloadFailedException("a", res.url, 500))
+        metrics.retry("a", res.url, 1, DownloadFailedException("a", res.url, 500), 0.5)
+        self.assertEqual(metrics.transfer_failures, 2)
+        self.assertEqual(metrics.verification_failures, 1)
+        self.assertEqual(metrics.retries, 1)
+        self.assertIn("2 failed attempts (1 corrupt), 1 retries", metrics.report()[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import gzip
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from bakrep.download import _parse_entries, _parse_ids_from_tsv
+
+TSV = "#id\tspecies\nSAMEA1\tE. coli\nSAMEA2\tB. subtilis\n\nSAMEA3\tS. aureus\n"
+
+
+class ParseIdsTest(unittest.TestCase):
+
+    def test_entries_should_be_stripped(self):
+        self.assertEqual(list(_parse_entries(" a, b,,c ")), ["a", "b", "c"])
+
+    def test_ids_should_be_read_from_the_first_column(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = Path(tmp) / "ids.tsv"
+            tsv.write_text(TSV)
+            self.assertEqual(list(_parse_ids_from_tsv(str(tsv))), ["SAMEA1", "SAMEA2", "SAMEA3"])
+
+    def test_ids_should_be_read_from_gzip_compressed_tsv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = Path(tmp) / "ids.tsv.gz"
+            tsv.write_bytes(gzip.compress(TSV.encode()))
+            self.assertEqual(list(_parse_ids_from_tsv(str(tsv))), ["SAMEA1", "SAMEA2", "SAMEA3"])
+
+    def test_ids_should_be_read_from_a_column_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = Path(tmp) / "ids.tsv"
+            tsv.write_text("E. coli\tSAMEA1\nB. subtilis\n")
+            self.assertEqual(list(_parse_ids_from_tsv(str(tsv), 1)), ["SAMEA1"])
+
+    def test_ids_should_be_read_from_a_named_column(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = Path(tmp) / "ids.tsv"
+            tsv.write_text("species\tid\nE. coli\tSAMEA1\nB. subtilis\tSAMEA2\n")
+            self.assertEqual(list(_parse_ids_from_tsv(str(tsv), "id")), ["SAMEA1", "SAMEA2"])
+
+    def test_unknown_column_should_raise_an_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = Path(tmp) / "ids.tsv"
+            tsv.write_text("species\tid\n")
+            with self.assertRaises(ValueError):
+                list(_parse_ids_from_tsv(str(tsv), "accession"))
+
+    def test_ids_should_be_read_from_stdin(self):
+        stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(gzip.compress(TSV.encode()))))
+        with mock.patch.object(sys, "stdin", stdin):
+            self.assertEqual(list(_parse_ids_from_tsv("-")), ["SAMEA1", "SAMEA2", "SAMEA3"])
+            self.assertFalse(stdin.buffer.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
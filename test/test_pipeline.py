@@ -0,0 +1,109 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.model import BakrepDownloader
+from bakrep.pipeline import DownloadPipeline
+from bakrep.retry import RetryPolicy
+from test.test_download_command import mock_dataset
+
+
+class Recorder:
+    def __init__(self):
+        self.finished = []
+        self.failed = []
+
+    def pipeline(self, tmp: str, filters=[], **kwargs):
+        downloader = BakrepDownloader(retry=RetryPolicy(max_retries=1, backoff=0))
+        return DownloadPipeline(downloader, filters, lambda id: Path(tmp) / id,
+                                on_finished=self.finished.append,
+                                on_failed=lambda id, e: self.failed.append(id), **kwargs)
+
+
+class DownloadPipelineTest(unittest.TestCase):
+    ids = [f"id{i}" for i in range(20)]
+
+    def test_all_datasets_should_be_downloaded(self):
+        with requests_mock.Mocker() as m:
+            for id in self.ids:
+                mock_dataset(m, id)
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                rec.pipeline(tmp, manifest_workers=3, transfer_workers=4, queue_size=2).run(self.ids)
+                self.assertEqual(sorted(rec.finished), sorted(self.ids))
+                self.assertEqual(rec.failed, [])
+                for id in self.ids:
+                    self.assertEqual(len(list((Path(tmp) / id).iterdir())), 3)
+
+    def test_missing_manifest_should_fail_only_its_dataset(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            m.get("https://bakrep.computational.bio/api/v1/datasets/xyz", status_code=404)
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                rec.pipeline(tmp, transfer_workers=2).run(["abc", "xyz"])
+                self.assertEqual(rec.finished, ["abc"])
+                self.assertEqual(rec.failed, ["xyz"])
+
+    def test_malformed_manifest_should_fail_only_its_dataset(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            m.get("https://bakrep.computational.bio/api/v1/datasets/xyz", json={"id": "xyz", "results": [{"url": "x"}]})
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                rec.pipeline(tmp, transfer_workers=2).run(["abc", "xyz"])
+                self.assertEqual(rec.finished, ["abc"])
+                self.assertEqual(rec.failed, ["xyz"])
+
+    def test_failed_write_should_fail_only_its_dataset(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            mock_dataset(m, "xyz")
+            with tempfile.TemporaryDirectory() as tmp:
+                # a file in place of the target directory
+                (Path(tmp) / "xyz").write_text("")
+                rec = Recorder()
+                rec.pipeline(tmp, transfer_workers=2).run(["abc", "xyz"])
+                self.assertEqual(rec.finished, ["abc"])
+                self.assertEqual(rec.failed, ["xyz"])
+
+    def test_failed_result_should_fail_its_dataset_once(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            mock_dataset(m, "xyz")
+            m.get("https://bakrep-data.s3.computational.bio.uni-giessen.de/xyz/xyz.gff3", status_code=500)
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                rec.pipeline(tmp, transfer_workers=2).run(["abc", "xyz"])
+                self.assertEqual(rec.finished, ["abc"])
+                self.assertEqual(rec.failed, ["xyz"])
+
+    def test_datasets_without_matching_results_should_be_finished(self):
+        with requests_mock.Mocker() as m:
+            mock_dataset(m, "abc")
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                rec.pipeline(tmp, filters=[{"tool": "unknown"}]).run(["abc"])
+                self.assertEqual(rec.finished, ["abc"])
+                self.assertFalse((Path(tmp) / "abc").exists())
+
+    def test_unexpected_errors_should_stop_the_pipeline(self):
+        with requests_mock.Mocker() as m:
+            for id in self.ids:
+                mock_dataset(m, id)
+            with tempfile.TemporaryDirectory() as tmp:
+                rec = Recorder()
+                pipeline = rec.pipeline(tmp, transfer_workers=2)
+
+                def finished(id: str):
+                    raise ZeroDivisionError()
+
+                pipeline.on_finished = finished
+                with self.assertRaises(ZeroDivisionError):
+                    pipeline.run(self.ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
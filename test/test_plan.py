@@ -0,0 +1,116 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.content_cache import ContentCache
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, DownloadSet, Result
+from bakrep.plan import CACHED, DOWNLOAD, PRESENT, Plan, measure_throughput, resolve
+from bakrep.retry import RetryPolicy
+from bakrep.writers import DirectoryWriter
+from test.test_download import mockserver
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+
+
+class PlanTest(unittest.TestCase):
+    def test_results_should_be_grouped_by_tool_and_filetype(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            m.get("https://bakrep.computational.bio/api/v1/datasets/unknown", status_code=404)
+            with tempfile.TemporaryDirectory() as tmp:
+                name = f"{ID}.bakta.gff3.gz"
+                (Path(tmp) / name).write_bytes((FIXTURES / name).read_bytes())
+                with BakrepDownloader(retry=RetryPolicy(max_retries=0)) as d:
+                    plan = resolve(d, [ID, "unknown"], Matcher.parse(["tool:bakta"]),
+                                   DirectoryWriter(lambda id: Path(tmp)), workers=2)
+                self.assertEqual(plan.datasets, 1)
+                self.assertEqual(plan.failed, ["unknown"])
+                self.assertEqual(len(plan.groups), 5)
+                gff3 = plan.groups[("bakta", "gff3")]
+                self.assertEqual(gff3.files[PRESENT], 1)
+                self.assertEqual(gff3.bytes[PRESENT], 378160)
+                self.assertEqual(plan.total(DOWNLOAD), 965037 + 137591 + 716583)
+                self.assertEqual(plan.total(CACHED), 0)
+
+    def test_sample_should_be_bounded(self):
+        plan = Plan(sample_size=3)
+        for i in range(100):
+            plan.add_dataset(f"id{i}", [(Result(f"https://example.org/id{i}.json", {}, "", 10), DOWNLOAD),
+                                         (Result(f"https://example.org/id{i}.fas", {}, "", 10), PRESENT)])
+        self.assertEqual(len(plan.sample), 3)
+        self.assertEqual(plan.total(DOWNLOAD), 1000)
+
+    def test_throughput_should_be_measured_with_the_sample(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                sample = [(ID, r) for r in d.fetch_dataset(ID).filter([{"tool": "bakta"}])]
+                throughput = measure_throughput(d, sample, 2)
+                self.assertTrue(throughput is not None and throughput > 0)
+            self.assertIsNone(measure_throughput(d, [], 2))
+
+
+class PlanCommandTest(unittest.TestCase):
+    def test_plan_should_not_download_anything(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    main(["download", "-e", ID, "-d", tmp, "--plan", "-m", "tool:mlst"])
+                self.assertFalse((Path(tmp) / ID[3:7]).exists())
+                lines = out.getvalue().splitlines()
+                self.assertTrue(lines[0].startswith("Plan for 1 datasets"))
+                self.assertIn("mlst", lines[2])
+
+    def test_plan_should_not_change_the_download_set(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with DownloadSet.at_location(tmp, ["a", "b"]) as ds:
+                    ds.finish_dataset("a")
+                cache = str(Path(tmp) / "cache")
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    main(["download", "-e", ID, "-d", tmp, "--plan", "--restart", "--cache-dir", cache])
+                self.assertTrue(out.getvalue().startswith("Plan for 1 datasets"))
+                with DownloadSet.at_location(tmp) as ds:
+                    self.assertSetEqual(ds.toDownload, {"a", "b"})
+                    self.assertSetEqual(ds.downloaded, {"a"})
+                with ContentCache(Path(cache)) as c:
+                    self.assertEqual(c.size(), 0)
+
+    def test_a_sync_should_be_planned_without_input(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with DownloadSet.at_location(tmp, [ID, ID]) as ds:
+                    ds.finish_dataset(ID)
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    main(["download", "-d", tmp, "--plan", "--sync"])
+                self.assertTrue(out.getvalue().startswith("Plan for 1 datasets"))
+                with DownloadSet.at_location(tmp) as ds:
+                    self.assertSetEqual(ds.downloaded, {ID})
+
+    def test_plan_should_fail_without_enough_space(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with mock.patch("shutil.disk_usage", return_value=mock.Mock(free=1000)), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    with self.assertRaises(SystemExit) as cm:
+                        main(["download", "-e", ID, "-d", tmp, "--dry-run"])
+                self.assertIn("not enough free space", str(cm.exception.code))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from requests_mock import Mocker
+
+from bakrep.cli import main
+from bakrep.model import DownloadSet
+from bakrep.progress import JobProgress, progress_locations
+from bakrep.shard import Shard
+from test.test_download_command import mock_dataset
+
+
+class JobProgressTest(unittest.TestCase):
+    def test_shards_should_be_merged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b", "c"], shard=Shard(1, 2)) as s:
+                s.finish_dataset("a")
+                s.failed_dataset("b")
+            with DownloadSet.at_location(tmp, ["d", "e"], shard=Shard(2, 2)) as s:
+                s.finish_dataset("d")
+            with JobProgress(Path(tmp)) as job:
+                self.assertEqual([name for (name, _) in job.shards], ["shard-1-of-2", "shard-2-of-2"])
+                self.assertEqual(job.counts(), (2, 1, 2))
+                self.assertEqual(list(job.ids("downloaded")), ["a", "d"])
+                self.assertEqual(list(job.ids("failed")), ["b"])
+                self.assertEqual(list(job.ids("pending")), ["c", "e"])
+
+    def test_a_dataset_downloaded_by_any_shard_should_be_downloaded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with DownloadSet.at_location(tmp, ["a", "b"]) as s:
+                s.failed_dataset("a")
+            with DownloadSet.at_location(tmp, ["a"], shard=Shard(1, 3)) as s:
+                s.finish_dataset("a")
+            with JobProgress(Path(tmp)) as job:
+                self.assertEqual(job.counts(), (1, 0, 1))
+
+    def test_shards_should_be_ordered_by_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for k in [10, 2, 1]:
+                DownloadSet.at_location(tmp, shard=Shard(k, 12)).close()
+            names = [name for (name, _) in progress_locations(Path(tmp))]
+            self.assertEqual(names, ["shard-1-of-12", "shard-2-of-12", "shard-10-of-12"])
+
+
+class ProgressCommandTest(unittest.TestCase):
+    ids = [f"id{i}" for i in range(10)]
+
+    def test_sharded_downloads_should_cover_all_datasets(self):
+        with Mocker() as m:
+            for id in self.ids:
+                mock_dataset(m, id)
+            with tempfile.TemporaryDirectory() as tmp:
+                for k in [1, 2, 3]:
+                    main(["download", "-e", ",".join(self.ids), "-d", tmp, "--flat", "--shard", f"{k}/3"])
+                for id in self.ids:
+                    self.assertTrue((Path(tmp) / id).is_dir())
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    main(["progress", "-d", tmp])
+                lines = out.getvalue().splitlines()
+                self.assertEqual(len(lines), 4)
+                self.assertEqual(lines[-1], "total: 10 datasets, 10 downloaded, 0 failed, 0 pending")
+
+    def test_should_fail_without_progress(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(SystemExit):
+                main(["progress", "-d", tmp])
+
+    def test_should_fail_for_invalid_shard(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(SystemExit):
+                main(["download", "-e", "abc", "-d", tmp, "--shard", "3/2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
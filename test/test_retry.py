@@ -0,0 +1,111 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests
+import requests_mock
+
+from bakrep.model import BakrepDownloader, DownloadFailedException
+from bakrep.retry import RetryPolicy, parse_retry_after
+from test.test_download import mockdataset
+
+ID = "SAMEA3231284"
+MLST_URL = f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{ID}/{ID}.mlst.json.gz"
+MLST = Path(f"./test/data/scenarios/download-dataset/{ID}.mlst.json.gz").read_bytes()
+
+
+class RecordingPolicy(RetryPolicy):
+    def __init__(self, **kwargs):
+        self.delays = []
+        super().__init__(sleep=self.delays.append, **kwargs)
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_server_errors_should_be_retried_per_file(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            m.get(MLST_URL, [{"status_code": 500}, {"status_code": 502}, {"content": MLST}])
+            with tempfile.TemporaryDirectory() as tmp:
+                policy = RecordingPolicy()
+                with BakrepDownloader(retry=policy) as d:
+                    d.download(ID, [{"tool": "mlst"}], tmp)
+                self.assertEqual(len(policy.delays), 2)
+                # the manifest is not requested again
+                self.assertEqual(m.call_count, 4)
+
+    def test_not_found_should_not_be_retried(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            m.get(MLST_URL, status_code=404)
+            with tempfile.TemporaryDirectory() as tmp:
+                policy = RecordingPolicy()
+                with BakrepDownloader(retry=policy) as d:
+                    with self.assertRaises(DownloadFailedException) as cm:
+                        d.download(ID, [{"tool": "mlst"}], tmp)
+                self.assertEqual(policy.delays, [])
+                self.assertEqual(cm.exception.status_code, 404)
+                self.assertFalse(cm.exception.retryable)
+
+    def test_invalid_urls_should_not_be_retried(self):
+        policy = RecordingPolicy()
+        with BakrepDownloader("bakrep.invalid/api/", retry=policy) as d:
+            with self.assertRaises(DownloadFailedException) as cm:
+                d.fetch_dataset(ID)
+        self.assertIsInstance(cm.exception.reason, requests.exceptions.MissingSchema)
+        self.assertFalse(cm.exception.retryable)
+        self.assertEqual(policy.delays, [])
+
+    def test_only_transient_errors_should_be_retryable(self):
+        for (reason, retryable) in [(requests.exceptions.ReadTimeout(), True),
+                                    (requests.exceptions.ChunkedEncodingError(), True),
+                                    (requests.exceptions.InvalidURL(), False),
+                                    (requests.exceptions.InvalidSchema(), False),
+                                    (ValueError(), False)]:
+            with self.subTest(reason=type(reason).__name__):
+                self.assertEqual(DownloadFailedException(ID, MLST_URL, reason).retryable, retryable)
+
+    def test_retry_after_should_be_honored(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            m.get(MLST_URL, [{"status_code": 429, "headers": {"Retry-After": "7"}}, {"content": MLST}])
+            with tempfile.TemporaryDirectory() as tmp:
+                policy = RecordingPolicy(backoff=0.01)
+                with BakrepDownloader(retry=policy) as d:
+                    d.download(ID, [{"tool": "mlst"}], tmp)
+                self.assertEqual(policy.delays, [7.0])
+
+    def test_connection_errors_should_be_retried_until_the_limit(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            m.get(MLST_URL, exc=requests.exceptions.ConnectTimeout)
+            with tempfile.TemporaryDirectory() as tmp:
+                policy = RecordingPolicy(max_retries=2)
+                with BakrepDownloader(retry=policy) as d:
+                    with self.assertRaises(DownloadFailedException):
+                        d.download(ID, [{"tool": "mlst"}], tmp)
+                self.assertEqual(len(policy.delays), 2)
+
+    def test_requests_should_have_a_timeout(self):
+        with requests_mock.Mocker() as m:
+            mockdataset(m, ID)
+            with BakrepDownloader(timeout=12) as d:
+                d.fetch_dataset(ID)
+            self.assertEqual(m.last_request.timeout, 12)
+
+    def test_delays_should_grow_exponentially_up_to_the_maximum(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5)
+        for attempt in range(6):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2 ** attempt))
+
+    def test_retry_after_should_be_parsed(self):
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
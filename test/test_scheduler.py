@@ -0,0 +1,108 @@
+import contextlib
+import hashlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.filters import Matcher
+from bakrep.model import BakrepDownloader, DownloadSet, Result
+from bakrep.retry import RetryPolicy
+from bakrep.scheduler import Scheduler, resolve_sizes
+
+API = "https://bakrep.computational.bio/api/v1/datasets/"
+
+
+def mock_sized_dataset(m: requests_mock.Mocker, id: str, sizes: list):
+    results = [{
+        "url": f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{id}/{id}.{i}.json",
+        "attributes": {"tool": "test", "filetype": f"f{i}"},
+        "md5": hashlib.md5(b"x" * size).hexdigest(),
+        "size": size,
+    } for (i, size) in enumerate(sizes)]
+    m.get(API + id, json={"id": id, "results": results})
+    for (r, size) in zip(results, sizes):
+        m.get(r["url"], content=b"x" * size)
+
+
+class SchedulerTest(unittest.TestCase):
+    ids = ["SAMEA100001", "SAMEA100002", "SAMEA200001", "SAMEA100003", "SAMEA300001", "SAMEA200002"]
+
+    def _set(self, tmp: str):
+        ds = DownloadSet.at_location(tmp, self.ids)
+        for (id, size) in zip(self.ids, [30, 10, 50, None, 10, 20]):
+            if size is not None:
+                ds.set_size(id, size)
+        return ds
+
+    def test_input_order_should_be_kept(self):
+        with tempfile.TemporaryDirectory() as tmp, self._set(tmp) as ds:
+            self.assertListEqual(list(Scheduler.of("input").pending(ds)), self.ids)
+
+    def test_largest_should_come_first(self):
+        with tempfile.TemporaryDirectory() as tmp, self._set(tmp) as ds:
+            ds.finish_dataset("SAMEA200001")
+            self.assertListEqual(list(Scheduler.of("largest").pending(ds)),
+                                 ["SAMEA100001", "SAMEA200002", "SAMEA100002", "SAMEA300001", "SAMEA100003"])
+
+    def test_smallest_should_come_first(self):
+        with tempfile.TemporaryDirectory() as tmp, self._set(tmp) as ds:
+            self.assertListEqual(list(ds.pending(page_size=2, order_by=Scheduler.of("smallest").order_by)),
+                                 ["SAMEA100002", "SAMEA300001", "SAMEA200002", "SAMEA100001", "SAMEA200001",
+                                  "SAMEA100003"])
+
+    def test_groups_should_be_interleaved(self):
+        with tempfile.TemporaryDirectory() as tmp, self._set(tmp) as ds:
+            self.assertListEqual(list(Scheduler.of("interleave").pending(ds)),
+                                 ["SAMEA100001", "SAMEA200001", "SAMEA300001", "SAMEA100002", "SAMEA200002",
+                                  "SAMEA100003"])
+
+    def test_result_files_should_be_ordered_by_size(self):
+        results = [Result(f"https://example.org/{size}", {}, "", size) for size in [2, 3, 1]]
+        self.assertListEqual([r.size for r in Scheduler.of("largest").order_results(results)], [3, 2, 1])
+        self.assertListEqual([r.size for r in Scheduler.of("smallest").order_results(results)], [1, 2, 3])
+        self.assertListEqual(Scheduler.of("input").order_results(results), results)
+
+    def test_unknown_order_should_fail(self):
+        with self.assertRaises(ValueError):
+            Scheduler.of("random")
+
+    def test_sizes_should_be_resolved_for_the_selected_results(self):
+        with requests_mock.Mocker() as m:
+            mock_sized_dataset(m, "SAMEA100001", [10, 20])
+            m.get(API + "SAMEA100002", status_code=404)
+            with tempfile.TemporaryDirectory() as tmp, \
+                    DownloadSet.at_location(tmp, ["SAMEA100001", "SAMEA100002"]) as ds, \
+                    BakrepDownloader(retry=RetryPolicy(max_retries=0)) as d:
+                self.assertEqual(resolve_sizes(d, ds, Matcher.parse(["filetype:f1"]), workers=2), 1)
+                self.assertListEqual(list(ds.unsized()), ["SAMEA100002"])
+                self.assertListEqual(list(Scheduler.of("largest").pending(ds)), ["SAMEA100001", "SAMEA100002"])
+
+
+class OrderCommandTest(unittest.TestCase):
+    def test_manifests_should_be_resolved_once_when_ordering_by_size(self):
+        ids = ["SAMEA100001", "SAMEA100002", "SAMEA100003"]
+        with requests_mock.Mocker() as m:
+            for (id, size) in zip(ids, [5, 30, 10]):
+                mock_sized_dataset(m, id, [size, 1])
+            with tempfile.TemporaryDirectory() as tmp:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main(["download", "-e", ",".join(ids), "-d", tmp, "--flat", "--order", "largest"])
+                for id in ids:
+                    self.assertTrue((Path(tmp) / id / f"{id}.0.json").exists())
+                manifests = [r for r in m.request_history if r.url.startswith(API)]
+                self.assertEqual(len(manifests), 3)
+                with DownloadSet.at_location(tmp) as ds:
+                    self.assertSetEqual(ds.downloaded, set(ids))
+
+    def test_an_unknown_order_should_fail(self):
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main(["download", "-e", "abc", "-d", tmp, "--order", "random"])
+
+
+if __name__ == '__main__':
+    unittest.main()
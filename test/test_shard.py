@@ -0,0 +1,33 @@
+import unittest
+
+from bakrep.shard import Shard
+
+
+class ShardTest(unittest.TestCase):
+    ids = [f"SAMEA{i}" for i in range(1000)]
+
+    def test_shards_should_partition_the_ids(self):
+        shards = [Shard(k, 4) for k in range(1, 5)]
+        parts = [list(s.filter(self.ids)) for s in shards]
+        self.assertEqual(sorted(sum(parts, [])), sorted(self.ids))
+        for part in parts:
+            self.assertGreater(len(part), 200)
+
+    def test_shards_should_be_stable(self):
+        self.assertTrue(Shard(1, 2).contains("SAMEA3231284"))
+        self.assertFalse(Shard(2, 2).contains("SAMEA3231284"))
+
+    def test_single_shard_should_contain_everything(self):
+        self.assertEqual(list(Shard(1, 1).filter(self.ids)), self.ids)
+
+    def test_parse(self):
+        self.assertEqual(Shard.parse("2/4"), Shard(2, 4))
+        self.assertEqual(Shard.parse("2/4").name, "shard-2-of-4")
+        for value in ["2", "0/4", "5/4", "a/b", "1/0", "-1/4"]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    Shard.parse(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import gzip
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.content_cache import ContentCache
+from bakrep.model import BakrepDownloader, DownloadFailedException
+from bakrep.retry import RetryPolicy
+from test.test_download import mockserver
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+
+
+class IterResultsTest(unittest.TestCase):
+    def test_results_should_be_streamed(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                results = d.iter_results([ID], [{"tool": "mlst"}, {"tool": "checkm2"}])
+                items = {res.filename(): (dataset, stream.read()) for (dataset, res, stream) in results}
+            self.assertSetEqual(set(items), {f"{ID}.mlst.json.gz", f"{ID}.checkm2.json.gz"})
+            (dataset, data) = items[f"{ID}.mlst.json.gz"]
+            self.assertEqual(dataset.id, ID)
+            self.assertEqual(len(dataset.results), 2)
+            self.assertEqual(data, (FIXTURES / f"{ID}.mlst.json.gz").read_bytes())
+
+    def test_results_should_be_decompressed_and_decoded(self):
+        expected = gzip.decompress((FIXTURES / f"{ID}.bakta.gff3.gz").read_bytes())
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                items = {res.attributes["filetype"]: value for (_, res, value) in
+                         d.iter_results([ID], [{"tool": "bakta", "filetype": "gff3"}, {"tool": "mlst"}],
+                                        decompress=True, decode_json=True, spool_size=1024)}
+            self.assertIsInstance(items["json"], list)
+            # a stream is closed after the next item
+            with self.assertRaises(ValueError):
+                items["gff3"].read()
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                for (_, res, value) in d.iter_results([ID], [{"tool": "bakta", "filetype": "gff3"}],
+                                                      decompress=True):
+                    self.assertEqual(value.read(), expected)
+
+    def test_compressed_json_should_be_decoded(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                [(_, _, value)] = list(d.iter_results([ID], [{"tool": "mlst"}], decode_json=True))
+            self.assertIsInstance(value, list)
+
+    def test_failed_datasets_should_be_raised(self):
+        with requests_mock.Mocker() as m:
+            m.get("https://bakrep.computational.bio/api/v1/datasets/unknown", status_code=404)
+            with BakrepDownloader(retry=RetryPolicy(max_retries=0)) as d:
+                with self.assertRaises(DownloadFailedException):
+                    list(d.iter_results(["unknown"]))
+                failed = []
+                self.assertListEqual(
+                    list(d.iter_results(["unknown"], on_failed=lambda id, e: failed.append(id))), [])
+                self.assertListEqual(failed, ["unknown"])
+
+    def test_stopping_early_should_stop_the_downloads(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with BakrepDownloader() as d:
+                it = d.iter_results([ID], workers=1, prefetch=1)
+                next(it)
+                it.close()
+            self.assertFalse(any(t.name.startswith("bakrep-") for t in threading.enumerate()))
+
+    def test_cached_results_should_be_streamed(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp, ContentCache(Path(tmp)) as cache, \
+                    BakrepDownloader(content_cache=cache) as d:
+                first = [stream.read() for (_, _, stream) in d.iter_results([ID], [{"tool": "mlst"}])]
+                requests = m.call_count
+                second = [stream.read() for (_, _, stream) in d.iter_results([ID], [{"tool": "mlst"}])]
+                self.assertEqual(first, second)
+                self.assertEqual(m.call_count, requests + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import contextlib
+import gzip
+import io
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from bakrep.cli import main
+from bakrep.summarize import HEADER, SummaryStore, scan, summarize_dataset, update
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+
+
+def copy_results(directory: Path, tools=("checkm2", "gtdbtk", "mlst", "assemblyscan")):
+    directory.mkdir(parents=True, exist_ok=True)
+    for tool in tools:
+        shutil.copy(FIXTURES / f"{ID}.{tool}.json.gz", directory / f"{ID}.{tool}.json.gz")
+
+
+class SummarizeTest(unittest.TestCase):
+    def test_datasets_should_be_found_in_both_layouts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            copy_results(Path(tmp) / "3231" / ID, ["mlst"])
+            copy_results(Path(tmp) / ID, ["checkm2"])
+            (Path(tmp) / ".progress").mkdir()
+            (Path(tmp) / "3231" / ID / f"{ID}.bakta.json.gz").touch()
+            (Path(tmp) / "3231" / ID / f"{ID}.gtdbtk.json.gz.part").touch()
+            found = [(id, sorted(files)) for (id, files) in scan(Path(tmp))]
+            self.assertListEqual(found, [(ID, ["mlst"]), (ID, ["checkm2"])])
+
+    def test_the_results_should_be_flattened(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            copy_results(Path(tmp) / ID)
+            json = Path(tmp) / ID / f"{ID}.mlst.json"
+            json.write_bytes(gzip.decompress((FIXTURES / f"{ID}.mlst.json.gz").read_bytes()))
+            (Path(tmp) / ID / f"{ID}.mlst.json.gz").unlink()
+            [item] = list(scan(Path(tmp)))
+            (signature, row) = summarize_dataset(item)
+            values = dict(zip(HEADER, row))
+            self.assertEqual(values["id"], ID)
+            self.assertEqual(values["checkm2_completeness"], 100.0)
+            self.assertEqual(values["gtdbtk_species"], "Mycoplasmoides pneumoniae")
+            self.assertEqual(values["mlst_sequence_type"], "2")
+            self.assertTrue(values["mlst_alleles"].startswith("atpA(4),glyA(2)"))
+            self.assertEqual(values["assemblyscan_n50_contig_length"], 9607)
+            self.assertEqual(len(signature.split(";")), 4)
+
+    def test_corrupt_files_should_be_parsed_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            copy_results(Path(tmp) / ID, ["checkm2"])
+            (Path(tmp) / ID / f"{ID}.checkm2.json.gz").write_bytes(b"\x1f\x8b broken")
+            with SummaryStore(Path(tmp) / "summary.sqlite") as store:
+                self.assertEqual(update(store, Path(tmp)), (1, 0, 0))
+            with SummaryStore(Path(tmp) / "summary.sqlite") as store:
+                self.assertEqual(update(store, Path(tmp)), (1, 0, 0))
+
+    def test_only_changed_datasets_should_be_parsed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            download = Path(tmp) / "download"
+            copy_results(download / "3231" / ID, ["checkm2"])
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                main(["summarize", "-d", str(download), "-o", str(Path(tmp) / "summary.tsv"), "-j", "2"])
+                main(["summarize", "-d", str(download), "-o", str(Path(tmp) / "summary.tsv"), "-j", "2"])
+                copy_results(download / "3231" / ID, ["gtdbtk"])
+                main(["summarize", "-d", str(download), "-o", str(Path(tmp) / "summary.tsv")])
+            self.assertListEqual(out.getvalue().splitlines(), [
+                "Summarized 1 datasets: 1 parsed, 0 unchanged, 0 removed",
+                "Summarized 1 datasets: 0 parsed, 1 unchanged, 0 removed",
+                "Summarized 1 datasets: 1 parsed, 0 unchanged, 0 removed",
+            ])
+            lines = (Path(tmp) / "summary.tsv").read_text().splitlines()
+            self.assertEqual(lines[0], "#" + "\t".join(HEADER))
+            row = dict(zip(HEADER, lines[1].split("\t")))
+            self.assertEqual(row["gtdbtk_genus"], "Mycoplasmoides")
+            self.assertEqual(row["mlst_scheme"], "")
+
+    def test_removed_datasets_should_be_removed_from_the_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            download = Path(tmp) / "download"
+            copy_results(download / "3231" / ID)
+            output = Path(tmp) / "summary.sqlite"
+            with contextlib.redirect_stdout(io.StringIO()):
+                main(["summarize", "-d", str(download), "-o", str(output)])
+                with sqlite3.connect(str(output)) as db:
+                    self.assertEqual(db.execute("SELECT gtdbtk_order FROM summary").fetchall(), [("Mycoplasmatales",)])
+                db.close()
+                shutil.rmtree(download / "3231")
+                main(["summarize", "-d", str(download), "-o", str(output)])
+            with sqlite3.connect(str(output)) as db:
+                self.assertEqual(db.execute("SELECT count(*) FROM summary").fetchone(), (0,))
+            db.close()
+
+    def test_should_fail_without_download_directory(self):
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main(["summarize", "-d", str(Path(tmp) / "missing"), "-o", str(Path(tmp) / "summary.tsv")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import contextlib
+import hashlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.model import DownloadSet
+
+ID = "SAMEA100001"
+API = "https://bakrep.computational.bio/api/v1/datasets/"
+DATA = f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{ID}/"
+
+
+def mock_files(m: requests_mock.Mocker, files: dict):
+    results = [{
+        "url": DATA + name,
+        "attributes": {"tool": "test", "filetype": name.split(".")[1]},
+        "md5": hashlib.md5(content).hexdigest(),
+        "size": len(content),
+    } for (name, content) in files.items()]
+    m.get(API + ID, json={"id": ID, "results": results})
+    for (name, content) in files.items():
+        m.get(DATA + name, content=content)
+
+
+def data_requests(m: requests_mock.Mocker):
+    return sorted(r.url[len(DATA):] for r in m.request_history if r.url.startswith(DATA))
+
+
+class SyncTest(unittest.TestCase):
+    def _download(self, tmp: str, *options: str):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(["download", "-e", ID, "-d", tmp, "--flat", *options])
+        return out.getvalue().splitlines()
+
+    def test_only_changed_files_should_be_downloaded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.b.json": b"b", f"{ID}.c.json": b"c"})
+                self._download(tmp)
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.b.json": b"b2", f"{ID}.d.json": b"d"})
+                lines = self._download(tmp, "--sync", "--changeset", str(Path(tmp) / "changes.tsv"))
+                self.assertListEqual(data_requests(m), [f"{ID}.b.json", f"{ID}.d.json"])
+            self.assertIn("Sync: 1 files added, 1 changed, 0 removed, 1 unchanged", lines)
+            self.assertEqual((Path(tmp) / ID / f"{ID}.b.json").read_bytes(), b"b2")
+            # without --prune the file stays
+            self.assertTrue((Path(tmp) / ID / f"{ID}.c.json").exists())
+            self.assertListEqual(sorted((Path(tmp) / "changes.tsv").read_text().splitlines()), [
+                "#change\tid\tfile",
+                f"added\t{ID}\t{ID}.d.json",
+                f"changed\t{ID}\t{ID}.b.json",
+            ])
+
+    def test_removed_files_should_be_pruned(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.c.json": b"c"})
+                self._download(tmp, "-m", "filetype:a")
+                (Path(tmp) / ID / "notes.txt").write_text("kept")
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.c.json": b"c"})
+                lines = self._download(tmp, "--sync", "--prune")
+                self.assertListEqual(data_requests(m), [f"{ID}.c.json"])
+            self.assertIn("Sync: 1 files added, 0 changed, 1 removed, 0 unchanged", lines)
+            self.assertListEqual(sorted(p.name for p in (Path(tmp) / ID).iterdir()), [f"{ID}.c.json", "notes.txt"])
+            with DownloadSet.at_location(tmp) as ds:
+                self.assertListEqual(list(ds.finished_files(ID)), [f"{ID}.c.json"])
+
+    def test_previous_datasets_should_be_synced_without_input(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.b.json": b"b"})
+                self._download(tmp)
+            (Path(tmp) / ID / f"{ID}.a.json").unlink()
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.b.json": b"b2"})
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    main(["download", "-d", tmp, "--flat", "--sync"])
+                self.assertListEqual(data_requests(m), [f"{ID}.a.json", f"{ID}.b.json"])
+            # the deleted file is restored
+            self.assertIn("Sync: 1 files added, 1 changed, 0 removed, 0 unchanged", out.getvalue().splitlines())
+
+    def test_files_without_a_record_should_be_verified(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / ID).mkdir()
+            (Path(tmp) / ID / f"{ID}.a.json").write_bytes(b"a")
+            (Path(tmp) / ID / f"{ID}.b.json").write_bytes(b"x")
+            with requests_mock.Mocker() as m:
+                mock_files(m, {f"{ID}.a.json": b"a", f"{ID}.b.json": b"b"})
+                lines = self._download(tmp, "--sync")
+                self.assertListEqual(data_requests(m), [f"{ID}.b.json"])
+            self.assertIn("Sync: 1 files added, 0 changed, 0 removed, 1 unchanged", lines)
+
+    def test_prune_should_require_sync(self):
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main(["download", "-e", ID, "-d", tmp, "--prune"])
+
+    def test_sync_should_not_be_combined_with_pack(self):
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main(["download", "-e", ID, "-d", tmp, "--sync", "--pack", "1G"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+import unittest
+
+from bakrep.throttle import AdaptiveConcurrency, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_consume_should_limit_the_rate(self):
+        bucket = TokenBucket(rate=1000, burst=100)
+        start = time.monotonic()
+        for _ in range(3):
+            bucket.consume(100)
+        # the burst is free, the other 200 tokens need 0.2 seconds
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+    def test_consume_within_burst_should_not_block(self):
+        bucket = TokenBucket(rate=10, burst=100)
+        start = time.monotonic()
+        bucket.consume(100)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def test_throttling_should_decrease_the_limit(self):
+        c = AdaptiveConcurrency(8)
+        c.record(429, 0.1)
+        self.assertEqual(c.limit, 4)
+
+    def test_throttling_should_count_once_per_cooldown(self):
+        c = AdaptiveConcurrency(8, cooldown=60)
+        c.record(503, 0.1)
+        c.record(503, 0.1)
+        self.assertEqual(c.limit, 4)
+
+    def test_limit_should_not_drop_below_minimum(self):
+        c = AdaptiveConcurrency(8, minimum=2, cooldown=0)
+        for _ in range(5):
+            c.record(429, 0.1)
+        self.assertEqual(c.limit, 2)
+
+    def test_success_should_increase_the_limit_up_to_maximum(self):
+        c = AdaptiveConcurrency(4, cooldown=0)
+        c.record(429, 0.1)
+        for _ in range(20):
+            c.record(200, 0.1)
+        self.assertEqual(c.limit, 4)
+
+    def test_rising_latency_should_decrease_the_limit(self):
+        c = AdaptiveConcurrency(8, latency_threshold=1.0, cooldown=0)
+        for _ in range(50):
+            c.record(200, 0.1)
+        for _ in range(5):
+            c.record(200, 2.0)
+        self.assertLess(c.limit, 8)
+
+    def test_latency_should_be_ignored_without_a_threshold(self):
+        c = AdaptiveConcurrency(8, cooldown=0)
+        for _ in range(50):
+            c.record(200, 0.1)
+        for _ in range(5):
+            c.record(200, 2.0)
+        self.assertEqual(c.limit, 8)
+
+    def test_jitter_below_the_threshold_should_keep_the_limit(self):
+        c = AdaptiveConcurrency(8, latency_threshold=1.0, cooldown=0)
+        rng = random.Random(0)
+        for _ in range(1000):
+            # fast responses, every tenth is several times slower
+            c.record(200, rng.uniform(0.005, 0.02) * (10 if rng.random() < 0.1 else 1))
+        self.assertEqual(c.limit, 8)
+
+    def test_acquire_should_block_above_the_limit(self):
+        c = AdaptiveConcurrency(1)
+        c.acquire()
+        acquired = threading.Event()
+
+        def worker():
+            with c:
+                acquired.set()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        self.assertFalse(acquired.wait(0.1))
+        c.release()
+        self.assertTrue(acquired.wait(1))
+        t.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
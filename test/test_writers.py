@@ -0,0 +1,103 @@
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from typing import IO, cast
+
+import requests_mock
+
+from bakrep.cli import main
+from bakrep.model import BakrepDownloader, DownloadFailedException, Result
+from bakrep.writers import PackedResults, TarShardWriter, read_index
+from test.test_download import NO_RETRY, mockserver
+from test.test_download_command import mock_dataset
+
+ID = "SAMEA3231284"
+FIXTURES = Path("./test/data/scenarios/download-dataset")
+
+
+class TarShardWriterTest(unittest.TestCase):
+    def test_results_should_be_packed_into_an_archive_with_an_index(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with TarShardWriter(Path(tmp), lambda id: Path(id)) as writer, BakrepDownloader() as d:
+                    d.download(ID, [], writer)
+                self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()), ["results-000001.tar", "results-000001.tsv"])
+                with tarfile.open(Path(tmp) / "results-000001.tar") as tar:
+                    names = tar.getnames()
+                    self.assertEqual(len(names), 9)
+                    member = cast(IO[bytes], tar.extractfile(f"{ID}/{ID}.bakta.gff3.gz"))
+                    self.assertEqual(member.read(), (FIXTURES / f"{ID}.bakta.gff3.gz").read_bytes())
+                packed = PackedResults(Path(tmp))
+                self.assertEqual(packed.ids(), [ID])
+                self.assertEqual(len(packed.files(ID)), 9)
+                for name in packed.files(ID):
+                    self.assertEqual(packed.read(ID, name), (FIXTURES / name).read_bytes())
+
+    def test_archives_should_roll_over_at_the_shard_size(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            with tempfile.TemporaryDirectory() as tmp:
+                with TarShardWriter(Path(tmp), lambda id: Path(id), shard_size=100_000) as writer, \
+                        BakrepDownloader() as d:
+                    d.download(ID, [{"tool": "bakta"}], writer)
+                archives = sorted(Path(tmp).glob("*.tar"))
+                self.assertGreater(len(archives), 1)
+                entries = [e for a in archives for e in read_index(a.with_suffix(".tsv"))]
+                self.assertEqual(len(entries), 5)
+                for a in archives:
+                    with tarfile.open(a) as tar:
+                        self.assertGreater(len(tar.getnames()), 0)
+
+    def test_corrupt_results_should_not_be_packed(self):
+        with requests_mock.Mocker() as m:
+            mockserver(m, ID)
+            m.get(f"https://bakrep-data.s3.computational.bio.uni-giessen.de/{ID}/{ID}.mlst.json.gz",
+                  content=b"corrupt")
+            with tempfile.TemporaryDirectory() as tmp:
+                with TarShardWriter(Path(tmp), lambda id: Path(id)) as writer, \
+                        BakrepDownloader(retry=NO_RETRY) as d:
+                    d.download(ID, [{"tool": "gtdbtk"}], writer)
+                    with self.assertRaises(DownloadFailedException):
+                        d.download(ID, [{"tool": "mlst"}], writer)
+                    d.download(ID, [{"tool": "checkm2"}], writer)
+                with tarfile.open(Path(tmp) / "results-000001.tar") as tar:
+                    self.assertEqual(tar.getnames(), [f"{ID}/{ID}.gtdbtk.json.gz", f"{ID}/{ID}.checkm2.json.gz"])
+                    self.assertEqual(cast(IO[bytes], tar.extractfile(f"{ID}/{ID}.checkm2.json.gz")).read(),
+                                     (FIXTURES / f"{ID}.checkm2.json.gz").read_bytes())
+
+    def test_interrupted_archives_should_be_recovered(self):
+        res = Result("https://example.org/abc/abc.json", {}, "md5", 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TarShardWriter(Path(tmp), lambda id: Path(id))
+            with writer.open("abc", res) as out:
+                out.write(b"abc")
+                out.commit()
+            # the process dies while it streams the next member
+            out = writer.open("abc", Result("https://example.org/abc/abc.fas", {}, "md5", 100))
+            out.write(b"x" * 50)
+            out.shard.file.flush()
+            self.assertTrue((Path(tmp) / "results-000001.tar.part").exists())
+
+            TarShardWriter(Path(tmp), lambda id: Path(id)).close()
+            self.assertFalse((Path(tmp) / "results-000001.tar.part").exists())
+            with tarfile.open(Path(tmp) / "results-000001.tar") as tar:
+                self.assertEqual(tar.getnames(), ["abc/abc.json"])
+            self.assertEqual(PackedResults(Path(tmp)).read("abc", "abc.json"), b"abc")
+
+
+class PackCommandTest(unittest.TestCase):
+    def test_download_should_pack_results(self):
+        with requests_mock.Mocker() as m:
+            for id in ["abc", "xyz"]:
+                mock_dataset(m, id)
+            with tempfile.TemporaryDirectory() as tmp:
+                main(["download", "-e", "abc,xyz", "-d", tmp, "--pack", "1G", "-j", "2"])
+                packed = PackedResults(Path(tmp))
+                self.assertEqual(sorted(packed.ids()), ["abc", "xyz"])
+                self.assertFalse((Path(tmp) / "abc").exists())
+
+
+if __name__ == '__main__':
+    unittest.main()